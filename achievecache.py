@@ -0,0 +1,64 @@
+# achievecache.py
+"""
+In-memory masks of the members' achievements.
+
+The achievements of a member are a bitmask (see ACHIEVEMENT_BITS in
+dbschema.py) read by add_achievement() of the intercogs cog on every
+grant. The masks are kept here rather than in the cog: loading an
+extension executes its module again, so after !reload intercogs the
+cogs that were not reloaded still use the previous module, and two
+caches of the same mask could disagree. This module is never
+reloaded, so every copy of the intercogs module shares these masks.
+
+Author: Elcoyote Solitaire
+"""
+from collections import OrderedDict
+
+
+MAX_CACHED_ACHIEVERS = 10000
+
+
+
+class AchieveMasks:
+    """
+    Achievements' masks of the most recently used members.
+
+    The least recently used members are forgotten past
+    MAX_CACHED_ACHIEVERS.
+    """
+    def __init__(self):
+        self._masks = OrderedDict()
+
+
+    def get(self, server_id, user_id):
+        """
+        Returns the mask of a member (or None if not in memory).
+
+        Args:
+            server_id as guild.id
+            user_id as user.id
+        """
+        key = (server_id, user_id)
+        mask = self._masks.get(key)
+        if mask is not None:
+            self._masks.move_to_end(key)
+        return mask
+
+
+    def put(self, server_id, user_id, mask):
+        """
+        Keeps the mask of a member in memory.
+
+        Args:
+            server_id as guild.id
+            user_id as user.id
+            mask as int
+        """
+        self._masks[(server_id, user_id)] = mask
+        self._masks.move_to_end((server_id, user_id))
+        while len(self._masks) > MAX_CACHED_ACHIEVERS:
+            self._masks.popitem(last=False)
+
+
+
+achieve_masks = AchieveMasks()
@@ -0,0 +1,236 @@
+# auditlog.py
+"""
+Audit log lookups of the servers, shared by the modlogs listeners.
+
+The modlogs need the moderator behind a kick, a ban or a bulk
+deletion. Asking Discord for the audit log on every event costs one
+request per event, so a ban wave of 100 members is 100 requests and
+as many rate limits.
+
+This module keeps, per server, a cursor on the newest audit log
+entry already read and a short index of the recent entries by
+(action, target_id). A lookup that misses the index fetches the
+entries newer than the cursor (one page, every action at once) and
+every lookup waiting meanwhile uses that same fetch:
+
+    entry = await find_audit_entry(guild, discord.AuditLogAction.ban, user.id)
+
+The entries created while the bot is connected are also indexed
+from the gateway (on_audit_log_entry_create of the modlogs), which
+spares the fetch when they arrive before the event. discord.py only
+fills entry.user of those from the member cache, so an entry whose
+moderator is not cached doesn't count as found: the fetch replaces
+it with the entry of Discord, which comes with its user.
+
+The entries show up in the audit log a little after the gateway
+event. A lookup for an action known to have happened (a ban, a bulk
+deletion) tries once more after AUDIT_RETRY_DELAY when it still
+misses; a lookup that may have no entry (the kick behind a member
+leaving) only fetches once.
+
+Author: Elcoyote Solitaire
+"""
+import asyncio
+import time
+import discord
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+# entries fetched per request (the maximum of Discord)
+AUDIT_PAGE_SIZE = 100
+# seconds an entry can match an event
+AUDIT_MAX_AGE = 60
+# entries kept per server
+AUDIT_INDEX_SIZE = 500
+# seconds before the second fetch of a lookup that missed
+AUDIT_RETRY_DELAY = 1.5
+
+
+
+class GuildAuditLog:
+    """
+    Cursor and index of the audit log of a single server.
+    """
+    def __init__(self):
+        self.cursor = None
+        self.index = OrderedDict()
+        self.lock = asyncio.Lock()
+        self.fetched_at = 0.0
+
+
+    def add(self, entry, move_cursor=True):
+        """
+        Indexes an entry by (action, target_id), the newest wins.
+
+        Args:
+            entry as discord.AuditLogEntry
+            move_cursor as bool, False for the entries of the gateway
+            since the ones sent while disconnected are still unread
+        """
+        key = (entry.action, getattr(entry.target, "id", None))
+        indexed = self.index.get(key)
+        if indexed is None or indexed.id <= entry.id:
+            self.index[key] = entry
+            self.index.move_to_end(key)
+        if move_cursor and (self.cursor is None or entry.id > self.cursor):
+            self.cursor = entry.id
+
+
+    def prune(self):
+        """
+        Forgets the entries too old to match an event, and the
+        oldest ones above AUDIT_INDEX_SIZE.
+        """
+        oldest = datetime.now(timezone.utc) - timedelta(seconds=AUDIT_MAX_AGE)
+        for key, entry in list(self.index.items()):
+            if entry.created_at < oldest or len(self.index) > AUDIT_INDEX_SIZE:
+                del self.index[key]
+
+
+    def find(self, action, target_id):
+        """
+        Returns the recent entry of an action on a target (or None).
+
+        Args:
+            action as discord.AuditLogAction
+            target_id as the ID of the target (member, channel...)
+        """
+        entry = self.index.get((action, target_id))
+        if entry is None or (entry.user is None and entry.user_id is not None):
+            return None
+        if datetime.now(timezone.utc) - entry.created_at > timedelta(seconds=AUDIT_MAX_AGE):
+            return None
+        return entry
+
+
+
+class AuditLogService:
+    """
+    Audit log lookups of every server.
+    """
+    def __init__(self):
+        self._guilds = {}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetched_entries = 0
+
+
+    async def fetch(self, guild, state, key, requested_at):
+        """
+        Reads the entries newer than the cursor of a server.
+
+        The fetch is skipped when the fetch of another lookup found
+        the entry, or started after this lookup asked.
+
+        Args:
+            guild as discord.Guild
+            state as GuildAuditLog
+            key as (action, target_id) of the lookup
+            requested_at as time.monotonic() of the lookup
+        """
+        async with state.lock:
+            if state.fetched_at >= requested_at or state.find(*key) is not None:
+                return
+            now = time.monotonic()
+            # after a long pause, only the newest page can still match
+            if now - state.fetched_at > AUDIT_MAX_AGE:
+                state.cursor = None
+            state.fetched_at = now
+            self.fetches += 1
+            after = discord.Object(id=state.cursor) if state.cursor else None
+            entries = [
+                entry async for entry in guild.audit_logs(limit=AUDIT_PAGE_SIZE, after=after)
+            ]
+            for entry in sorted(entries, key=lambda entry: entry.id):
+                state.add(entry)
+            self.fetched_entries += len(entries)
+            state.prune()
+
+
+    def record(self, entry):
+        """
+        Indexes an entry received from the gateway.
+
+        Args:
+            entry as discord.AuditLogEntry
+        """
+        state = self._guilds.setdefault(entry.guild.id, GuildAuditLog())
+        state.add(entry, move_cursor=False)
+        state.prune()
+
+
+    async def find(self, guild, action, target_id, retry=False):
+        """
+        Returns the recent audit log entry of an action on a target.
+
+        Args:
+            guild as discord.Guild
+            action as discord.AuditLogAction
+            target_id as the ID of the target (member, channel...)
+            retry as bool, True to fetch again after AUDIT_RETRY_DELAY
+            when the action surely has an entry
+
+        Returns:
+            discord.AuditLogEntry, or None if there is none or the
+            bot can't view the audit log
+        """
+        if not guild.me.guild_permissions.view_audit_log:
+            return None
+        state = self._guilds.setdefault(guild.id, GuildAuditLog())
+        entry = state.find(action, target_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        for attempt in range(2 if retry else 1):
+            if attempt:
+                await asyncio.sleep(AUDIT_RETRY_DELAY)
+            try:
+                await self.fetch(guild, state, (action, target_id), time.monotonic())
+            except discord.HTTPException as err_audit:
+                print(f"Error reading the audit log of {guild.id}: {err_audit}")
+                return None
+            entry = state.find(action, target_id)
+            if entry is not None:
+                return entry
+        return None
+
+
+    def forget(self, server_id):
+        """
+        Drops the cursor and the index of a server.
+
+        Args:
+            server_id as guild.id
+        """
+        self._guilds.pop(server_id, None)
+
+
+    def stats(self):
+        """
+        Returns the counters of the lookups.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "guilds": len(self._guilds),
+            "entries": sum(len(state.index) for state in self._guilds.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "fetches": self.fetches,
+            "fetched_entries": self.fetched_entries
+        }
+
+
+
+audit_log = AuditLogService()
+
+
+async def find_audit_entry(guild, action, target_id, retry=False):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await audit_log.find(guild, action, target_id, retry)
@@ -0,0 +1,32 @@
+# boardcache.py
+"""
+Snapshots of the boards (level, leader, achieve and battle).
+
+The boards are generated by the intercogs cog (see get_board()),
+but their snapshots are kept here. The cogs can be reloaded with
+!reload, and loading an extension executes its module again: after
+!reload intercogs, the cogs that were not reloaded still call the
+mark_board_dirty() of the previous module. This module is never
+reloaded, so every copy of the intercogs module shares the same
+snapshots, flags and rebuilds.
+
+Author: Elcoyote Solitaire
+"""
+
+
+
+class BoardCache:
+    """
+    Snapshots of the boards of every server.
+    """
+    def __init__(self):
+        # {(server_id, board): (embed, time built)}
+        self.snapshots = {}
+        # (server_id, board) changed since their snapshot
+        self.dirty = set()
+        # {(server_id, board): asyncio.Task} of the background rebuilds
+        self.rebuilds = {}
+
+
+
+board_cache = BoardCache()
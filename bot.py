@@ -8,6 +8,7 @@ main configuration. In your command terminal, type: python bot.py
 Author: Elcoyote Solitaire
 """
 import os
+import asyncio
 import logging
 import logging.handlers
 import json
@@ -21,7 +22,12 @@ from datetime import datetime
 from dotenv import load_dotenv
 from discord import app_commands
 from discord.ext import commands, tasks
-from cogs.intercogs import add_achievement
+from cachepolicy import cache_policy
+from cluster import ClusterHub, cluster_client
+from dbmanager import db_manager
+from guildconfig import preload_configs
+from messagestore import message_store
+from startup import load_extensions, print_report
 
 
 def load_configs():
@@ -35,6 +41,9 @@ def load_configs():
             [status_interval_minutes]
             [custom_statuses]
             [playing_statuses]
+            [database] (see DEFAULT_SETTINGS in dbmanager.py)
+            [sharding] (shard_count and shard_ids, null for automatic)
+            [cache] (see DEFAULT_SETTINGS in cachepolicy.py)
     """
     with open("config.json", "r", encoding="utf-8") as jsonfile:
         config = json.load(jsonfile)
@@ -55,13 +64,22 @@ intents.members = True
 
 
 
-class MyBot(commands.Bot):
+class MyBot(commands.AutoShardedBot):
     """
     Custom Discord bot class.
 
-    This class extends the commands.Bot class to provide additional functionality.
+    This class extends the commands.AutoShardedBot class to provide additional functionality.
     This is a setup to override the setup_hook to includes specific asyncs and loops.
 
+    The shards come from "sharding" in config.json: with a null
+    shard_count, Discord recommends the amount of shards (a single
+    one for a small bot). shard_ids selects the shards run by this
+    process, and then needs the shard_count.
+
+    The cache of the members and messages comes from "cache" in
+    config.json (see cachepolicy.py): the servers are not chunked
+    before the bot is ready, only the small ones are afterwards.
+
     Args:
         command_prefix (str): The prefix for bot commands.
         intents (discord.Intents): The intents for the bot.
@@ -70,41 +88,56 @@ class MyBot(commands.Bot):
     def __init__(self, config, status_interval, help_command=None):
         self.config = config
         self.status_interval = status_interval
+        db_manager.configure(config.get("database", {}))
+        cache_policy.configure(config.get("cache", {}))
+        message_store.configure(cache_policy.settings["message_store"])
+        sharding = config.get("sharding", {})
         super().__init__(
             command_prefix=commands.when_mentioned_or(config["prefix"]),
-            intents=intents
+            intents=intents,
+            shard_count=sharding.get("shard_count"),
+            shard_ids=sharding.get("shard_ids"),
+            **cache_policy.client_options()
         )
+        self.chunk_task = None
+        self.preload_task = None
         self.original_app_error = self.tree.on_error
         self.tree.on_error = self.on_app_command_error
 
-    
-    def count_lines(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            line_count = sum(1 for line in file)
-        return line_count
-
 
     async def setup_hook(self) -> None:
         """
         Overriding the normal setup_hook.
+
+        The cogs are loaded by startup.py, which prints the time
+        spent importing every cog.
         """
-        totallines = 0
-        totalextensions = 0
-        print("\n-----EXTENSIONS-----")
-        for file in os.listdir("./cogs"):
-            if file.endswith(".py"):
-                extension = file[:-3]
-                try:
-                    await self.load_extension(f"cogs.{extension}")
-                    extension_file_path = os.path.join("./cogs", file)
-                    lines = self.count_lines(extension_file_path)
-                    print(f"Loaded extension '{extension}' ({lines} lines)")
-                    totallines += lines
-                    totalextensions += 1
-                except commands.ExtensionFailed as extension_failed:
-                    exception = f"{type(extension_failed).__name__}: {extension_failed}"
-                    print(f"Failed to load extension {extension}\n{exception}")
-        print(f"¤¤¤ {totallines} lines of codes for {totalextensions} extensions ¤¤¤")
+        cluster_client.start()
+        report, elapsed = await load_extensions(self)
+        print_report(report, elapsed)
+        checkpoint_interval = db_manager.settings["checkpoint_interval_minutes"]
+        if checkpoint_interval > 0:
+            self.checkpoint_task.change_interval(minutes=checkpoint_interval)
+            self.checkpoint_task.start()
+
+
+    def shard_latencies(self):
+        """
+        Returns the latency of every shard of this process, as text.
+        """
+        return ", ".join(
+            f"shard {shard_id}: {round(latency * 1000)}ms"
+            for shard_id, latency in self.latencies
+        )
+
+
+    async def on_shard_ready(self, shard_id):
+        """
+        Print the shard that is ready, with its servers and latency.
+        """
+        guilds = sum(1 for guild in self.guilds if guild.shard_id == shard_id)
+        latency = self.get_shard(shard_id).latency
+        print(f"Shard {shard_id} ready ({guilds} servers, ping:{round(latency * 1000)}ms)")
 
 
     async def on_ready(self):
@@ -118,12 +151,62 @@ class MyBot(commands.Bot):
         print(f"Running on: {platform.system()} {platform.release()} ({os.name})")
         print("\n-----BOT NAME-----")
         print(f"{self.user.name} (ping:{round(self.latency * 1000)}ms)")
+        print(
+            f"{self.shard_count} shards, running {sorted(self.shards)} "
+            f"(cluster {cluster_client.cluster_id + 1}/{cluster_client.clusters})"
+        )
+        print(self.shard_latencies())
         print("\n-----SERVERS-----")
         for guild in activeservers:
-            print(f"- {guild.name} (ID: {guild.id}) ({guild.member_count} members)")
+            print(
+                f"- {guild.name} (ID: {guild.id}) ({guild.member_count} members) "
+                f"(shard {guild.shard_id})"
+            )
         print("-------------------")
         print("Bot is now online and ready")
-        self.status_task.start()
+        if not self.status_task.is_running():
+            self.status_task.start()
+        if self.chunk_task is None or self.chunk_task.done():
+            # the servers logging the members first (see cachepolicy.py)
+            self.chunk_task = asyncio.create_task(cache_policy.chunk_startup_guilds(self.guilds))
+        if self.preload_task is None:
+            # completes the setup index of guildconfig.py (see on_user_update)
+            self.preload_task = asyncio.create_task(
+                preload_configs([guild.id for guild in self.guilds])
+            )
+
+
+    async def on_guild_join(self, guild):
+        """
+        Chunks a new server if it is small enough (see cachepolicy.py).
+        """
+        await cache_policy.chunk_small_guilds([guild])
+
+
+    async def close(self):
+        """
+        Closes the servers' database connections before logging out.
+        """
+        if self.checkpoint_task.is_running():
+            self.checkpoint_task.cancel()
+        await super().close()
+        db_manager.close_all()
+
+
+    @tasks.loop(minutes=5)
+    async def checkpoint_task(self):
+        """
+        Checkpoints the servers' databases in the background.
+
+        With the WAL journal, the automatic checkpoints are disabled
+        (wal_autocheckpoint in config.json) so no listener has to wait
+        for one during a commit. This task does them instead, at the
+        interval set by checkpoint_interval_minutes.
+        """
+        try:
+            await db_manager.checkpoint_all()
+        except Exception as err_checkpoint:
+            print(f"Error during the databases' checkpoint: {err_checkpoint}")
 
 
     @tasks.loop(minutes=10)
@@ -148,6 +231,7 @@ class MyBot(commands.Bot):
                 await self.change_presence(
                     activity=discord.CustomActivity(name=random.choice(statuses))
                 )
+        print(f"{datetime.now().strftime('%H:%M:%S')} - Latency: {self.shard_latencies()}")
 
 
     async def on_app_command_error(
@@ -156,6 +240,9 @@ class MyBot(commands.Bot):
         """
         Global error handler for application commands.
         """
+        # imported here so it comes from the intercogs extension
+        # (loading an extension executes its module again)
+        from cogs.intercogs import add_achievement
         if isinstance(error, app_commands.errors.MissingPermissions):
             await add_achievement(interaction.guild.id, interaction.user.id, "Bold")
             await interaction.response.send_message(
@@ -223,23 +310,13 @@ class MyBot(commands.Bot):
         )
 
 
-def main():
+def create_log_handler(filename):
     """
-    Starts the bot and the logs system (discord.log)
-
-    This part will get the token from the .env file, then
-    use it to log the bot online (bot.run(token)).
-    It also includes a logging script to keep track of any
-    issue that the bot could encounter, which is crucial 
-    for development.
+    Creates the logs system of discord.py in a rotating file.
 
-    There's also a setup for the status intervals, which is
-    10 minutes per default, but can be changed in the file
-    config.json.
+    Args:
+        filename as str
     """
-    load_dotenv()
-    token = os.getenv('DISCORD_TOKEN')
-
     logger = logging.getLogger('discord')
     logger.setLevel(logging.WARNING)
     logging.getLogger('discord.http').setLevel(logging.WARNING)
@@ -247,7 +324,7 @@ def main():
     #useless log entries in the discord.log file
 
     handler = logging.handlers.RotatingFileHandler(
-        filename='discord.log',
+        filename=filename,
         encoding='utf-8',
         maxBytes=32 * 1024 * 1024,  #32 MiB
         backupCount=5,  #Rotate through 5 files
@@ -258,12 +335,81 @@ def main():
     )
     handler.setFormatter(formatter)
     logger.addHandler(handler)
+    return handler
+
+
+async def recommended_shards(token):
+    """
+    Asks Discord for the amount of shards recommended for the bot.
+
+    Args:
+        token as str
+    """
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        return (await http.get_bot_gateway())[0]
+    finally:
+        await http.close()
+
+
+def run_cluster(cluster_id, shard_ids, clusters, conn, shard_count):
+    """
+    Starts the bot in a cluster process, for its range of shards.
+
+    Every cluster logs in its own file (discord-cluster<id>.log).
+
+    Args:
+        cluster_id as int
+        shard_ids as list of int
+        clusters as int for the amount of clusters
+        conn as multiprocessing.connection.Connection to the hub
+        shard_count as int for the shards of every cluster
+    """
+    load_dotenv()
+    token = os.getenv('DISCORD_TOKEN')
+    handler = create_log_handler(f"discord-cluster{cluster_id}.log")
     config = load_configs()
+    config["sharding"] = {"shard_count": shard_count, "shard_ids": shard_ids}
+    cluster_client.connect(cluster_id, clusters, conn)
     status_interval = config.get("status_interval_minutes", 10)
     bot = MyBot(config, status_interval)
     bot.run(token, log_handler=handler)
 
 
+def main():
+    """
+    Starts the bot and the logs system (discord.log)
+
+    This part will get the token from the .env file, then
+    use it to log the bot online (bot.run(token)).
+    It also includes a logging script to keep track of any
+    issue that the bot could encounter, which is crucial 
+    for development.
+
+    There's also a setup for the status intervals, which is
+    10 minutes per default, but can be changed in the file
+    config.json.
+
+    With "clusters" above 1 in the sharding settings, the shards
+    are split between that many processes instead (see cluster.py)
+    and this process only relays the requests between them.
+    """
+    load_dotenv()
+    token = os.getenv('DISCORD_TOKEN')
+    config = load_configs()
+    sharding = config.get("sharding", {})
+    clusters = sharding.get("clusters", 1)
+    if clusters > 1:
+        shard_count = sharding.get("shard_count") or asyncio.run(recommended_shards(token))
+        ClusterHub(run_cluster, shard_count, clusters, (shard_count,)).run()
+        return
+
+    handler = create_log_handler('discord.log')
+    status_interval = config.get("status_interval_minutes", 10)
+    bot = MyBot(config, status_interval)
+    bot.run(token, log_handler=handler)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,284 @@
+# cachepolicy.py
+"""
+Cache policy of discord.py for the members and the messages.
+
+With the members intent and the defaults of discord.py, every server
+is chunked (all of its members downloaded) before the bot is ready,
+and every member stays in memory. On large servers, that is most of
+the startup time and most of the memory of the bot.
+
+The "cache" section of config.json (see DEFAULT_SETTINGS) sets:
+
+- chunk_threshold: the servers up to that amount of members are
+  chunked in the background once the bot is ready, the bigger ones
+  only when a feature needs their whole member list (ensure_chunked);
+- member_cache: the MemberCacheFlags (joined, voice) of discord.py;
+- max_messages: the size of the message cache (null to disable it);
+- message_store: the budgets in bytes of the compact records of the
+  messages used by the modlogs, per server and in total (see
+  messagestore.py).
+
+Since a member may not be cached, the cogs use resolve_member(),
+which falls back to fetching the member from Discord, and
+count_bots(), which downloads the members of a big server without
+caching them.
+
+Some events of discord.py still need a cached member: on_member_update
+(and the "before" of the change), the mutual servers of
+on_user_update, and the roles and join date of the leave embed. The
+servers with one of MEMBER_LOG_CHANNELS in their setup are therefore
+chunked whatever their size, first at startup (chunk_startup_guilds)
+and when /setchan adds one of those channels.
+
+Author: Elcoyote Solitaire
+"""
+import asyncio
+import sys
+import discord
+
+from guildconfig import guilds_with_setup
+
+
+DEFAULT_SETTINGS = {
+    "chunk_threshold": 1000,
+    "member_cache": {"joined": True, "voice": True},
+    "max_messages": 1000,
+    "message_store": {"guild_bytes": 262144, "total_bytes": 67108864}
+}
+MEMBER_CACHE_FLAGS = ("joined", "voice")
+# setup entries of the logs reading the cached members (see above)
+MEMBER_LOG_CHANNELS = ("lefts", "users")
+
+
+
+class CachePolicy:
+    """
+    Chunking of the servers and resolution of the members.
+    """
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._chunk_locks = {}
+        self.chunked_on_demand = 0
+        self.fetched_members = 0
+
+
+    def configure(self, settings):
+        """
+        Applies the "cache" section of config.json.
+
+        Missing keys keep their DEFAULT_SETTINGS value.
+
+        Args:
+            settings as dict
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update(settings or {})
+        flags = dict(DEFAULT_SETTINGS["member_cache"])
+        flags.update(merged["member_cache"] or {})
+        unknown = set(flags) - set(MEMBER_CACHE_FLAGS)
+        if unknown:
+            raise ValueError(f"Invalid member_cache in config.json: {sorted(unknown)}")
+        merged["member_cache"] = {flag: bool(value) for flag, value in flags.items()}
+        merged["chunk_threshold"] = int(merged["chunk_threshold"])
+        store = dict(DEFAULT_SETTINGS["message_store"])
+        store.update(merged["message_store"] or {})
+        merged["message_store"] = store
+        if merged["max_messages"] is not None:
+            merged["max_messages"] = int(merged["max_messages"])
+        self.settings = merged
+
+
+    def client_options(self):
+        """
+        Returns the cache options of discord.Client.
+        """
+        return {
+            "chunk_guilds_at_startup": False,
+            "member_cache_flags": discord.MemberCacheFlags(**self.settings["member_cache"]),
+            "max_messages": self.settings["max_messages"]
+        }
+
+
+    def is_small(self, guild):
+        """
+        Verify if a server is chunked in the background.
+
+        Args:
+            guild as discord.Guild
+        """
+        return (guild.member_count or 0) <= self.settings["chunk_threshold"]
+
+
+    async def ensure_chunked(self, guild):
+        """
+        Downloads the members of a server if it was not done yet.
+
+        Args:
+            guild as discord.Guild
+        """
+        if guild.chunked:
+            return
+        lock = self._chunk_locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            if not guild.chunked:
+                await guild.chunk(cache=True)
+                if not self.is_small(guild):
+                    self.chunked_on_demand += 1
+
+
+    async def count_bots(self, guild):
+        """
+        Returns the amount of bots of a server.
+
+        The small servers are chunked and counted from the cache.
+        The members of a big server that is not chunked are
+        downloaded without being cached, which takes the time of a
+        chunk but keeps the memory of the cache.
+
+        Args:
+            guild as discord.Guild
+        """
+        if self.is_small(guild):
+            await self.ensure_chunked(guild)
+        members = guild.members if guild.chunked else await guild.chunk(cache=False)
+        return sum(member.bot for member in members)
+
+
+    async def chunk_guilds(self, guilds):
+        """
+        Chunks servers one after the other.
+
+        Args:
+            guilds as list of discord.Guild
+        """
+        for guild in guilds:
+            if not guild.chunked:
+                try:
+                    await self.ensure_chunked(guild)
+                except Exception as err_chunk:
+                    print(f"Error chunking {guild.id}: {err_chunk}")
+
+
+    async def chunk_small_guilds(self, guilds):
+        """
+        Chunks the small servers one after the other.
+
+        Args:
+            guilds as list of discord.Guild
+        """
+        await self.chunk_guilds([guild for guild in guilds if self.is_small(guild)])
+
+
+    async def chunk_startup_guilds(self, guilds):
+        """
+        Chunks the servers logging the members, then the small ones.
+
+        Args:
+            guilds as list of discord.Guild
+        """
+        logged = set()
+        for chans in MEMBER_LOG_CHANNELS:
+            logged.update(await guilds_with_setup(chans, [guild.id for guild in guilds]))
+        await self.chunk_guilds([guild for guild in guilds if guild.id in logged])
+        await self.chunk_small_guilds(guilds)
+
+
+    async def resolve_member(self, guild, user_id):
+        """
+        Returns a member of a server, from the cache or from Discord.
+
+        Args:
+            guild as discord.Guild
+            user_id as member.id
+
+        Returns:
+            discord.Member, or None if the user is not a member
+        """
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+        except discord.HTTPException as err_fetch:
+            print(f"Error fetching member {user_id} of {guild.id}: {err_fetch}")
+            return None
+        self.fetched_members += 1
+        return member
+
+
+    def report(self, bot, top=10):
+        """
+        Returns the sizes of the caches, with the biggest servers.
+
+        Args:
+            bot as discord.Client
+            top as int for the amount of servers listed
+
+        Returns:
+            dict of the totals and of the servers
+        """
+        guilds = sorted(bot.guilds, key=lambda guild: len(guild.members), reverse=True)
+        return {
+            "guilds": len(bot.guilds),
+            "chunked": sum(1 for guild in bot.guilds if guild.chunked),
+            "chunked_on_demand": self.chunked_on_demand,
+            "cached_members": sum(len(guild.members) for guild in bot.guilds),
+            "members": sum(guild.member_count or 0 for guild in bot.guilds),
+            "users": len(bot.users),
+            "messages": len(bot.cached_messages),
+            "fetched_members": self.fetched_members,
+            "max_rss_mb": max_rss_mb(),
+            "top": [
+                {
+                    "name": guild.name,
+                    "id": guild.id,
+                    "cached_members": len(guild.members),
+                    "members": guild.member_count or 0,
+                    "channels": len(guild.channels),
+                    "roles": len(guild.roles),
+                    "chunked": guild.chunked
+                }
+                for guild in guilds[:top]
+            ]
+        }
+
+
+
+def max_rss_mb():
+    """
+    Returns the peak memory of the process in MB (None on Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+
+cache_policy = CachePolicy()
+
+
+async def resolve_member(guild, user_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await cache_policy.resolve_member(guild, user_id)
+
+
+async def ensure_chunked(guild):
+    """
+    Mirror function to be imported in cogs.
+    """
+    await cache_policy.ensure_chunked(guild)
+
+
+async def count_bots(guild):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await cache_policy.count_bots(guild)
@@ -0,0 +1,432 @@
+# cluster.py
+"""
+Cluster of processes for the shards of the bot.
+
+A single process runs every shard of the bot on a single core. With
+"clusters" above 1 in the sharding settings of config.json, bot.py
+starts one process per cluster instead, each one owning a contiguous
+range of shards (see shard_ranges()). The first process stays as the
+hub between the clusters and restarts a cluster that stops.
+
+The clusters talk to the hub through multiprocessing pipes. A cluster
+sends a request to the hub, the hub sends it to every cluster (the
+one asking included) and gives back the results once all of them
+replied:
+
+    for cluster_id, success, result in await broadcast("showcogs"):
+        ...
+
+The cogs register the handlers of the requests in cog_load():
+
+    register_handler("showcogs", self.local_cogs)
+
+where a handler is an async function taking the arguments of the
+request and returning something that can be pickled. Without
+clusters, broadcast() runs the handler of this process, so the cogs
+use the same code either way.
+
+Author: Elcoyote Solitaire
+"""
+import asyncio
+import itertools
+import multiprocessing
+import threading
+import time
+
+from multiprocessing.connection import wait
+
+
+# seconds a broadcast waits for every cluster to reply
+IPC_TIMEOUT = 30
+# seconds before the hub starts a cluster that stopped
+CLUSTER_RESTART_DELAY = 10
+
+
+def shard_ranges(shard_count, clusters):
+    """
+    Splits the shards in contiguous ranges, one per cluster.
+
+    Args:
+        shard_count as int
+        clusters as int
+
+    Returns:
+        list of list of shard IDs
+    """
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for cluster_id in range(clusters):
+        end = start + size + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+
+class ClusterClient:
+    """
+    Side of a cluster: sends the requests and runs the handlers.
+
+    The pipe is read by a thread, which hands every message to the
+    event loop. The pipe is only written from the event loop.
+    """
+    def __init__(self):
+        self.cluster_id = 0
+        self.clusters = 1
+        self._conn = None
+        self._loop = None
+        self._handlers = {}
+        self._pending = {}
+        self._request_ids = itertools.count()
+
+
+    def connect(self, cluster_id, clusters, conn):
+        """
+        Makes this process a cluster, before the bot starts.
+
+        Args:
+            cluster_id as int
+            clusters as int for the amount of clusters
+            conn as multiprocessing.connection.Connection to the hub
+        """
+        self.cluster_id = cluster_id
+        self.clusters = clusters
+        self._conn = conn
+
+
+    def start(self):
+        """
+        Starts reading the pipe, from the event loop of the bot.
+        """
+        if self._conn is None or self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(
+            target=self._read, name=f"cluster-{self.cluster_id}-ipc", daemon=True
+        ).start()
+
+
+    def register(self, name, handler):
+        """
+        Adds the handler of a request, replacing the previous one.
+
+        Args:
+            name as str
+            handler as async function taking the arguments
+        """
+        self._handlers[name] = handler
+
+
+    def unregister(self, name):
+        """
+        Removes the handler of a request.
+
+        Args:
+            name as str
+        """
+        self._handlers.pop(name, None)
+
+
+    async def broadcast(self, name, args=None, timeout=IPC_TIMEOUT):
+        """
+        Runs a request on every cluster.
+
+        Args:
+            name as str
+            args as anything that can be pickled
+            timeout as seconds
+
+        Returns:
+            list of (cluster_id, success, result), by cluster_id;
+            the result is the error as str when success is False
+
+        Raises:
+            asyncio.TimeoutError: If a cluster did not reply in time.
+        """
+        if self._conn is None:
+            success, result = await self._run(name, args)
+            return [(self.cluster_id, success, result)]
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        try:
+            self._conn.send(("request", request_id, name, args))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+
+    async def _run(self, name, args):
+        """
+        Runs the handler of this process for a request.
+
+        Args:
+            name as str
+            args as the arguments of the request
+        """
+        handler = self._handlers.get(name)
+        if handler is None:
+            return False, f"No handler for {name}"
+        try:
+            return True, await handler(args)
+        except Exception as err_handler:
+            return False, f"{type(err_handler).__name__}: {err_handler}"
+
+
+    async def _reply(self, key, name, args):
+        """
+        Runs a request sent by the hub and sends back the result.
+
+        Args:
+            key as the key of the request in the hub
+            name as str
+            args as the arguments of the request
+        """
+        success, result = await self._run(name, args)
+        try:
+            self._conn.send(("reply", key, self.cluster_id, success, result))
+        except (OSError, EOFError):
+            pass
+        except Exception as err_send:
+            self._conn.send(("reply", key, self.cluster_id, False, f"Can't send: {err_send}"))
+
+
+    def _received(self, message):
+        """
+        Handles a message from the hub, in the event loop.
+
+        Args:
+            message as tuple
+        """
+        if message[0] == "call":
+            _, key, name, args = message
+            self._loop.create_task(self._reply(key, name, args))
+        elif message[0] == "result":
+            _, request_id, results = message
+            future = self._pending.get(request_id)
+            if future is not None and not future.done():
+                future.set_result(results)
+
+
+    def _read(self):
+        """
+        Reads the pipe until the hub is gone (thread).
+        """
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                print(f"Cluster {self.cluster_id}: the hub is gone.")
+                return
+            self._loop.call_soon_threadsafe(self._received, message)
+
+
+
+class ClusterHub:
+    """
+    Side of the hub: starts the clusters and relays their requests.
+
+    Args:
+        target as function run by every cluster, called with
+            (cluster_id, shard_ids, clusters, conn, *args)
+        shard_count as int
+        clusters as int
+        args as tuple of extra arguments for target
+    """
+    def __init__(self, target, shard_count, clusters, args=()):
+        self.target = target
+        self.ranges = shard_ranges(shard_count, clusters)
+        self.args = args
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {}
+        self._conns = {}
+        self._restarts = {}
+        self._pending = {}
+
+
+    def spawn(self, cluster_id):
+        """
+        Starts the process of a cluster.
+
+        Args:
+            cluster_id as int
+        """
+        hub_conn, cluster_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=self.target,
+            args=(cluster_id, self.ranges[cluster_id], len(self.ranges), cluster_conn, *self.args),
+            name=f"cluster-{cluster_id}"
+        )
+        process.start()
+        cluster_conn.close()
+        self._processes[cluster_id] = process
+        self._conns[cluster_id] = hub_conn
+        print(f"Cluster {cluster_id} started (shards {self.ranges[cluster_id]}, pid {process.pid})")
+
+
+    def run(self):
+        """
+        Starts every cluster and relays their requests until stopped.
+        """
+        for cluster_id in range(len(self.ranges)):
+            self.spawn(cluster_id)
+        try:
+            while True:
+                for conn in wait(list(self._conns.values()), timeout=1):
+                    cluster_id = self._cluster_of(conn)
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        self._stopped(cluster_id)
+                        continue
+                    self._handle(cluster_id, message)
+                self._watch()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+    def stop(self):
+        """
+        Stops every cluster.
+        """
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(timeout=10)
+
+
+    def _cluster_of(self, conn):
+        """
+        Returns the cluster ID of a pipe.
+
+        Args:
+            conn as multiprocessing.connection.Connection
+        """
+        for cluster_id, cluster_conn in self._conns.items():
+            if cluster_conn is conn:
+                return cluster_id
+        return None
+
+
+    def _send(self, cluster_id, message):
+        """
+        Sends a message to a cluster, False if it is gone.
+
+        Args:
+            cluster_id as int
+            message as tuple
+        """
+        conn = self._conns.get(cluster_id)
+        if conn is None:
+            return False
+        try:
+            conn.send(message)
+        except (OSError, EOFError):
+            return False
+        return True
+
+
+    def _handle(self, cluster_id, message):
+        """
+        Relays a request or a reply.
+
+        Args:
+            cluster_id as int for the sender
+            message as tuple
+        """
+        if message[0] == "request":
+            _, request_id, name, args = message
+            key = (cluster_id, request_id)
+            self._pending[key] = {"waiting": set(), "results": []}
+            for target_id in list(self._conns):
+                if self._send(target_id, ("call", key, name, args)):
+                    self._pending[key]["waiting"].add(target_id)
+                else:
+                    self._pending[key]["results"].append((target_id, False, "Cluster down"))
+            self._complete(key)
+        elif message[0] == "reply":
+            _, key, replier_id, success, result = message
+            pending = self._pending.get(key)
+            if pending is not None and replier_id in pending["waiting"]:
+                pending["waiting"].discard(replier_id)
+                pending["results"].append((replier_id, success, result))
+                self._complete(key)
+
+
+    def _complete(self, key):
+        """
+        Sends the results of a request once every cluster replied.
+
+        Args:
+            key as (cluster_id, request_id)
+        """
+        pending = self._pending[key]
+        if pending["waiting"]:
+            return
+        del self._pending[key]
+        origin_id, request_id = key
+        self._send(origin_id, ("result", request_id, sorted(pending["results"])))
+
+
+    def _stopped(self, cluster_id):
+        """
+        Forgets a cluster that stopped and plans its restart.
+
+        Args:
+            cluster_id as int
+        """
+        conn = self._conns.pop(cluster_id, None)
+        if conn is None:
+            return
+        conn.close()
+        print(f"Cluster {cluster_id} stopped, restart in {CLUSTER_RESTART_DELAY} seconds.")
+        self._restarts[cluster_id] = time.monotonic() + CLUSTER_RESTART_DELAY
+        for key, pending in list(self._pending.items()):
+            if cluster_id in pending["waiting"]:
+                pending["waiting"].discard(cluster_id)
+                pending["results"].append((cluster_id, False, "Cluster down"))
+                self._complete(key)
+
+
+    def _watch(self):
+        """
+        Notices the clusters that stopped and restarts them.
+        """
+        for cluster_id, process in self._processes.items():
+            if cluster_id in self._conns and not process.is_alive():
+                self._stopped(cluster_id)
+        now = time.monotonic()
+        for cluster_id, restart_at in list(self._restarts.items()):
+            if restart_at <= now:
+                del self._restarts[cluster_id]
+                self.spawn(cluster_id)
+
+
+
+cluster_client = ClusterClient()
+
+
+async def broadcast(name, args=None, timeout=IPC_TIMEOUT):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await cluster_client.broadcast(name, args, timeout)
+
+
+def register_handler(name, handler):
+    """
+    Mirror function to be imported in cogs.
+    """
+    cluster_client.register(name, handler)
+
+
+def unregister_handler(name):
+    """
+    Mirror function to be imported in cogs.
+    """
+    cluster_client.unregister(name)
@@ -7,15 +7,19 @@ Author: Elcoyote Solitaire
 import os
 import datetime
 import shutil
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import matplotlib.dates as mdates
 import discord
 
 from discord import app_commands, Interaction
 from discord.app_commands import Choice
 from discord.ext import commands, tasks
-from cogs.intercogs import get_server_database, get_time_zone
+from cogs.intercogs import get_time_zone, get_setup_chan_id, shard_guilds
+from startup import lazy_import
+
+
+# imported on the first plot (see startup.py)
+plt = lazy_import("matplotlib.pyplot")
+ticker = lazy_import("matplotlib.ticker")
+mdates = lazy_import("matplotlib.dates")
 
 
 
@@ -78,12 +82,7 @@ class Analysis(commands.Cog, name="analysis"):
         """
         Returns the channel ID of analysis if there's one
         """
-        conn, cur = get_server_database(guild_id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("analysis",))
-        row = cur.fetchone()
-        conn.close()
-        analysis_chan_id = row[0] if row else None
-        return analysis_chan_id
+        return await get_setup_chan_id(guild_id, "analysis")
 
 
     async def create_backup(self, guild_id, guild_dir):
@@ -122,7 +121,7 @@ class Analysis(commands.Cog, name="analysis"):
         This loop tracks online member every 15 minutes
         for every active servers of the bot.
         """
-        for guild in self.bot.guilds:
+        for guild in shard_guilds():
             time_zone = await get_time_zone(guild.id)
             time_stamp = datetime.datetime.now(time_zone)
             timestamp = datetime.datetime.now(time_zone).strftime("%Y-%m-%d %H:%M:%S")
@@ -18,7 +18,8 @@ from discord import app_commands, Interaction
 from discord.ext import commands, tasks
 from discord.utils import get
 from discord.app_commands import Group, command
-from cogs.intercogs import get_server_database, add_achievement
+from cogs.intercogs import get_server_database, add_achievement, shard_guilds
+from guildconfig import get_config, invalidate_config
 
 
 
@@ -120,11 +121,11 @@ class Anniversaries(commands.Cog, name="anniversaries"):
         return None
 
 
-    def hour_chan(self, server_id):
+    async def hour_chan(self, server_id):
         """
         Function to check the hour for the message.
         
-        Verify the database to return the hours and the
+        Verify the server's setup to return the hours and the
         channel to use for the anniversaries messages.
         
         Used by anniversaires_message() function (loop).
@@ -132,18 +133,10 @@ class Anniversaries(commands.Cog, name="anniversaries"):
         Args:
             server_id
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute(
-            "SELECT id FROM setup WHERE chans IN (?, ?) "
-            "ORDER BY CASE chans WHEN ? THEN 0 ELSE 1 END",
-            ("hour", "anniv", "anniv")
-        )
-        rows = cur.fetchall()
-        conn.close()
-        if not rows:
-            return None, None
-        anniv_chan = self.bot.get_channel(rows[0][0]) if rows[0][0] else None
-        msg_hour = rows[1][0] if len(rows) > 1 and rows[1][0] else None
+        config = await get_config(server_id)
+        anniv_id = config.get_setup("anniv")
+        anniv_chan = self.bot.get_channel(anniv_id) if anniv_id else None
+        msg_hour = config.get_setup("hour")
         if anniv_chan and msg_hour:
             return anniv_chan, msg_hour
         return None, None
@@ -160,9 +153,9 @@ class Anniversaries(commands.Cog, name="anniversaries"):
         Args:
             None
         """
-        for guild in self.bot.guilds:
+        for guild in shard_guilds():
             server_id = guild.id
-            anniv_chan, msg_hour = self.hour_chan(server_id)
+            anniv_chan, msg_hour = await self.hour_chan(server_id)
             if msg_hour == datetime.now().hour:
                 month_anniv = self.has_month_anniv(server_id)
                 anniv_ids = self.has_today_anniv(server_id)
@@ -235,6 +228,7 @@ class Anniversaries(commands.Cog, name="anniversaries"):
         )
         conn.commit()
         conn.close()
+        invalidate_config(interaction.guild.id)
         await interaction.response.send_message(
             content=f"Hour for daily anniversary message is set to {hour}h.",
             ephemeral=True
@@ -6,14 +6,18 @@ Used to find informations about books and movies
 
 Author: Elcoyote Solitaire
 """
-import requests
 import discord
 
-from imdb import Cinemagoer
 from discord import app_commands, Interaction
 from discord.app_commands import Group
 from discord.ext import commands
 from cogs.intercogs import add_achievement
+from startup import lazy_import
+
+
+# imported on the first search (see startup.py)
+requests = lazy_import("requests")
+imdb = lazy_import("imdb")
 
 
 
@@ -216,7 +220,7 @@ class Bookmovie(commands.Cog, name="bookmovie"):
             interaction as discord.Interaction
             movie_name as string for the movie's name
         """
-        movies = Cinemagoer().search_movie(movie_name)
+        movies = imdb.Cinemagoer().search_movie(movie_name)
         list_movies = ""
         for movie in movies:
             list_movies += f"{movie}: {movie.movieID}\n"
@@ -238,7 +242,7 @@ class Bookmovie(commands.Cog, name="bookmovie"):
             movie_id as an integer for the movie's ID
         """
         await interaction.response.send_message(content="searching . . . ", ephemeral=True)
-        movie = Cinemagoer().get_movie(movie_id)
+        movie = imdb.Cinemagoer().get_movie(movie_id)
         title = movie["title"]
         year = movie["year"]
         genres = ""
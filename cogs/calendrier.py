@@ -8,18 +8,24 @@ Author: elcoyote solitaire
 """
 import calendar
 import os
-import ephem
-import holidays
 import discord
 
 from datetime import datetime, timedelta
 from typing import List
 from zoneinfo import ZoneInfo
 from dateutil.easter import easter
-from PIL import Image, ImageDraw, ImageFont
 from discord import app_commands, Interaction
 from discord.app_commands import Choice
 from discord.ext import commands
+from startup import lazy_import
+
+
+# imported on the first calendar (see startup.py)
+ephem = lazy_import("ephem")
+holidays = lazy_import("holidays")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
 
 
 
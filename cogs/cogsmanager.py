@@ -12,10 +12,17 @@ sync command from Umbra:
 https://about.abstractumbra.dev/discord.py/2023/01/29/sync-command-example.html
 """
 import os
+import asyncio
 import discord
 
 from typing import Literal, Optional
 from discord.ext import commands
+from auditlog import audit_log
+from cachepolicy import cache_policy
+from cluster import broadcast, cluster_client, register_handler, unregister_handler
+from dbmanager import db_manager
+from messagestore import message_store
+from guildconfig import config_cache
 
 
 
@@ -25,6 +32,9 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
 
     This class contains commands to load, unload and
     reload cogs.
+
+    When the bot runs in clusters (see cluster.py), the commands
+    are sent to every cluster and the replies are put together.
     
     Commands:
         !load
@@ -32,11 +42,174 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
         !reload
         !showcogs
         !sync
+        !cachestats
+        !clusterstats
+        !memstats
     """
     def __init__(self, bot):
         self.bot = bot
 
 
+    async def cog_load(self):
+        register_handler("load", self.load_local)
+        register_handler("unload", self.unload_local)
+        register_handler("reload", self.reload_local)
+        register_handler("showcogs", self.showcogs_local)
+        register_handler("sync", self.sync_local)
+        register_handler("clusterstats", self.clusterstats_local)
+        register_handler("memstats", self.memstats_local)
+
+
+    async def cog_unload(self):
+        for name in ("load", "unload", "reload", "showcogs", "sync", "clusterstats", "memstats"):
+            unregister_handler(name)
+
+
+    async def fan_out(self, ctx, name, args=None):
+        """
+        Runs a request on every cluster (or on this process only).
+
+        Args:
+            ctx as commands.Context
+            name as str for the handler
+            args as the arguments of the handler
+
+        Returns:
+            list of (cluster_id, success, result), or None after
+            telling that a cluster did not reply in time
+        """
+        try:
+            return await broadcast(name, args)
+        except asyncio.TimeoutError:
+            await ctx.send(f"A cluster did not reply in time to {name}.")
+            return None
+
+
+    def cluster_report(self, results, success_text, error_text):
+        """
+        Puts together the replies of the clusters in a message.
+
+        Args:
+            results as list of (cluster_id, success, result)
+            success_text as str
+            error_text as str, followed by the error
+        """
+        lines = []
+        for cluster_id, success, result in results:
+            text = success_text if success else f"{error_text}: {result}"
+            lines.append(text if len(results) == 1 else f"Cluster {cluster_id}: {text}")
+        return "\n".join(lines)
+
+
+    def owns_guild(self, guild_id):
+        """
+        Verify if a guild belongs to a shard of this process.
+
+        Args:
+            guild_id as guild.id
+        """
+        if cluster_client.clusters == 1:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in self.bot.shards
+
+
+    async def load_local(self, cog_name):
+        """
+        Loads a cog in this process.
+        """
+        await self.bot.load_extension(f"cogs.{cog_name}")
+
+
+    async def unload_local(self, cog_name):
+        """
+        Unloads a cog in this process.
+        """
+        await self.bot.unload_extension(f"cogs.{cog_name}")
+
+
+    async def reload_local(self, cog_name):
+        """
+        Unloads a cog in this process then loads it back.
+        """
+        await self.bot.unload_extension(f"cogs.{cog_name}")
+        await self.bot.load_extension(f"cogs.{cog_name}")
+
+
+    async def sync_local(self, args):
+        """
+        Syncs the commands of this process.
+
+        The changes to the tree (spec * and ^) are done in every
+        process, so their trees stay the same, but a guild is only
+        synced by the process owning it and the global commands by
+        the first cluster.
+
+        Args:
+            args as (guild_ids, spec, current guild ID)
+
+        Returns:
+            the amount of synced commands (or guilds with guild_ids),
+            None when this process had nothing to sync
+        """
+        guild_ids, spec, current_guild_id = args
+        if guild_ids:
+            ret = 0
+            for guild_id in guild_ids:
+                if not self.owns_guild(guild_id):
+                    continue
+                try:
+                    await self.bot.tree.sync(guild=discord.Object(id=guild_id))
+                except discord.HTTPException:
+                    pass
+                else:
+                    ret += 1
+            return ret
+
+        if spec is None:
+            if cluster_client.cluster_id != 0:
+                return None
+            return len(await self.bot.tree.sync())
+        guild = discord.Object(id=current_guild_id)
+        if spec == "*":
+            self.bot.tree.copy_global_to(guild=guild)
+        elif spec == "^":
+            self.bot.tree.clear_commands(guild=guild)
+        if not self.owns_guild(current_guild_id):
+            return None
+        synced = await self.bot.tree.sync(guild=guild)
+        return 0 if spec == "^" else len(synced)
+
+
+    async def showcogs_local(self, _args):
+        """
+        Returns the cogs loaded in this process, with their lines.
+        """
+        return {
+            cog: self.count_lines(os.path.join("./cogs", f"{cog}.py"))
+            for cog in self.bot.cogs
+        }
+
+
+    async def clusterstats_local(self, _args):
+        """
+        Returns the shards, servers, members and latency of this process.
+        """
+        return {
+            "shards": sorted(self.bot.shards),
+            "guilds": len(self.bot.guilds),
+            "members": sum(guild.member_count or 0 for guild in self.bot.guilds),
+            "latency": round(self.bot.latency * 1000),
+            "databases": db_manager.stats()["guilds"]
+        }
+
+
+    async def memstats_local(self, top):
+        """
+        Returns the sizes of the caches of this process (see cachepolicy.py).
+        """
+        return cache_policy.report(self.bot, top)
+
+
     @commands.command()
     @commands.is_owner()
     async def load(self, ctx: commands.Context, cog_name: str):
@@ -51,11 +224,11 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
             commands.ExtensionFailed: If loading the cog fails.
         """
         if cog_name != "cogsmanager":
-            try:
-                await self.bot.load_extension(f"cogs.{cog_name}")
-                await ctx.send(f"{cog_name} cog has been loaded.")
-            except commands.ExtensionFailed as extension_failed:
-                await ctx.send(f"Error loading {cog_name} cog: {extension_failed}")
+            results = await self.fan_out(ctx, "load", cog_name)
+            if results:
+                await ctx.send(self.cluster_report(
+                    results, f"{cog_name} cog has been loaded.", f"Error loading {cog_name} cog"
+                ))
         else:
             await ctx.send("cogsmanager is already loaded, obviously.")
 
@@ -75,11 +248,11 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
             commands.ExtensionFailed: If unloading the cog fails.
         """
         if cog_name != "cogsmanager":
-            try:
-                await self.bot.unload_extension(f"cogs.{cog_name}")
-                await ctx.send(f"{cog_name} cog has been unloaded.")
-            except commands.ExtensionFailed as extension_failed:
-                await ctx.send(f"Error unloading {cog_name} cog: {extension_failed}")
+            results = await self.fan_out(ctx, "unload", cog_name)
+            if results:
+                await ctx.send(self.cluster_report(
+                    results, f"{cog_name} cog has been unloaded.", f"Error unloading {cog_name} cog"
+                ))
         else:
             await ctx.send("I can't unload the cogsmanager.")
 
@@ -99,12 +272,11 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
             commands.ExtensionFailed: If reloading the cog fails.
         """
         if cog_name != "cogsmanager":
-            try:
-                await self.bot.unload_extension(f"cogs.{cog_name}")
-                await self.bot.load_extension(f"cogs.{cog_name}")
-                await ctx.send(f"{cog_name} cog has been reloaded.")
-            except commands.ExtensionFailed as extension_failed:
-                await ctx.send(f"Error reloading {cog_name} cog: {extension_failed}")
+            results = await self.fan_out(ctx, "reload", cog_name)
+            if results:
+                await ctx.send(self.cluster_report(
+                    results, f"{cog_name} cog has been reloaded.", f"Error reloading {cog_name} cog"
+                ))
         else:
             await ctx.send("I can't reload the cogsmanager.")
 
@@ -142,34 +314,31 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
             guilds: guild(s) to sync
             spec: optional with 1 argument only
         """
-        if not guilds:
-            if spec == "~":
-                synced = await ctx.bot.tree.sync(guild=ctx.guild)
-            elif spec == "*":
-                ctx.bot.tree.copy_global_to(guild=ctx.guild)
-                synced = await ctx.bot.tree.sync(guild=ctx.guild)
-            elif spec == "^":
-                ctx.bot.tree.clear_commands(guild=ctx.guild)
-                await ctx.bot.tree.sync(guild=ctx.guild)
-                synced = []
-            else:
-                synced = await ctx.bot.tree.sync()
+        if not guilds and spec is not None and ctx.guild is None:
+            await ctx.send("This sync must be used in a server.")
+            return
+        results = await self.fan_out(
+            ctx, "sync", (
+                [guild.id for guild in guilds], spec, ctx.guild.id if ctx.guild else None
+            )
+        )
+        if not results:
+            return
+        errors = [
+            f"Cluster {cluster_id}: {result}"
+            for cluster_id, success, result in results if not success
+        ]
+        if errors:
+            await ctx.send("Error syncing:\n" + "\n".join(errors))
+        counts = [result for _, success, result in results if success and result is not None]
 
+        if not guilds:
             await ctx.send(
-                f"Synced {len(synced)} cmds {'globally' if spec is None else 'to current guild.'}"
+                f"Synced {sum(counts)} cmds {'globally' if spec is None else 'to current guild.'}"
             )
             return
 
-        ret = 0
-        for guild in guilds:
-            try:
-                await ctx.bot.tree.sync(guild=guild)
-            except discord.HTTPException:
-                pass
-            else:
-                ret += 1
-
-        await ctx.send(f"Synced the tree to {ret}/{len(guilds)}.")
+        await ctx.send(f"Synced the tree to {sum(counts)}/{len(guilds)}.")
 
 
     def count_lines(self, file_path):
@@ -192,16 +361,25 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
         Args:
             ctx as commands.Context
         """
+        results = await self.fan_out(ctx, "showcogs")
+        if not results:
+            return
+        loaded = [result for _, success, result in results if success]
         response = ""
         cog_lines_total = 0
         c_cogs = 0
-        for cog in self.bot.cogs:
-            cog_file = f"{cog}.py"
-            extension_file_path = os.path.join("./cogs", cog_file)
-            cog_lines = self.count_lines(extension_file_path)
+        for cog in sorted({cog for cogs in loaded for cog in cogs}):
+            cog_lines = next(cogs[cog] for cogs in loaded if cog in cogs)
             cog_lines_total += cog_lines
             c_cogs += 1
-            response += f"{cog} : {cog_lines}\n"
+            missing = [
+                str(cluster_id) for cluster_id, success, cogs in results
+                if success and cog not in cogs
+            ]
+            if missing:
+                response += f"{cog} : {cog_lines} (not loaded in clusters {', '.join(missing)})\n"
+            else:
+                response += f"{cog} : {cog_lines}\n"
 
         await ctx.send(
             "List of the loaded cogs:\n"
@@ -209,6 +387,108 @@ class Cogsmanager(commands.Cog, name="cogsmanager"):
         )
 
 
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx: commands.Context):
+        """
+        Shows the counters of the database pools, the config cache, the audit logs
+        and the message store.
+
+        Args:
+            ctx as commands.Context
+        """
+        pools = db_manager.stats()
+        configs = config_cache.stats()
+        audits = audit_log.stats()
+        messages = message_store.stats()
+        await ctx.send(
+            "Database pools:\n"
+            f"{pools['guilds']} servers, {pools['idle']} idle / {pools['in_use']} in use, "
+            f"{pools['opened']} opened, {pools['evictions']} evictions, "
+            f"{pools['checkpoints']} checkpoints, "
+            f"{pools['template_reads']} reads of servers without a file\n"
+            "Config cache:\n"
+            f"{configs['guilds']} servers, {configs['hits']} hits, {configs['misses']} misses "
+            f"({configs['hit_rate']:.1%}), {configs['invalidations']} invalidations\n"
+            "Audit logs:\n"
+            f"{audits['guilds']} servers, {audits['entries']} entries, {audits['hits']} hits, "
+            f"{audits['misses']} misses ({audits['hit_rate']:.1%}), {audits['fetches']} fetches "
+            f"of {audits['fetched_entries']} entries\n"
+            "Message store:\n"
+            f"{messages['guilds']} servers, {messages['messages']} messages in "
+            f"{messages['bytes'] / 1024:.0f} KB (content at {messages['ratio']:.0%}), "
+            f"{messages['hits']} hits, {messages['misses']} misses ({messages['hit_rate']:.1%}), "
+            f"{messages['evictions']} evictions"
+        )
+
+
+    @commands.command()
+    @commands.is_owner()
+    async def clusterstats(self, ctx: commands.Context):
+        """
+        Shows the shards, servers, members and latency of every cluster.
+
+        Args:
+            ctx as commands.Context
+        """
+        results = await self.fan_out(ctx, "clusterstats")
+        if not results:
+            return
+        lines = []
+        total_guilds = 0
+        total_members = 0
+        for cluster_id, success, result in results:
+            if not success:
+                lines.append(f"Cluster {cluster_id}: {result}")
+                continue
+            total_guilds += result["guilds"]
+            total_members += result["members"]
+            lines.append(
+                f"Cluster {cluster_id} (shards {result['shards']}): {result['guilds']} servers, "
+                f"{result['members']} members, {result['latency']}ms, "
+                f"{result['databases']} open databases"
+            )
+        lines.append(
+            f"Total: {len(results)} clusters, {total_guilds} servers, {total_members} members"
+        )
+        await ctx.send("\n".join(lines))
+
+
+    @commands.command()
+    @commands.is_owner()
+    async def memstats(self, ctx: commands.Context, top: int = 5):
+        """
+        Shows the sizes of the caches and the servers caching the most members.
+
+        Args:
+            ctx as commands.Context
+            top as int for the amount of servers listed per cluster
+        """
+        results = await self.fan_out(ctx, "memstats", max(0, min(top, 20)))
+        if not results:
+            return
+        lines = []
+        for cluster_id, success, result in results:
+            if not success:
+                lines.append(f"Cluster {cluster_id}: {result}")
+                continue
+            memory = f"{result['max_rss_mb']:.0f} MB peak" if result["max_rss_mb"] else "peak unknown"
+            lines.append(
+                f"Cluster {cluster_id}: {result['cached_members']}/{result['members']} members "
+                f"cached, {result['chunked']}/{result['guilds']} servers chunked "
+                f"({result['chunked_on_demand']} on demand), {result['users']} users, "
+                f"{result['messages']} messages, {result['fetched_members']} members fetched, "
+                f"{memory}"
+            )
+            for guild in result["top"]:
+                lines.append(
+                    f"- {guild['name']} ({guild['id']}): {guild['cached_members']}/"
+                    f"{guild['members']} members, {guild['channels']} channels, "
+                    f"{guild['roles']} roles{'' if guild['chunked'] else ', not chunked'}"
+                )
+        await ctx.send("\n".join(lines)[:2000])
+
+
 
 async def setup(bot):
     """
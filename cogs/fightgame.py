@@ -13,7 +13,11 @@ import discord
 from discord import app_commands, Interaction
 from discord.ext import commands
 from discord.app_commands import Choice
-from cogs.intercogs import get_server_database, add_achievement, add_achievecount, check_optin
+from dbmanager import db_transaction
+from cogs.intercogs import (
+    get_server_database, add_achievement, add_achievecount, check_optin, get_board,
+    mark_board_dirty
+)
 
 
 
@@ -26,6 +30,7 @@ class Fightgame(commands.Cog, name="fightgame"):
 
     Functions:
         combat()
+        score_moves()
         user_fights()
         format_fights()
         
@@ -61,13 +66,43 @@ class Fightgame(commands.Cog, name="fightgame"):
             fscore as integer
             oscore as integer
         """
-        conn, cur = get_server_database(guild_id)
+        async with db_transaction(guild_id) as trans:
+            fightmoves = await trans.fetchone(
+                "SELECT * FROM fightgame WHERE attackid = ? AND opponentid = ?",
+                (opponent_id, user_id)
+            )
+            fscore, oscore = self.score_moves(
+                fightmoves, fattk1, fattk2, fattk3, fdef1, fdef2, fdef3
+            )
+            await trans.execute(
+                "DELETE FROM fightgame WHERE attackid = ? AND opponentid = ?",
+                (opponent_id, user_id)
+            )
+            fightscore = (
+                "INSERT INTO fightscore (id, score, games) VALUES (?, ?, 1) "
+                "ON CONFLICT(id) DO UPDATE SET score = score + excluded.score, "
+                "games = games + 1 RETURNING score"
+            )
+            fnewscore = (await trans.fetchone(fightscore, (user_id, fscore)))[0]
+            await trans.execute(fightscore, (opponent_id, oscore))
+        mark_board_dirty(guild_id, "battle")
+        return fscore, fnewscore, oscore
 
-        cur.execute(
-            "SELECT * FROM fightgame WHERE attackid = ? AND opponentid = ?",
-            (opponent_id, user_id)
-        )
-        fightmoves = cur.fetchall()[0]
+
+    def score_moves(self, fightmoves, fattk1, fattk2, fattk3, fdef1, fdef2, fdef3):
+        """
+        Calculates the points of both fighters.
+
+        See combat()
+
+        Args:
+            fightmoves as the fightgame row of the opponent
+            attack1~3 and defense1~3 as Choice of the fighter
+
+        Returns:
+            fscore as integer
+            oscore as integer
+        """
         fscore = 0
         oscore = 0
         oattk1 = fightmoves[2]
@@ -92,46 +127,7 @@ class Fightgame(commands.Cog, name="fightgame"):
                 fscore += 5
             else:
                 oscore += 2
-        cur.execute(
-            "DELETE FROM fightgame WHERE attackid = ? AND opponentid = ?",
-            (opponent_id, user_id)
-        )
-        conn.commit()
-        cur.execute("SELECT score, games FROM fightscore WHERE id = ?", (user_id, ))
-        fcombatscore = cur.fetchone()
-        fgames = fcombatscore[1] + 1 if fcombatscore else 1
-        if fcombatscore:
-            fnewscore = fcombatscore[0] + fscore
-            cur.execute(
-                "UPDATE fightscore SET score = ?, games = ? WHERE id = ?",
-                (fnewscore, fgames, user_id)
-            )
-            conn.commit()
-        else:
-            fnewscore = fscore
-            cur.execute(
-                "INSERT INTO fightscore (id, score, games) VALUES (?, ?, ?)",
-                (user_id, fscore, fgames)
-            )
-            conn.commit()
-        cur.execute("SELECT score, games FROM fightscore WHERE id = ?", (opponent_id, ))
-        ocombatscore = cur.fetchone()
-        ogames = ocombatscore[1] + 1 if ocombatscore else 1
-        if ocombatscore:
-            onewscore = ocombatscore[0] + oscore
-            cur.execute(
-                "UPDATE fightscore SET score = ?, games = ? WHERE id = ?",
-                (onewscore, ogames, opponent_id)
-            )
-            conn.commit()
-        else:
-            cur.execute(
-                "INSERT INTO fightscore (id, score, games) VALUES (?, ?, ?)",
-                (opponent_id, oscore, ogames)
-            )
-            conn.commit()
-        conn.close()
-        return fscore, fnewscore, oscore
+        return fscore, oscore
 
 
     @app_commands.command(
@@ -326,44 +322,13 @@ class Fightgame(commands.Cog, name="fightgame"):
                 ephemeral=True
             )
             return
-        conn, cur = get_server_database(interaction.guild.id)
-
-        cur.execute("SELECT * FROM fightscore")
-        top_scores = cur.fetchall()
-        conn.close()
-
-        if not top_scores:
+        embed = await get_board(interaction.guild, "battle")
+        if embed is None:
             await interaction.response.send_message(
                 content="There is no score yet on this server for the fight system.",
                 ephemeral=True
             )
             return
-
-        embed = discord.Embed(title=f"Battleboard of {interaction.guild.name}", color=0x00ff00)
-        embed.set_thumbnail(url=interaction.guild.icon)
-
-        sorted_points = sorted(top_scores, key=lambda x: (-x[1], -x[2]))[:10]
-        boardpoints = ""
-        for item in sorted_points:
-            member = self.bot.get_user(int(item[0]))
-            if member is not None:
-                member = member.display_name
-            else:
-                member = f"<@{item[0]}>"
-            boardpoints += f"{member}: {item[1]} points\n"
-
-        sorted_games = sorted(top_scores, key=lambda x: (-x[2], -x[1]))[:10]
-        boardgames = ""
-        for item in sorted_games:
-            member = self.bot.get_user(int(item[0]))
-            if member is not None:
-                member = member.display_name
-            else:
-                member = f"<@{item[0]}>"
-            boardgames += f"{member}: {item[2]} games\n"
-
-        embed.add_field(name="Top 10 scores", value=boardpoints, inline=True)
-        embed.add_field(name="Top 10 games", value=boardgames, inline=True)
         await interaction.response.send_message(embed=embed)
 
 
@@ -8,15 +8,31 @@ cogs to fetch datas from the database.
 
 Author: Elcoyote Solitaire
 """
+import asyncio
 import datetime
-import sqlite3
-import pytz
+import time
 import discord
 
 from datetime import datetime, timezone, timedelta
 from discord import app_commands, Interaction
 from discord.ext import commands
 from discord.app_commands import Choice
+from dbmanager import (
+    db_manager, db_execute, db_executemany, db_fetchone, db_fetchall
+)
+from cachepolicy import MEMBER_LOG_CHANNELS, ensure_chunked
+from guildconfig import get_config, invalidate_config
+from achievecache import achieve_masks
+from boardcache import board_cache
+from dbschema import ACHIEVEMENT_BITS
+
+
+BOARD_TTL = 300
+BOARD_MIN_REBUILD = 30
+STATS_COLUMNS = (
+    "messages", "words", "characters", "emojis", "reactions",
+    "edited", "deleted", "jvoice", "tvoice"
+)
 
 
 
@@ -28,8 +44,13 @@ class Intercogs(commands.Cog, name="intercogs"):
 
     Functions used through the bot:
         - get_server_database
+        - shard_guilds
         - add_achievement
 
+    Coroutines should prefer the awaitable queries from dbmanager.py
+    (db_execute, db_fetchone, db_fetchall, db_transaction), which
+    never block the event loop.
+
     Commands:
         /showsetup
         /exception
@@ -73,180 +94,71 @@ class Intercogs(commands.Cog, name="intercogs"):
     }
 
 
-    # USING THIS METHOD ALLOWS THE ADMIN TO ADD/CHANGE TABLES FROM
-    # THE DATABASE WITHOUT HAVING TO FIND WHERE TO APPLY THE CHANGES.
-    # IT ALSO ALLOWS TO CREATE ALL NECESSARY TABLES AT ONCE EVERYTIME
-    # A BOT JOINS A SERVER. EVERYTHING THAT TRIGGERS A SEARCH/WRITE IN
-    # THE DATABASE WILL AUTOMATICALLY GO THROUGH THIS.
+    # THE TABLES ARE CREATED IN DBSCHEMA.PY, WHICH ALLOWS THE ADMIN TO
+    # ADD/CHANGE TABLES FROM THE DATABASE WITHOUT HAVING TO FIND WHERE TO
+    # APPLY THE CHANGES. EVERYTHING THAT TRIGGERS A SEARCH/WRITE IN THE
+    # DATABASE WILL AUTOMATICALLY GO THROUGH THIS.
 
     def get_server_database(self, server_id):
         """
         Main function to obtain servers' database.
-        Creates all the necessary tables if they aren't created yet.
+
+        The connection is borrowed from the server's pool in
+        dbmanager.py, so conn.close() gives it back to the pool
+        instead of closing the file. The tables are created by
+        dbschema.py the first time the file is opened.
 
         Args:
             server_id as guild.id
         """
-        db_file = f"./database/servers/{server_id}.db"
-        conn = sqlite3.connect(db_file)
+        conn = db_manager.connection(server_id)
         cur = conn.cursor()
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS stats
-            (id INTEGER PRIMARY KEY,
-            messages INTEGER,
-            words INTEGER,
-            characters INTEGER,
-            emojis INTEGER,
-            reactions INTEGER,
-            edited INTEGER,
-            deleted INTEGER,
-            jvoice INTEGER,
-            tvoice INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS setup
-            (chans TEXT PRIMARY KEY,
-            id INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS level
-            (id INTEGER PRIMARY KEY,
-            exp INTEGER,
-            level INTEGER,
-            total INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS reaction
-            (message INTEGER,
-            emoji TEXT,
-            type TEXT,
-            role INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS servstats
-            (chans TEXT PRIMARY KEY,
-            id INTEGER,
-            region TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS suggestion
-            (number INTEGER PRIMARY KEY AUTOINCREMENT,
-            id INTEGER,
-            authorid INTEGER,
-            decision TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS exception
-            (id INTEGER,
-            reason TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS punishment
-            (target INTEGER,
-            starters INTEGER,
-            message INTEGER,
-            channel INTEGER,
-            PRIMARY KEY (target, starters))''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS anniv
-            (id INTEGER PRIMARY KEY,
-            month INTEGER,
-            day INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS voice
-            (id INTEGER PRIMARY KEY,
-            jtime TIMESTAMP,
-            embmsg INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS timezone
-            (id INTEGER PRIMARY KEY,
-            timezone TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS achievements
-            (id INTEGER,
-            achievements TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS notes
-            (number INTEGER PRIMARY KEY AUTOINCREMENT,
-            authorid INTEGER,
-            ctime TIMESTAMP,
-            note TEXT,
-            active TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS achievecount
-            (id INTEGER,
-            achieve TEXT,
-            count INTEGER,
-            notes TEXT,
-            PRIMARY KEY (id, achieve))''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS fightgame
-            (attackid INTEGER,
-            opponentid INTEGER,
-            attack1 INTEGER,
-            attack2 INTEGER,
-            attack3 INTEGER,
-            defense1 INTEGER,
-            defense2 INTEGER,
-            defense3 INTEGER,
-            PRIMARY KEY (attackid, opponentid))''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS fightscore
-            (id INTEGER,
-            score INTEGER,
-            games INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS anonyme
-            (id INTEGER PRIMARY KEY,
-            prefix TEXT,
-            suffix TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS member_options
-            (id INTEGER PRIMARY KEY,
-            single_hug TEXT,
-            anon_hug TEXT,
-            group_hug TEXT,
-            fight TEXT,
-            kiss TEXT)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS quiz
-            (starter INTEGER PRIMARY KEY,
-            question TEXT,
-            answer TEXT,
-            timestamp TIMESTAMP)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS quiz_score
-            (id INTEGER PRIMARY KEY,
-            score INTEGER,
-            question INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS thisorthat
-            (id INTEGER PRIMARY KEY,
-            answers TEXT,
-            current_question INTEGER)''')
-
-        cur.execute('''CREATE TABLE IF NOT EXISTS reddit_settings
-            (guild_id INTEGER PRIMARY KEY,
-            channel_id INTEGER,
-            sub TEXT,
-            last_post_ids TEXT,
-            on_off TEXT)''')
-
-        conn.commit()
         return conn, cur
 
 
+    def shard_guilds(self, shard_id=None):
+        """
+        Returns the guilds owned by the shards of this process.
+
+        The background loops go through these instead of bot.guilds:
+        the guilds of a shard that is disconnected (or of a guild that
+        is unavailable) are skipped until the shard is back, and a
+        loop can ask for the guilds of a single shard.
+
+        Args:
+            shard_id as int (or None for every shard of this process)
+        """
+        shards = getattr(self.bot, "shards", None)
+        if not shards:
+            return [guild for guild in self.bot.guilds if not guild.unavailable]
+        if shard_id is not None:
+            owned = {shard_id} if shard_id in shards else set()
+        else:
+            owned = {
+                shard_info.id for shard_info in shards.values() if not shard_info.is_closed()
+            }
+        return [
+            guild for guild in self.bot.guilds
+            if guild.shard_id in owned and not guild.unavailable
+        ]
+
+
     async def get_setup_chan_id(self, server_id, channel):
         """
         Fetch channel ID from the setup table
 
+        The setup table is served from memory by guildconfig.py.
+
         Args:
             server_id as interaction.guild.id
             channel as string for the name of the channel in setup
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute("SELECT id FROM SETUP WHERE chans = ?", (channel, ))
-        channel_result = cur.fetchone()
-        conn.close()
-        channel_id = channel_result[0] if channel_result else None
-        return channel_id
+        config = await get_config(server_id)
+        return config.get_setup(channel)
 
 
     # exception function to update the table is in the modlogs.py
-    def is_exception(self, server_id, channel_id, reason):
+    async def is_exception(self, server_id, channel_id, reason):
         """
         Verify if the channel is in the exception's list.
 
@@ -255,13 +167,8 @@ class Intercogs(commands.Cog, name="intercogs"):
             channel_id as TextChannel.id
             reason as a string - The specific reason to be an exception.
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute("SELECT * FROM exception WHERE id = ? AND reason = ?", (channel_id, reason))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            return True
-        return False
+        config = await get_config(server_id)
+        return config.is_exception(channel_id, reason)
 
 
     async def add_achievement(self, server_id, user_id, achievement):
@@ -269,31 +176,47 @@ class Intercogs(commands.Cog, name="intercogs"):
         Adds an achievement to a user.
         
         Verify if the user has the achievement and applies if it doesn't.
+
+        The achievements are a bitmask (see ACHIEVEMENT_BITS in dbschema.py)
+        kept in memory once read (see achievecache.py), so an achievement
+        already granted never needs a query.
         
         Args:
             server_id as guild.id
             user_id as user.id
             achievement as str
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute("SELECT * FROM achievements WHERE id = ?", (user_id,))
-        rows = cur.fetchall()
-        if not rows:
-            cur.execute(
-                "INSERT INTO achievements (id, achievements) VALUES (?, ?)", (user_id, achievement)
-            )
-            conn.commit()
-            conn.close()
+        bit = 1 << ACHIEVEMENT_BITS[achievement]
+        mask = await self.get_achieve_mask(server_id, user_id)
+        if mask & bit:
             return
-        for row in rows:
-            if achievement in row:
-                conn.close()
-                return
-        cur.execute(
-            "INSERT INTO achievements (id, achievements) VALUES (?, ?)", (user_id, achievement)
+        # the WHERE keeps total right if another grant won the race
+        row = await db_fetchone(
+            server_id,
+            "INSERT INTO achievements (id, mask, total) VALUES (?, ?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET mask = mask | excluded.mask, total = total + 1 "
+            "WHERE mask & excluded.mask = 0 RETURNING mask",
+            (user_id, bit)
         )
-        conn.commit()
-        conn.close()
+        achieve_masks.put(server_id, user_id, row[0] if row else mask | bit)
+        self.mark_board_dirty(server_id, "achieve")
+
+
+    async def get_achieve_mask(self, server_id, user_id):
+        """
+        Retrieves the achievements' mask of a user, from memory if possible.
+
+        Args:
+            server_id as guild.id
+            user_id as user.id
+        """
+        mask = achieve_masks.get(server_id, user_id)
+        if mask is not None:
+            return mask
+        row = await db_fetchone(server_id, "SELECT mask FROM achievements WHERE id = ?", (user_id,))
+        mask = row[0] if row else 0
+        achieve_masks.put(server_id, user_id, mask)
+        return mask
 
 
     async def add_achievecount(self, server_id, user_id, achievement):
@@ -307,26 +230,13 @@ class Intercogs(commands.Cog, name="intercogs"):
             user_id as user.id
             achievement as str
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute(
-            "SELECT * FROM achievecount WHERE id = ? AND achieve = ?", (user_id, achievement)
+        row = await db_fetchone(
+            server_id,
+            "INSERT INTO achievecount (id, achieve, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(id, achieve) DO UPDATE SET count = count + 1 RETURNING count",
+            (user_id, achievement)
         )
-        rows = cur.fetchall()
-        if rows:
-            count = int(rows[0][2]) + 1
-            cur.execute(
-                "UPDATE achievecount SET count = ? WHERE id = ? AND achieve = ?",
-                (count, user_id, achievement)
-            )
-        else:
-            count = 1
-            cur.execute(
-                "INSERT INTO achievecount (id, achieve, count) VALUES (?, ?, ?)",
-                (user_id, achievement, count)
-            )
-        conn.commit()
-        conn.close()
-        return count
+        return row[0]
 
 
     async def get_achievements(self, server_id, user_id):
@@ -340,15 +250,12 @@ class Intercogs(commands.Cog, name="intercogs"):
             server_id as guild.id
             user_id as user.id
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute("SELECT * FROM achievements WHERE id = ?", (user_id,))
-        row = cur.fetchall()
-        conn.close()
-        if not row:
+        mask = await self.get_achieve_mask(server_id, user_id)
+        if not mask:
             return None, None, None, 0
-        achievements = []
-        for row in row:
-            achievements.append(row[1])
+        achievements = [
+            achievement for achievement, bit in ACHIEVEMENT_BITS.items() if mask & 1 << bit
+        ]
 
         if len(achievements) > 10:
             achievements_1 = achievements[:10]
@@ -364,6 +271,32 @@ class Intercogs(commands.Cog, name="intercogs"):
         return achievements, liste_1, liste_2, total_achieves
 
 
+    async def get_stats_leaders(self, server_id, top=1):
+        """
+        Retrieves the best members of every column of the stats table.
+
+        Every column has its own index (see dbschema.py), so this is
+        one query made of an index seek per column, whatever the size
+        of the table.
+
+        Args:
+            server_id as guild.id
+            top as int for the amount of members per column
+
+        Returns:
+            leaders as dict of {column: [(user_id, value), ...]}, best first
+        """
+        query = " UNION ALL ".join(
+            f"SELECT * FROM (SELECT '{column}', id, {column} FROM stats "
+            f"ORDER BY {column} DESC LIMIT {int(top)})"
+            for column in STATS_COLUMNS
+        )
+        leaders = {column: [] for column in STATS_COLUMNS}
+        for column, user_id, value in await db_fetchall(server_id, query):
+            leaders[column].append((user_id, value))
+        return leaders
+
+
     async def get_time_zone(self, server_id):
         """
         Retrieve the timezone for the server.
@@ -371,12 +304,8 @@ class Intercogs(commands.Cog, name="intercogs"):
         Args:
             server_id: The ID of the server.
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute("SELECT timezone FROM timezone")
-        row = cur.fetchone()
-        conn.close()
-        time_zone = pytz.timezone(row[0]) if row is not None else pytz.timezone("US/Eastern")
-        return time_zone
+        config = await get_config(server_id)
+        return config.time_zone
 
 
     async def check_senority(self, date_joined, delay: int):
@@ -412,10 +341,9 @@ class Intercogs(commands.Cog, name="intercogs"):
             user_id as discord.User.id
             system as str for colum in member_options table
         """
-        conn, cur = self.get_server_database(server_id)
-        cur.execute(f"SELECT {system} FROM member_options WHERE id = ?", (user_id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(
+            server_id, f"SELECT {system} FROM member_options WHERE id = ?", (user_id,)
+        )
         if result:
             if result[0] == "off":
                 return False
@@ -438,10 +366,7 @@ class Intercogs(commands.Cog, name="intercogs"):
         Arguments:
             interaction as discord.Interaction.
         """
-        conn, cur = self.get_server_database(interaction.guild.id)
-        cur.execute("SELECT * FROM setup")
-        rows = cur.fetchall()
-        conn.close()
+        rows = await db_fetchall(interaction.guild.id, "SELECT * FROM setup")
 
         setup_channels = [
             "audits", "edits", "users", "joins", "lefts", "alerts",
@@ -520,30 +445,30 @@ class Intercogs(commands.Cog, name="intercogs"):
             exp: Restrict the channel from giving exp to users typing there.
             delete: Deleting/editing messages won't trigger the modlogs.
         """
-        conn, cur = self.get_server_database(interaction.guild.id)
         if addremove.name == "add":
-            cur.execute(
+            await db_execute(
+                interaction.guild.id,
                 "INSERT OR REPLACE INTO exception (id, reason) VALUES (?, ?)",
                 (channel.id, exceptiontype.name)
             )
+            invalidate_config(interaction.guild.id)
             await interaction.response.send_message(
                 content=f"{channel.mention} has been set as {exceptiontype.name}.",
                 ephemeral=True
             )
 
         else:
-            cur.execute(
+            await db_execute(
+                interaction.guild.id,
                 "DELETE FROM exception WHERE id = ? AND reason = ?", (channel.id, exceptiontype.name)
             )
+            invalidate_config(interaction.guild.id)
             await interaction.response.send_message(
                 content=f"{channel.mention} has been removed from the list of "
                 f"{exceptiontype.name} exception",
                 ephemeral=True
             )
 
-        conn.commit()
-        conn.close()
-
 
     @app_commands.command(
         name="settimezone",
@@ -595,13 +520,12 @@ class Intercogs(commands.Cog, name="intercogs"):
             interaction as discord.Interaction
             timezonegmt as Choice[int]
         """
-        conn, cur = self.get_server_database(interaction.guild.id)
-        cur.execute(
+        await db_execute(
+            interaction.guild.id,
             "INSERT OR REPLACE INTO timezone (id, timezone) VALUES (?, ?)",
             (interaction.guild.id, timezonegmt.name,)
         )
-        conn.commit()
-        conn.close()
+        invalidate_config(interaction.guild.id)
         await interaction.response.send_message(
             content=f"Your timezone has been set as {timezonegmt.name}.", ephemeral=True
         )
@@ -669,30 +593,7 @@ class Intercogs(commands.Cog, name="intercogs"):
                 ephemeral=True
             )
             return
-        conn, cur = self.get_server_database(interaction.guild.id)
-
-        cur.execute(
-            "SELECT id, COUNT(*) as num_achievements FROM achievements GROUP BY id"
-        )
-        topachieve = cur.fetchall()
-        conn.close()
-
-        embed = discord.Embed(title=f"Achieveboard of {interaction.guild.name}", color=0x00ff00)
-        embed.set_thumbnail(url=interaction.guild.icon)
-
-        sorted_rows = sorted(topachieve, key=lambda x: x[1], reverse=True)[:10]
-        for item in sorted_rows:
-            member = self.bot.get_user(int(item[0]))
-            if member is not None:
-                member = member.display_name
-            else:
-                member = f"<@{item[0]}>"
-            embed.add_field(
-                name=f"{member}: {item[1]}",
-                value="",
-                inline=False
-            )
-
+        embed = await self.get_board(interaction.guild, "achieve")
         await interaction.response.send_message(embed=embed)
 
 
@@ -757,27 +658,30 @@ class Intercogs(commands.Cog, name="intercogs"):
             )
             return
 
-        conn, cur = self.get_server_database(interaction.guild.id)
-
         if addremove.name == "add":
-            cur.execute(
+            await db_execute(
+                interaction.guild.id,
                 "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)",
                 (logtype.name, channel.id)
             )
+            invalidate_config(interaction.guild.id)
 
             await interaction.response.send_message(
                 content=f"{channel.mention} has been set as ***{logtype.name}***.",
                 ephemeral=True
             )
+            if logtype.name in MEMBER_LOG_CHANNELS:
+                await ensure_chunked(interaction.guild)
 
         else:
-            cur.execute("DELETE FROM setup WHERE chans = ?", (logtype.name,))
+            await db_execute(
+                interaction.guild.id, "DELETE FROM setup WHERE chans = ?", (logtype.name,)
+            )
+            invalidate_config(interaction.guild.id)
             await interaction.response.send_message(
                 content=f"{channel.mention} has been removed from setup as {logtype.name}",
                 ephemeral=True
             )
-        conn.commit()
-        conn.close()
 
 
     @app_commands.command(
@@ -806,22 +710,22 @@ class Intercogs(commands.Cog, name="intercogs"):
                 ephemeral=True
             )
             return
-        conn, cur = self.get_server_database(interaction.guild.id)
         logtypes = [
             "audits", "edits", "users", "joins", "lefts", "alerts", "logs", "level", "starboard",
             "vote", "welcome", "anonyme", "voices", "anniv", "fight", "analysis", "quiz",
             "meme_en", "meme_fr"
         ]
-        for logtype in logtypes:
-            cur.execute(
-                "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)", (logtype, channel.id)
-            )
-        conn.commit()
+        await db_executemany(
+            interaction.guild.id,
+            "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)",
+            [(logtype, channel.id) for logtype in logtypes]
+        )
+        invalidate_config(interaction.guild.id)
         await interaction.response.send_message(
             content=f"{channel.mention} has been set for all the logs.",
             ephemeral=True
         )
-        conn.close()
+        await ensure_chunked(interaction.guild)
 
 
     @app_commands.command(
@@ -861,19 +765,18 @@ class Intercogs(commands.Cog, name="intercogs"):
             "group hug": "group_hug",
             "fight": "fight"
         }
-        conn, cur = self.get_server_database(interaction.guild.id)
         if option.value != 1 and option.value != 6:
             sys_opt = systems.get(option.name)
-            cur.execute(
+            await db_execute(
+                interaction.guild.id,
                 f"INSERT INTO member_options (id, {sys_opt}) VALUES (?, ?)"
                 f"ON CONFLICT(id) DO UPDATE SET {sys_opt} = EXCLUDED.{sys_opt}",
                 (interaction.user.id, on_off.name)
             )
-            conn.commit()
-            conn.close()
         else:
             if option.value == 1:
-                cur.execute(
+                await db_execute(
+                    interaction.guild.id,
                     """
                     INSERT INTO member_options (id, single_hug, anon_hug, group_hug)
                     VALUES (?, ?, ?, ?)
@@ -884,16 +787,13 @@ class Intercogs(commands.Cog, name="intercogs"):
                     """,
                     (interaction.user.id, on_off.name, on_off.name, on_off.name)
                 )
-                conn.commit()
-                conn.close()
             else:
-                cur.execute(
+                await db_execute(
+                    interaction.guild.id,
                     "INSERT OR REPLACE INTO member_options"
                     "(id, single_hug, anon_hug, group_hug, fight) VALUES (?, ?, ?, ?, ?)",
                     (interaction.user.id, on_off.name, on_off.name, on_off.name, on_off.name)
                 )
-                conn.commit()
-                conn.close()
                 await interaction.response.send_message(
                     content=f"__**All systems**__ options have been switched to"
                     f"__**{on_off.name}**__",
@@ -917,11 +817,9 @@ class Intercogs(commands.Cog, name="intercogs"):
         Returns:
             level as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute("SELECT id, level, exp FROM level ORDER BY total DESC LIMIT 10")
-        top_levels = cur.fetchall()
-        conn.close()
+        top_levels = await db_fetchall(
+            guild.id, "SELECT id, level, exp FROM level ORDER BY total DESC LIMIT 10"
+        )
 
         level = discord.Embed(title=f"Levelboard of {guild.name}", color=0x00ff00)
         top_level_info = []
@@ -953,9 +851,6 @@ class Intercogs(commands.Cog, name="intercogs"):
         Returns:
             leader as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
-        highest_stats = {}
         highest_stats_processed = {}
         stat_name_mapping = {
             'messages': 'Messages sent',
@@ -968,15 +863,10 @@ class Intercogs(commands.Cog, name="intercogs"):
             'jvoice': 'Voice sessions',
             'tvoice': 'Voice time',
         }
-        columns = [
-            "messages", "words", "characters", "emojis", "reactions",
-            "edited", "deleted", "jvoice", "tvoice"
-        ]
-        for column in columns:
-            cur.execute(f"SELECT id, MAX({column}) FROM stats")
-            result = cur.fetchone()
-            highest_stats[column] = result
-        conn.close()
+        leaders = await self.get_stats_leaders(guild.id)
+        highest_stats = {
+            column: rows[0] if rows else (None, None) for column, rows in leaders.items()
+        }
 
         for column, (user_id, stats_value) in highest_stats.items():
             member = self.bot.get_user(user_id)
@@ -1013,19 +903,15 @@ class Intercogs(commands.Cog, name="intercogs"):
         Returns:
             achieve as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute(
-            "SELECT id, COUNT(*) as num_achievements FROM achievements GROUP BY id"
+        topachieve = await db_fetchall(
+            guild.id,
+            "SELECT id, total FROM achievements WHERE total > 0 ORDER BY total DESC LIMIT 10"
         )
-        topachieve = cur.fetchall()
-        conn.close()
 
         achieve = discord.Embed(title=f"Achieveboard of {guild.name}", color=0x00ff00)
         achieve.set_thumbnail(url=guild.icon)
 
-        sorted_rows = sorted(topachieve, key=lambda x: x[1], reverse=True)[:10]
-        for item in sorted_rows:
+        for item in topachieve:
             member = self.bot.get_user(int(item[0]))
             if member is not None:
                 member = member.display_name
@@ -1048,20 +934,12 @@ class Intercogs(commands.Cog, name="intercogs"):
             guild as discord.Interaction.guild
 
         Returns:
-            battle as discord.Embed
+            battle as discord.Embed (None if there is no score yet)
         """
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute("SELECT * FROM fightscore")
-        top_scores = cur.fetchall()
-        conn.close()
+        top_scores = await db_fetchall(guild.id, "SELECT * FROM fightscore")
 
         if not top_scores:
-            await interaction.response.send_message(
-                content="There is no score yet on this server for the fight system.",
-                ephemeral=True
-            )
-            return
+            return None
 
         battle = discord.Embed(title=f"Battleboard of {guild.name}", color=0x00ff00)
         battle.set_thumbnail(url=guild.icon)
@@ -1091,6 +969,84 @@ class Intercogs(commands.Cog, name="intercogs"):
         return battle
 
 
+    def mark_board_dirty(self, server_id, board):
+        """
+        Flags a board as changed since its snapshot.
+
+        Called by the write paths of the boards' tables.
+
+        Args:
+            server_id as guild.id
+            board as str (level, leader, achieve or battle)
+        """
+        board_cache.dirty.add((server_id, board))
+
+
+    async def build_board(self, guild, board):
+        """
+        Generates a board and saves its snapshot.
+
+        Args:
+            guild as discord.Guild
+            board as str (level, leader, achieve or battle)
+        """
+        generators = {
+            "level": self.generate_levelboard,
+            "leader": self.generate_leaderboard,
+            "achieve": self.generate_achieveboard,
+            "battle": self.generate_battleboard
+        }
+        key = (guild.id, board)
+        # a write during the build flags the board again
+        board_cache.dirty.discard(key)
+        embed = await generators[board](guild)
+        board_cache.snapshots[key] = (embed, time.monotonic())
+        return embed
+
+
+    def board_rebuilt(self, key, task):
+        """
+        Forgets a finished background rebuild.
+
+        See get_board()
+
+        Args:
+            key as (server_id, board)
+            task as asyncio.Task
+        """
+        board_cache.rebuilds.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error rebuilding the {key[1]} board of server {key[0]}: {task.exception()}")
+
+
+    async def get_board(self, guild, board):
+        """
+        Returns the snapshot of a board.
+
+        The snapshot is returned right away. When it is older than
+        BOARD_TTL, or flagged by mark_board_dirty() and older than
+        BOARD_MIN_REBUILD, a new one is built in the background for
+        the next call. Only the very first call of a server waits
+        for the board to be built.
+
+        Args:
+            guild as discord.Guild
+            board as str (level, leader, achieve or battle)
+        """
+        key = (guild.id, board)
+        snapshot = board_cache.snapshots.get(key)
+        if snapshot is None:
+            return await self.build_board(guild, board)
+        embed, built = snapshot
+        age = time.monotonic() - built
+        if age >= BOARD_TTL or (key in board_cache.dirty and age >= BOARD_MIN_REBUILD):
+            if key not in board_cache.rebuilds:
+                task = asyncio.create_task(self.build_board(guild, board))
+                board_cache.rebuilds[key] = task
+                task.add_done_callback(lambda done: self.board_rebuilt(key, done))
+        return embed
+
+
     @app_commands.command(
         name="server_boards",
         description="Sends all the boards for the server"
@@ -1108,12 +1064,11 @@ class Intercogs(commands.Cog, name="intercogs"):
         Args:
             interaction as discord.Interaction
         """
-        level = await self.generate_levelboard(interaction.guild)
-        leader = await self.generate_leaderboard(interaction.guild)
-        achieve = await self.generate_achieveboard(interaction.guild)
-        battle = await self.generate_battleboard(interaction.guild)
-        embeds = [ level, leader, achieve, battle ]
-        await interaction.response.send_message(embeds=embeds)
+        embeds = [
+            await self.get_board(interaction.guild, board)
+            for board in ("level", "leader", "achieve", "battle")
+        ]
+        await interaction.response.send_message(embeds=[embed for embed in embeds if embed])
 
 
 
@@ -1127,6 +1082,13 @@ def get_server_database(server_id):
     return intercogs_instance.get_server_database(server_id)
 
 
+def shard_guilds(shard_id=None):
+    """
+    Mirror function to be imported in other cogs.
+    """
+    return intercogs_instance.shard_guilds(shard_id)
+
+
 async def get_setup_chan_id(server_id, channel):
     """
     Mirror function to be imported in other cogs.
@@ -1148,11 +1110,11 @@ async def get_achievements(server_id, user_id):
     return await intercogs_instance.get_achievements(server_id, user_id)
 
 
-def is_exception(server_id, channel_id, reason):
+async def is_exception(server_id, channel_id, reason):
     """
     Mirror function to be imported in other cogs.
     """
-    return intercogs_instance.is_exception(server_id, channel_id, reason)
+    return await intercogs_instance.is_exception(server_id, channel_id, reason)
 
 
 async def add_achievecount(server_id, user_id, achievement):
@@ -1162,6 +1124,27 @@ async def add_achievecount(server_id, user_id, achievement):
     return await intercogs_instance.add_achievecount(server_id, user_id, achievement)
 
 
+def mark_board_dirty(server_id, board):
+    """
+    Mirror function to be imported in other cogs.
+    """
+    intercogs_instance.mark_board_dirty(server_id, board)
+
+
+async def get_board(guild, board):
+    """
+    Mirror function to be imported in other cogs.
+    """
+    return await intercogs_instance.get_board(guild, board)
+
+
+async def get_stats_leaders(server_id, top=1):
+    """
+    Mirror function to be imported in other cogs.
+    """
+    return await intercogs_instance.get_stats_leaders(server_id, top)
+
+
 async def get_time_zone(server_id):
     """
     Mirror function to be imported in other cogs.
@@ -1188,4 +1171,6 @@ async def setup(bot):
     """
     Loads the cog on start.
     """
+    # the mirror functions' boards need the bot to find the members
+    intercogs_instance.bot = bot
     await bot.add_cog(Intercogs(bot))
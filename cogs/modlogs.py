@@ -10,15 +10,28 @@ everything in the moderation's channels.
 
 Author: Elcoyote Solitaire
 """
+import io
 import random
 import datetime
 import pytz
 import discord
-import emoji
 
 from datetime import datetime
-from discord.ext import commands
-from cogs.intercogs import get_server_database, is_exception, get_time_zone, add_achievement
+from discord import app_commands, Interaction
+from discord.ext import commands, tasks
+from cogs.intercogs import get_time_zone, add_achievement, get_setup_chan_id
+from dbmanager import db_executemany, db_fetchall, db_transaction
+from auditlog import audit_log, find_audit_entry
+from guildconfig import get_config, guilds_with_setup, invalidate_config
+from messagestore import get_message, message_store, pop_message, store_message
+from dbschema import CHANNEL_COLUMNS
+from eventstages import MODLOGS_ORDER, register_stage, unregister_stage
+from raidmode import RAID_JOINS, RAID_SUMMARY_INTERVAL, RAID_WINDOW, raid_detector
+from startup import lazy_import
+
+
+# imported on the first new account alert (see startup.py)
+emoji = lazy_import("emoji")
 
 
 
@@ -31,65 +44,252 @@ class Modlogs(commands.Cog, name="modlogs"):
 
     Functions:
         is_a_bot_chan()
+        send_edit_log()
+        send_delete_log()
+        send_kick_log()
+        raid_embed()
+        send_raid_summary()
+
+    Task loop:
+        raid_summaries()
+
+    Pipeline stages:
+        message_stage()
+        edit_stage()
+        delete_stage()
 
     Listeners:
-        on_message_edit()
-        on_message_delete()
+        on_raw_message_edit()
+        on_raw_message_delete()
         on_bulk_message_delete()
         on_member_join()
-        on_member_remove()
+        on_raw_member_remove()
         on_member_ban()
         on_member_update()
         on_user_update()
         on_guild_channel_create()
         on_guild_channel_delete()
         on_guild_channel_update()
+        on_guild_remove()
+
+    Commands:
+        /raidmode
     """
     def __init__(self, bot):
         self.bot = bot
+        self.raid_summaries.start()
 
 
-    @commands.Cog.listener()
-    async def on_message_edit(self, before, after):
+    async def cog_load(self):
+        register_stage("modlogs", "message", self.message_stage, MODLOGS_ORDER, bots=True)
+        register_stage("modlogs", "message_edit", self.edit_stage, MODLOGS_ORDER)
+        register_stage("modlogs", "message_delete", self.delete_stage, MODLOGS_ORDER, bots=True)
+
+
+    async def cog_unload(self):
+        unregister_stage("modlogs")
+        self.raid_summaries.cancel()
+
+
+    def raid_embed(self, title, aggregate, raid, time_zone, ended):
+        """
+        Builds the summary of the members that joined or left during
+        a raid, with the account ages and the IDs.
+
+        The IDs go in a file when they don't fit in the embed.
+
+        Args:
+            title as str
+            aggregate as raidmode.RaidAggregate
+            raid as raidmode.GuildRaid
+            time_zone as pytz.timezone
+            ended as bool
+
+        Returns:
+            discord.Embed and discord.File (or None)
+        """
+        embed = discord.Embed(color=0xFF0000, title=title)
+        embed.add_field(name="Members", value=str(aggregate.count))
+        embed.add_field(
+            name="Account age",
+            value="\n".join(f"{label}: {count}" for label, count in aggregate.histogram())
+        )
+        ids = " ".join(str(member_id) for member_id in aggregate.ids)
+        if aggregate.count > len(aggregate.ids):
+            ids += f" (+{aggregate.count - len(aggregate.ids)} not kept)"
+        raid_file = None
+        if len(ids) <= 1024:
+            embed.add_field(name="IDs", value=ids, inline=False)
+        else:
+            raid_file = discord.File(
+                io.BytesIO("\n".join(str(member_id) for member_id in aggregate.ids).encode()),
+                filename="raid_ids.txt"
+            )
+            embed.add_field(name="IDs", value="See raid_ids.txt", inline=False)
+        started = raid.started_at.astimezone(time_zone).strftime('%Y-%m-%d %H:%M:%S')
+        embed.set_footer(text=f"Raid mode since {started}{' (ended)' if ended else ''}")
+        return embed, raid_file
+
+
+    async def send_raid_summary(self, guild, raid, ended):
+        """
+        Posts the aggregates of a raid in the joins, lefts and
+        edits channels.
+
+        Args:
+            guild as discord.Guild
+            raid as raidmode.GuildRaid with the aggregates
+            ended as bool, True when the raid mode just ended
         """
-        Listener to message edition.
+        config = await get_config(guild.id)
+        for aggregate, chans, title in (
+            (raid.joined, "joins", "Raid: members joined"),
+            (raid.left, "lefts", "Raid: members left")
+        ):
+            channel = self.bot.get_channel(config.get_setup(chans) or 0)
+            if not aggregate.count or channel is None:
+                continue
+            embed, raid_file = self.raid_embed(title, aggregate, raid, config.time_zone, ended)
+            if raid_file is None:
+                await channel.send(embed=embed)
+            else:
+                await channel.send(embed=embed, file=raid_file)
+        editschanname = self.bot.get_channel(config.get_setup("edits") or 0)
+        if raid.bulk_deletes and editschanname is not None:
+            await editschanname.send(
+                f"Raid: {raid.bulk_deletes} bulk deletions of {raid.deleted_messages} messages."
+            )
+        joinschanname = self.bot.get_channel(config.get_setup("joins") or 0)
+        if ended and joinschanname is not None:
+            await joinschanname.send("Raid mode ended, the joins are logged one by one again.")
+
+
+    @tasks.loop(seconds=RAID_SUMMARY_INTERVAL)
+    async def raid_summaries(self):
+        """
+        Posts the aggregates of the servers in raid mode.
+        """
+        for server_id, raid, ended in raid_detector.summaries():
+            guild = self.bot.get_guild(server_id)
+            if guild is None:
+                continue
+            try:
+                await self.send_raid_summary(guild, raid, ended)
+            except discord.HTTPException as err_raid:
+                print(f"Error sending the raid summary of {server_id}: {err_raid}")
+
+
+    @raid_summaries.before_loop
+    async def before_raid_summaries(self):
+        await self.bot.wait_until_ready()
+
+
+    @app_commands.command(
+        name="raidmode",
+        description="Setups when the joins are summarized instead of logged one by one"
+    )
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        joins="Joins starting the raid mode (0~1000, 0 to turn off)",
+        seconds="Seconds in which the joins are counted (5~3600)"
+    )
+    async def raidmode(self, interaction: Interaction, joins: int, seconds: int):
+        """
+        Setups the raid mode of the server.
+
+        When `joins` members join within `seconds`, the joins,
+        leaves and bulk deletions are posted as summaries and
+        the welcome messages are paused until the joins slow down.
+
+        Args:
+            interaction as discord.Interaction
+            joins as int (0 to turn off the raid mode)
+            seconds as int
+        """
+        if not 0 <= joins <= 1000 or not 5 <= seconds <= 3600:
+            await interaction.response.send_message(
+                content="Joins must be from 0 to 1000 and seconds from 5 to 3600.",
+                ephemeral=True
+            )
+            return
+        await db_executemany(
+            interaction.guild.id,
+            "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)",
+            [("raid_joins", joins), ("raid_window", seconds)]
+        )
+        invalidate_config(interaction.guild.id)
+        if joins == 0:
+            content = "The raid mode is now off."
+        else:
+            content = f"The raid mode now starts at {joins} joins within {seconds} seconds."
+        await interaction.response.send_message(content=content, ephemeral=True)
+
+
+    async def message_stage(self, event):
+        """
+        Pipeline stage for new messages.
+
+        Records the message in the message store (see
+        messagestore.py) when the server logs the edits,
+        so the logs still work once discord.py forgot it.
+
+        Args:
+            event as eventstages.GuildEvent
+        """
+        if event.config.get_setup("edits"):
+            store_message(event.message)
+
+
+    async def edit_stage(self, event):
+        """
+        Pipeline stage for message edition.
 
         This will post an embed in a specific channel
         when any message is edited. The post will
         show the before and after the editing.
 
-        The listener also takes in consideration when
-        a channel is added to the exception's list.
-
         Args:
-            None
+            event as eventstages.GuildEvent
         """
-        if str(after.channel.type) == "private":
-            return
-        if after.author.bot:
-            return
+        before, after = event.before, event.message
         if before.content == after.content:
             return
+        await self.send_edit_log(
+            event.config, after, before.content, before.created_at,
+            [attachment.url for attachment in before.attachments]
+        )
+
+
+    async def send_edit_log(self, config, after, before_content, created_at, before_attachments):
+        """
+        Posts the embed of an edited message.
 
-        conn, cur = get_server_database(after.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("edits",))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
+        Args:
+            config as GuildConfig
+            after as discord.Message
+            before_content as str
+            created_at as datetime of the message
+            before_attachments as list of URLs
+        """
+        chan_id = config.get_setup("edits")
+        if not chan_id:
+            return
+        editschanname = self.bot.get_channel(chan_id)
+        if editschanname is None:
             return
-        editschanname = self.bot.get_channel(row[0])
         permissions = editschanname.permissions_for(editschanname.guild.me)
         if not permissions.embed_links:
             return
-        time_zone = await get_time_zone(after.guild.id)
-        created_timestamp = before.created_at.astimezone(time_zone).strftime("%Y-%m-%d %H:%M:%S")
+        time_zone = config.time_zone
+        created_timestamp = created_at.astimezone(time_zone).strftime("%Y-%m-%d %H:%M:%S")
         edited_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         embed = discord.Embed(
             color=0xF1C40F,
             url=after.jump_url,
             title="Message edited\n"
             f"in {after.channel.mention}",
-            description=f"***Before***: {before.content}\n"
+            description=f"***Before***: {before_content}\n"
             f"***@After***: {after.content}"
         )
         embed.add_field(
@@ -98,9 +298,9 @@ class Modlogs(commands.Cog, name="modlogs"):
                 f"After: (edited at: {edited_timestamp})",
             inline=False
         )
-        for attachment in before.attachments:
-            embed.set_image(url=attachment.url)
-            embed.add_field(name="Attachment", value=attachment.url, inline=False)
+        for url in before_attachments:
+            embed.set_image(url=url)
+            embed.add_field(name="Attachment", value=url, inline=False)
         for attachment in after.attachments:
             embed.set_image(url=attachment.url)
             embed.add_field(name="Attachment", value=attachment.url, inline=False)
@@ -115,10 +315,9 @@ class Modlogs(commands.Cog, name="modlogs"):
         await editschanname.send(embed=embed)
 
 
-    @commands.Cog.listener()
-    async def on_message_delete(self, message):
+    async def delete_stage(self, event):
         """
-        Listener to deletion.
+        Pipeline stage for message deletion.
 
         This will post an embed in a specific channel
         when any message is deleted. The post will
@@ -128,47 +327,125 @@ class Modlogs(commands.Cog, name="modlogs"):
         a channel is added to the exception's list.
 
         Args:
-            None
+            event as eventstages.GuildEvent
+        """
+        message = event.message
+        if not event.is_exception("delete"):
+            await self.send_delete_log(
+                event.config, message.channel, message.author, message.author.id,
+                message.created_at, message.content,
+                [attachment.url for attachment in message.attachments]
+            )
+
+
+    async def send_delete_log(
+        self, config, channel, author, author_id, created_at, content, attachments
+    ):
+        """
+        Posts the embed of a deleted message.
+
+        Args:
+            config as GuildConfig
+            channel as the channel of the message
+            author as discord.Member or discord.User (None if unknown)
+            author_id as member.id
+            created_at as datetime of the message
+            content as str
+            attachments as list of URLs
         """
-        if str(message.channel.type) == "private":
+        chan_id = config.get_setup("edits")
+        if chan_id:
+            editschanname = self.bot.get_channel(chan_id)
+            if editschanname is None:
+                return
+            permissions = editschanname.permissions_for(editschanname.guild.me)
+            if not permissions.embed_links:
+                return
+            time_zone = config.time_zone
+            time_created = created_at.astimezone(time_zone).strftime("%Y-%m-%d %H:%M:%S")
+            embed = discord.Embed(
+                color=0xFF0000,
+                title=f"Message deleted \nin: {channel.mention}",
+                description=f"***message***: {content}"
+            )
+            embed.add_field(
+                name="",
+                value=f"\nMessage: created at {time_created}", inline=False
+            )
+            if author is None:
+                embed.set_footer(text=f"Message from: {author_id}")
+            elif author.avatar:
+                embed.set_footer(
+                    text=f"Message from: {author.display_name}",
+                    icon_url=author.avatar.url
+                )
+            else:
+                embed.set_footer(text=f"Message from: {author.display_name}")
+            for url in attachments:
+                embed.set_image(url=url)
+                embed.add_field(name="Attachment", value=url, inline=False)
+            embed.timestamp = datetime.now(time_zone)
+            await editschanname.send(embed=embed)
+
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        """
+        Listener to the edits of every message.
+
+        Keeps the message store up to date, and logs the
+        edits of the messages that discord.py no longer has
+        in its cache (the others go through edit_stage()).
+
+        Args:
+            payload as discord.RawMessageUpdateEvent
+        """
+        if payload.guild_id is None:
             return
-        if not message.guild:
+        config = await get_config(payload.guild_id)
+        if not config.get_setup("edits"):
             return
-        conn, cur = get_server_database(message.guild.id)
-        if not is_exception(message.guild.id, message.channel.id, "delete"):
-            cur.execute("SELECT id FROM setup WHERE chans = ?", ("edits",))
-            row = cur.fetchone()
-            conn.close()
-            if row:
-                editschanname = self.bot.get_channel(row[0])
-                permissions = editschanname.permissions_for(editschanname.guild.me)
-                if not permissions.embed_links:
-                    return
-                time_zone = await get_time_zone(message.guild.id)
-                time_created = (
-                    message.created_at.astimezone(time_zone).strftime("%Y-%m-%d %H:%M:%S")
-                )
-                embed = discord.Embed(
-                    color=0xFF0000,
-                    title=f"Message deleted \nin: {message.channel.mention}",
-                    description=f"***message***: {message.content}"
-                )
-                embed.add_field(
-                    name="",
-                    value=f"\nMessage: created at {time_created}", inline=False
-                )
-                if message.author.avatar:
-                    embed.set_footer(
-                        text=f"Message from: {message.author.display_name}",
-                        icon_url=message.author.avatar.url
-                    )
-                else:
-                    embed.set_footer(text=f"Message from: {message.author.display_name}")
-                for attachment in message.attachments:
-                    embed.set_image(url=attachment.url)
-                    embed.add_field(name="Attachment", value=attachment.url, inline=False)
-                embed.timestamp = datetime.now(time_zone)
-                await editschanname.send(embed=embed)
+        after = payload.message
+        before = get_message(payload.guild_id, payload.message_id)
+        store_message(after)
+        if payload.cached_message is not None or before is None or after.author.bot:
+            return
+        if before.content == after.content:
+            return
+        await self.send_edit_log(
+            config, after, before.content, before.created_at, before.attachments
+        )
+
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        """
+        Listener to the deletion of every message.
+
+        Logs the deleted messages that discord.py no longer
+        has in its cache from the message store (the others
+        go through delete_stage()).
+
+        Args:
+            payload as discord.RawMessageDeleteEvent
+        """
+        if payload.guild_id is None:
+            return
+        stored = pop_message(payload.guild_id, payload.message_id)
+        if payload.cached_message is not None or stored is None:
+            return
+        config = await get_config(payload.guild_id)
+        if config.is_exception(payload.channel_id, "delete"):
+            return
+        guild = self.bot.get_guild(payload.guild_id)
+        channel = guild.get_channel_or_thread(payload.channel_id) if guild else None
+        if channel is None:
+            return
+        author = guild.get_member(stored.author_id) or self.bot.get_user(stored.author_id)
+        await self.send_delete_log(
+            config, channel, author, stored.author_id, stored.created_at,
+            stored.content, stored.attachments
+        )
 
 
     @commands.Cog.listener()
@@ -177,30 +454,33 @@ class Modlogs(commands.Cog, name="modlogs"):
         Listener to deletion.
 
         This will post an embed in a specific channel
-        when any message is deleted. The post will
-        show the message and the author.
-
-        The listener also takes in consideration when
-        a channel is added to the exception's list.
+        when messages are deleted in bulk. The post will
+        show who deleted them (see auditlog.py).
 
         Args:
             None
         """
         guild = message[0].guild
-        server_id = guild.id
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("edits",))
-        row = cur.fetchone()
-        conn.close()
-        if not row:
+        channel = message[0].channel
+        chan_id = await get_setup_chan_id(guild.id, "edits")
+        if not chan_id:
+            return
+        raid = raid_detector.active(guild.id)
+        if raid is not None:
+            raid.bulk_deletes += 1
+            raid.deleted_messages += len(message)
             return
-        async for entry in guild.audit_logs(action=discord.AuditLogAction.message_delete):
-            if entry.target.id in [msg.author.id for msg in message]:
-                responsible_user = entry.user
-                embed = discord.Embed(color=0xF1C40F, title=f"Deleted by: {responsible_user}")
-                editschan = int(row[0])
-                editschanname = self.bot.get_channel(editschan)
-                await editschanname.send(embed=embed)
+        editschanname = self.bot.get_channel(int(chan_id))
+        if editschanname is None:
+            return
+        entry = await find_audit_entry(
+            guild, discord.AuditLogAction.message_bulk_delete, channel.id, retry=True
+        )
+        if entry is None:
+            return
+        embed = discord.Embed(color=0xF1C40F, title=f"Deleted by: {entry.user}")
+        embed.add_field(name="Bulk deletion", value=f"{len(message)} messages in {channel.mention}")
+        await editschanname.send(embed=embed)
 
 
     @commands.Cog.listener()
@@ -217,14 +497,40 @@ class Modlogs(commands.Cog, name="modlogs"):
         The listener also sends a welcome message in
         a specific channel with a random message.
 
+        During a raid (see raidmode.py), the member is
+        added to the summary and not welcomed.
+
         Args:
             None
         """
-        conn, cur = get_server_database(member.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("joins",))
-        row = cur.fetchone()
-        if row:
-            joinschanname = self.bot.get_channel(row[0])
+        config = await get_config(member.guild.id)
+        raid_joins = config.get_setup("raid_joins")
+        raid_window = config.get_setup("raid_window")
+        was_raid = raid_detector.active(member.guild.id) is not None
+        if raid_joins != 0 and raid_detector.record_join(
+            member.guild.id,
+            RAID_JOINS if raid_joins is None else raid_joins,
+            RAID_WINDOW if raid_window is None else raid_window
+        ):
+            raid_detector.active(member.guild.id).joined.add(member)
+            joinschanname = self.bot.get_channel(config.get_setup("joins") or 0)
+            if not was_raid and joinschanname is not None:
+                await joinschanname.send(
+                    f"Raid mode: {RAID_JOINS if raid_joins is None else raid_joins} joins "
+                    f"within {RAID_WINDOW if raid_window is None else raid_window} seconds. "
+                    f"The joins and leaves are summarized every {RAID_SUMMARY_INTERVAL} "
+                    "seconds and the welcome messages are paused."
+                )
+            return
+
+        welcome_msgs = [
+            f"Welcome aboard **{member.display_name}**!",
+            f"It is a pleasure to have you here **{member.display_name}**!",
+            f"Oy! **{member.display_name}** just arrived!"
+        ]
+        chan_id = await get_setup_chan_id(member.guild.id, "joins")
+        if chan_id:
+            joinschanname = self.bot.get_channel(chan_id)
             permissions = joinschanname.permissions_for(joinschanname.guild.me)
             if not permissions.embed_links:
                 return
@@ -268,21 +574,14 @@ class Modlogs(commands.Cog, name="modlogs"):
                 )
             await joinschanname.send(embed=embed)
 
-            welcome_msgs = [
-                f"Welcome aboard **{member.display_name}**!",
-                f"It is a pleasure to have you here **{member.display_name}**!",
-                f"Oy! **{member.display_name}** just arrived!"
-            ]
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("welcome",))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            welcomechanname = self.bot.get_channel(row[0])
+        chan_id = await get_setup_chan_id(member.guild.id, "welcome")
+        if chan_id:
+            welcomechanname = self.bot.get_channel(chan_id)
             await welcomechanname.send(random.choice(welcome_msgs))
 
 
     @commands.Cog.listener()
-    async def on_member_remove(self, member):
+    async def on_raw_member_remove(self, payload):
         """
         Listener member leaving the server.
 
@@ -291,19 +590,42 @@ class Modlogs(commands.Cog, name="modlogs"):
         will show informations about the user, such as
         for how long he was on the server.
 
+        The raw event also fires for the members out of the
+        cache (see cachepolicy.py), whose join date and roles
+        are then unknown.
+
+        During a raid (see raidmode.py), the member is
+        added to the summary instead.
+
         Args:
-            None
+            payload as discord.RawMemberRemoveEvent
         """
-        conn, cur = get_server_database(member.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("lefts",))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            leftschanname = self.bot.get_channel(row[0])
+        member = payload.user
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild is None:
+            return
+        raid = raid_detector.active(guild.id)
+        if raid is not None:
+            raid.left.add(member)
+            return
+        chan_id = await get_setup_chan_id(guild.id, "lefts")
+        if chan_id:
+            leftschanname = self.bot.get_channel(chan_id)
             permissions = leftschanname.permissions_for(leftschanname.guild.me)
             if not permissions.embed_links:
                 return
-            time_zone = await get_time_zone(member.guild.id)
+            if not isinstance(member, discord.Member):
+                embed = discord.Embed(color=0xFF0000, title=member)
+                embed.set_thumbnail(url=member.avatar)
+                embed.add_field(
+                    name="Member left",
+                    value=f"{member.display_name} ({member.id}) \n"
+                        "Join date and roles unknown (member not cached)"
+                )
+                await leftschanname.send(embed=embed)
+                await self.send_kick_log(guild, member, leftschanname)
+                return
+            time_zone = await get_time_zone(guild.id)
 
             joined_gap = datetime.now(pytz.utc) - member.joined_at
             years = joined_gap.days // 365
@@ -338,24 +660,33 @@ class Modlogs(commands.Cog, name="modlogs"):
             )
 
             await leftschanname.send(embed=embed)
+            await self.send_kick_log(guild, member, leftschanname)
 
-            guild = member.guild
-            if guild.me.guild_permissions.view_audit_log:
-                async for entry in guild.audit_logs(action=discord.AuditLogAction.kick, limit=1):
-                    if entry.target == member:
-                        moderator = entry.user
-                        reason = entry.reason
-                        if reason is None:
-                            reason = "No reason provided"
-
-                        embedkick = discord.Embed(color=0xFF0000, title=member)
-                        embedkick.set_thumbnail(url=member.avatar)
-                        embedkick.add_field(
-                            name="Member kicked",
-                            value=f"{member.display_name} ({member.id}) \nKicked by {moderator}\n"
-                            f"Reason: {reason}"
-                        )
-                        await leftschanname.send(embed=embedkick)
+
+    async def send_kick_log(self, guild, member, leftschanname):
+        """
+        Posts the kick of a member that left, if it was one.
+
+        Args:
+            guild as discord.Guild
+            member as discord.Member or discord.User
+            leftschanname as discord.TextChannel
+        """
+        entry = await find_audit_entry(guild, discord.AuditLogAction.kick, member.id)
+        if entry is not None:
+            moderator = entry.user
+            reason = entry.reason
+            if reason is None:
+                reason = "No reason provided"
+
+            embedkick = discord.Embed(color=0xFF0000, title=member)
+            embedkick.set_thumbnail(url=member.avatar)
+            embedkick.add_field(
+                name="Member kicked",
+                value=f"{member.display_name} ({member.id}) \nKicked by {moderator}\n"
+                f"Reason: {reason}"
+            )
+            await leftschanname.send(embed=embedkick)
 
 
     @commands.Cog.listener()
@@ -370,17 +701,13 @@ class Modlogs(commands.Cog, name="modlogs"):
         Args:
             None
         """
-        conn, cur = get_server_database(guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("lefts",))
-        row = cur.fetchone()
-        conn.close()
-        if row:
+        chan_id = await get_setup_chan_id(guild.id, "lefts")
+        if chan_id:
             if guild.me.guild_permissions.view_audit_log:
-                async for entry in guild.audit_logs(action=discord.AuditLogAction.ban, limit=1):
-                    if entry.target == user:
-                        moderator = entry.user
-                    else:
-                        moderator = "No name in audit"
+                entry = await find_audit_entry(
+                    guild, discord.AuditLogAction.ban, user.id, retry=True
+                )
+                moderator = entry.user if entry else "No name in audit"
             else:
                 moderator = "no view audit"
 
@@ -396,7 +723,7 @@ class Modlogs(commands.Cog, name="modlogs"):
                 name=f"MEMBER {user.mention} BANNED",
                 value=f"Moderator: {moderator}\nReason: {reason}."
             )
-            chan_left = self.bot.get_channel(row[0])
+            chan_left = self.bot.get_channel(chan_id)
             permissions = chan_left.permissions_for(chan_left.guild.me)
             if not permissions.embed_links:
                 await chan_left.send(
@@ -423,12 +750,9 @@ class Modlogs(commands.Cog, name="modlogs"):
         if after.bot:
             return
 
-        conn, cur = get_server_database(after.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("users",))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            userschanname = self.bot.get_channel(row[0])
+        chan_id = await get_setup_chan_id(after.guild.id, "users")
+        if chan_id:
+            userschanname = self.bot.get_channel(chan_id)
 
             if userschanname:
                 permissions = userschanname.permissions_for(userschanname.guild.me)
@@ -537,29 +861,25 @@ class Modlogs(commands.Cog, name="modlogs"):
         if before.avatar == after.avatar:
             return
 
-        for guilds in after.mutual_guilds:
-            server_id = guilds.id
-            conn, cur = get_server_database(server_id)
-            cur.execute("SELECT id FROM setup WHERE chans = ?", ("users",))
-            row = cur.fetchone()
-            conn.close()
-
-            if row:
-                userschan = int(row[0])
-                userschanname = self.bot.get_channel(userschan)
-                permissions = userschanname.permissions_for(userschanname.guild.me)
-                if not permissions.embed_links:
-                    return
-                embed = discord.Embed(color=0x00FF00, title="USER AVATAR UPDATE")
-                embed.add_field(
-                    name="New user avatar",
-                    value=f"{after.mention} ({after.id})\n"
-                        f"Name: {after.display_name}",
-                    inline=True
-                )
-                embed.set_thumbnail(url=before.avatar)
-                embed.set_image(url=after.avatar)
-                await userschanname.send(embed=embed)
+        # only the mutual servers with a "users" channel (see guildconfig.py)
+        users_chans = await guilds_with_setup("users", [guild.id for guild in after.mutual_guilds])
+        for chan_id in users_chans.values():
+            userschanname = self.bot.get_channel(int(chan_id))
+            if userschanname is None:
+                continue
+            permissions = userschanname.permissions_for(userschanname.guild.me)
+            if not permissions.embed_links:
+                continue
+            embed = discord.Embed(color=0x00FF00, title="USER AVATAR UPDATE")
+            embed.add_field(
+                name="New user avatar",
+                value=f"{after.mention} ({after.id})\n"
+                    f"Name: {after.display_name}",
+                inline=True
+            )
+            embed.set_thumbnail(url=before.avatar)
+            embed.set_image(url=after.avatar)
+            await userschanname.send(embed=embed)
 
 
     @commands.Cog.listener()
@@ -576,12 +896,9 @@ class Modlogs(commands.Cog, name="modlogs"):
         Args:
             None
         """
-        conn, cur = get_server_database(channel.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("audits",))
-        row = cur.fetchone()
-        conn.close()
-        if row:
-            auditschanname = self.bot.get_channel(row[0])
+        chan_id = await get_setup_chan_id(channel.guild.id, "audits")
+        if chan_id:
+            auditschanname = self.bot.get_channel(chan_id)
             permissions = auditschanname.permissions_for(auditschanname.guild.me)
             if not permissions.embed_links:
                 return
@@ -610,31 +927,26 @@ class Modlogs(commands.Cog, name="modlogs"):
         sure that any deleted channel was not a part
         of it's database, such as modlogs channels.
 
-        If the deleted channel was part of the database,
-        a message will be sent to a specific channel
-        letting know the mods that an important channel
-        has been deleted.
+        The channels saved in the database are known from
+        the GuildConfig (see CHANNEL_COLUMNS in dbschema.py),
+        so most deletions don't run any query. A saved channel
+        is removed from every table in a single transaction.
 
         Args:
             guild
             channel
-        """
-        conn, cur = get_server_database(guild.id)
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cur.fetchall()]
 
-        for table_name in tables:
-            cur.execute(f"PRAGMA table_info({table_name})")
-            column_names = [row[1] for row in cur.fetchall()]
-
-            if "id" in column_names:
-                cur.execute(f"SELECT * FROM {table_name} WHERE id = ?", (channel.id,))
-                row = cur.fetchone()
-                if row:
-                    cur.execute(f"DELETE FROM {table_name} WHERE id = ?", (channel.id,))
-                    conn.commit()
-
-        conn.close()
+        Returns:
+            True if the channel was part of the database
+        """
+        config = await get_config(guild.id)
+        if not config.references(channel.id):
+            return False
+        async with db_transaction(guild.id) as trans:
+            for table, column in CHANNEL_COLUMNS:
+                await trans.execute(f"DELETE FROM {table} WHERE {column} = ?", (channel.id,))
+        invalidate_config(guild.id)
+        return True
 
 
     @commands.Cog.listener()
@@ -655,29 +967,19 @@ class Modlogs(commands.Cog, name="modlogs"):
         Args:
             channel
         """
-        is_setup_chan = False
-        conn, cur = get_server_database(channel.guild.id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("audits",))
-        auditschanid = cur.fetchone()
-        cur.execute("SELECT * FROM setup WHERE id = ?", (channel.id,))
-        setupchan = cur.fetchall()
-        if auditschanid is not None:
-            if auditschanid[0] == channel.id:
-                cur.execute("DELETE FROM setup WHERE id = ?", (channel.id,))
-                conn.commit()
-                conn.close()
-                return
-        if setupchan:
-            cur.execute("DELETE FROM setup WHERE id = ?", (channel.id,))
-            is_setup_chan = True
-            conn.commit()
-        conn.close()
+        config = await get_config(channel.guild.id)
+        auditschanid = config.get_setup("audits")
+        setupchan = [
+            (chans, chan_id) for chans, chan_id in config.setup.items() if chan_id == channel.id
+        ]
+        await self.is_a_bot_chan(channel.guild, channel)
+        if auditschanid == channel.id:
+            return
         if auditschanid:
-            auditschanname = self.bot.get_channel(auditschanid[0])
+            auditschanname = self.bot.get_channel(auditschanid)
             permissions = auditschanname.permissions_for(auditschanname.guild.me)
             if not permissions.embed_links:
                 return
-            await self.is_a_bot_chan(channel.guild, channel)
 
             if isinstance(channel, discord.TextChannel):
                 type_deleted = "Channel"
@@ -693,7 +995,7 @@ class Modlogs(commands.Cog, name="modlogs"):
                 name=f"{type_deleted} deleted",
                 value=f"{channel.category} \n╚►***{channel}***"
             )
-            if is_setup_chan == True:
+            if setupchan:
                 embed.add_field(
                     name="Setup channel deleted",
                     value=f"__**#{channel.name}**__ was the channel for {setupchan[0][0]}.\n"
@@ -717,9 +1019,9 @@ class Modlogs(commands.Cog, name="modlogs"):
         Args:
             None
         """
-        conn, cur = get_server_database(after.guild.id)
-        cur.execute("SELECT * FROM servstats WHERE id = ?", (before.id,))
-        rows = cur.fetchall()
+        rows = await db_fetchall(
+            after.guild.id, "SELECT * FROM servstats WHERE id = ?", (before.id,)
+        )
 
         if isinstance(after, discord.TextChannel):
             type_updated = "Channel"
@@ -731,11 +1033,9 @@ class Modlogs(commands.Cog, name="modlogs"):
             type_updated = "Other channel"
 
         if not rows:
-            cur.execute("SELECT id FROM setup WHERE chans = ?", ("audits",))
-            row = cur.fetchone()
-            conn.close()
-            if row:
-                auditschanname = self.bot.get_channel(row[0])
+            chan_id = await get_setup_chan_id(after.guild.id, "audits")
+            if chan_id:
+                auditschanname = self.bot.get_channel(chan_id)
                 permissions = auditschanname.permissions_for(auditschanname.guild.me)
                 if not permissions.embed_links:
                     return
@@ -746,8 +1046,35 @@ class Modlogs(commands.Cog, name="modlogs"):
                         name="After",
                         value=f"{after.category} \n╚►***{after} ({after.mention})***")
                     await auditschanname.send(embed=embed)
-        else:
-            conn.close()
+
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        """
+        Listener to the bot leaving a server.
+
+        Drops the audit log index (see auditlog.py) and the
+        stored messages (see messagestore.py) of the server.
+
+        Args:
+            guild as discord.Guild
+        """
+        audit_log.forget(guild.id)
+        message_store.forget(guild.id)
+
+
+    @commands.Cog.listener()
+    async def on_audit_log_entry_create(self, entry):
+        """
+        Listener to the new audit log entries of a server.
+
+        Indexes the entry for the lookups of the modlogs (see
+        auditlog.py).
+
+        Args:
+            entry as discord.AuditLogEntry
+        """
+        audit_log.record(entry)
 
 
 
@@ -0,0 +1,110 @@
+# pipeline.py
+"""
+Event pipeline cog.
+
+This cog receives the message events once for the whole bot,
+resolves the configuration of the server once, then runs the
+stages that the other cogs registered (see eventstages.py).
+
+Author: Elcoyote Solitaire
+"""
+from discord.ext import commands
+from eventstages import GuildEvent, event_stages
+from guildconfig import get_config
+
+
+
+class Pipeline(commands.Cog, name="pipeline"):
+    """
+    Pipeline class for the message events.
+
+    Functions:
+        dispatch()
+
+    Listeners:
+        on_message()
+        on_message_edit()
+        on_message_delete()
+
+    Commands:
+        !stagestats
+    """
+    def __init__(self, bot):
+        self.bot = bot
+
+
+    async def dispatch(self, kind, message, before=None):
+        """
+        Builds the GuildEvent and runs the stages of the event.
+
+        Args:
+            kind as str from eventstages.EVENTS
+            message as discord.Message
+            before as discord.Message (for an edit)
+        """
+        if message.guild is None:
+            return
+        if not event_stages.wanted(kind, message.author.bot):
+            return
+        config = await get_config(message.guild.id)
+        await event_stages.dispatch(GuildEvent(kind, message, config, before))
+
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        """
+        Listener for messages.
+
+        Args:
+            message: The message.
+        """
+        await self.dispatch("message", message)
+
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before, after):
+        """
+        Listener for edited messages.
+
+        Args:
+            before: The message before the edition.
+            after: The message after the edition.
+        """
+        await self.dispatch("message_edit", after, before)
+
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message):
+        """
+        Listener for message deletion.
+
+        Args:
+            message: The deleted message.
+        """
+        await self.dispatch("message_delete", message)
+
+
+    @commands.command()
+    @commands.is_owner()
+    async def stagestats(self, ctx: commands.Context):
+        """
+        Shows the timing of every stage of the pipeline.
+
+        Args:
+            ctx as commands.Context
+        """
+        lines = [
+            f"{stage['event']} #{stage['order']} {stage['name']}: {stage['calls']} calls, "
+            f"{stage['average_ms']:.2f} ms avg, {stage['max_ms']:.2f} ms max, "
+            f"{stage['errors']} errors"
+            for stage in event_stages.stats()
+        ]
+        await ctx.send("\n".join(lines) or "No stage registered.")
+
+
+
+async def setup(bot):
+    """
+    Loads the cog on start.
+    """
+    await bot.add_cog(Pipeline(bot))
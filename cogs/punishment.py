@@ -16,7 +16,9 @@ from datetime import timedelta
 from discord import app_commands, Interaction
 from discord.utils import get
 from discord.ext import commands
+from cachepolicy import resolve_member
 from cogs.intercogs import get_server_database, get_time_zone, add_achievement
+from guildconfig import invalidate_config
 
 
 
@@ -65,6 +67,7 @@ class Punishment(commands.Cog, name="punishment"):
         cur.execute("REPLACE INTO setup (chans, id) VALUES ('punishreq', '10')")
         conn.commit()
         conn.close()
+        invalidate_config(server_id)
         return punishreq
 
 
@@ -82,7 +85,7 @@ class Punishment(commands.Cog, name="punishment"):
             target_id as discord.Member.id (forced integer)
         """
         await interaction.response.send_message(
-            f"Timer started for {interaction.guild.get_member(target_id)}.",
+            f"Timer started for {await resolve_member(interaction.guild, target_id)}.",
             ephemeral=True
         )
         await asyncio.sleep(300)  # 5 minutes
@@ -110,10 +113,11 @@ class Punishment(commands.Cog, name="punishment"):
             context = await self.bot.get_context(interaction)
             message = await context.fetch_message(message_id)
             embed = message.embeds[0]
+            target = await resolve_member(interaction.guild, target_id)
             embed.add_field(
                 name="Time's up!",
                 value=f"Not enough people used the command against "
-                    f"{interaction.guild.get_member(target_id).display_name}.",
+                    f"{target.display_name if target else f'<@{target_id}>'}.",
                 inline=False
             )
             await message.edit(embed=embed)
@@ -197,7 +201,7 @@ class Punishment(commands.Cog, name="punishment"):
                 ephemeral=True
             )
             return
-        if target not in interaction.guild.members:
+        if await resolve_member(interaction.guild, target.id) is None:
             await interaction.response.send_message(
                 content=f"{target} is not a member of {interaction.guild.name}.",
                 ephemeral=True
@@ -326,6 +330,7 @@ class Punishment(commands.Cog, name="punishment"):
                 "INSERT OR REPLACE INTO setup (chans, id) VALUES ('punishreq', ?)", (requirement,)
             )
             conn.commit()
+            invalidate_config(interaction.guild.id)
             await interaction.response.send_message(
                 f"New requirement for punishment is {requirement}.",
                 ephemeral=True
@@ -364,6 +369,7 @@ class Punishment(commands.Cog, name="punishment"):
         cur.execute("INSERT OR REPLACE INTO setup (chans, id) VALUES ('punishtime', ?)", (length,))
         conn.commit()
         conn.close()
+        invalidate_config(interaction.guild.id)
         await interaction.response.send_message(
             content=f"New length for punishment is {length} minutes.",
             ephemeral=True
@@ -23,7 +23,8 @@ import pytz
 from datetime import datetime, timedelta
 from discord import app_commands, Interaction
 from discord.ext import commands, tasks
-from cogs.intercogs import get_server_database, get_time_zone, get_setup_chan_id
+from cogs.intercogs import get_server_database, get_time_zone, get_setup_chan_id, shard_guilds
+from eventstages import QUIZ_ORDER, register_stage, unregister_stage
 
 
 
@@ -44,6 +45,9 @@ class Quiz(commands.Cog, name="quiz"):
     Commands:
         /quiz_start
         /trivia
+
+    Pipeline stages:
+        message_stage()
     """
     def __init__(self, bot):
         self.bot = bot
@@ -59,10 +63,12 @@ class Quiz(commands.Cog, name="quiz"):
 
 
     async def cog_load(self):
+        register_stage("quiz", "message", self.message_stage, QUIZ_ORDER)
         asyncio.create_task(self.after_on_ready())
 
 
     async def cog_unload(self):
+        unregister_stage("quiz")
         self.run_trivia.cancel()
 
 
@@ -70,7 +76,7 @@ class Quiz(commands.Cog, name="quiz"):
         """
         Loads all datas for quiz game
         """
-        for guild in self.bot.guilds:
+        for guild in shard_guilds():
             self.guild_quiz_data[guild.id] = {
                 "starter": "",
                 "question": "",
@@ -79,11 +85,10 @@ class Quiz(commands.Cog, name="quiz"):
                 "timestamp": ""
             }
             self.quiz_tasks[guild.id] = ""
-            conn, cur = get_server_database(guild.id)
-            cur.execute("SELECT id FROM setup WHERE chans = ?", ("quiz",))
-            quizchan_id = cur.fetchone()
+            quizchan_id = await get_setup_chan_id(guild.id, "quiz")
             if quizchan_id:
-                self.guild_quiz_data[guild.id]["quizchan"] = quizchan_id[0]
+                conn, cur = get_server_database(guild.id)
+                self.guild_quiz_data[guild.id]["quizchan"] = quizchan_id
                 cur.execute("SELECT * FROM quiz")
                 quiz_data = cur.fetchall()
                 if quiz_data:
@@ -116,8 +121,6 @@ class Quiz(commands.Cog, name="quiz"):
                         )
                 else:
                     conn.close()
-            else:
-                conn.close()
 
 
     async def quiz_timer(self, guild_id, seconds_left):
@@ -274,18 +277,18 @@ class Quiz(commands.Cog, name="quiz"):
         )
 
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    async def message_stage(self, event):
         """
-        Listener for messages.
+        Pipeline stage for messages.
 
         Triggers when the channel is the quiz channel
         and the correct answer is given by a member.
 
         Args:
-            message: The message.
+            event as eventstages.GuildEvent
         """
-        if message.author.bot:
+        message = event.message
+        if message.channel.guild.id not in self.guild_quiz_data:
             return
         if message.author.id == self.guild_quiz_data[message.channel.guild.id]["starter"] and self.trivia is False:
             return
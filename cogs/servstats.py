@@ -17,7 +17,10 @@ from datetime import datetime, time, timedelta
 from discord import app_commands, Interaction
 from discord.ext import commands, tasks
 from discord.utils import get
-from cogs.intercogs import get_server_database, get_time_zone, add_achievement
+from cachepolicy import cache_policy, count_bots
+from cogs.intercogs import get_server_database, get_time_zone, add_achievement, shard_guilds
+from dbmanager import db_fetchone, db_fetchall
+from guildconfig import invalidate_config
 
 # add checks for permissions to manage roles, channels and permissions
 
@@ -70,21 +73,9 @@ class Servstats(commands.Cog, name="servstats"):
         clock_channel = await guild.create_voice_channel(
             name=f"Local: {datetime.now(time_zone).strftime('%H:%M')}",
             position=0, overwrites=overwrites)
-        cur.execute("SELECT * FROM servstats WHERE chans = ?", ("clock",))
-        existing_row = cur.fetchone()
-        if existing_row:
-            cur.execute(
-                "UPDATE servstats SET id = ?, region = ? WHERE chans = ?",
-                (clock_channel.id, "America/Montreal", "clock")
-            )
-        else:
-            cur.execute(
-                "INSERT INTO servstats (chans, id, region) VALUES(?, ?, ?)",
-                ("clock", clock_channel.id, "America/Montreal")
-            )
 
         # stats [members, users, bots, categories, channels, roles]
-        bot_count = sum(member.bot for member in guild.members)
+        bot_count = await count_bots(guild)
         channel_count = len([
             channel for channel in guild.channels if not isinstance(
                 channel, discord.CategoryChannel
@@ -119,6 +110,20 @@ class Servstats(commands.Cog, name="servstats"):
             name=f"[Roles]: {len(guild.roles)}", category=stats_cat, overwrites=overwrites
         )
 
+        # every write after the awaits, so the database of the server
+        # is not locked while the channels are created
+        cur.execute("SELECT * FROM servstats WHERE chans = ?", ("clock",))
+        existing_row = cur.fetchone()
+        if existing_row:
+            cur.execute(
+                "UPDATE servstats SET id = ?, region = ? WHERE chans = ?",
+                (clock_channel.id, "America/Montreal", "clock")
+            )
+        else:
+            cur.execute(
+                "INSERT INTO servstats (chans, id, region) VALUES(?, ?, ?)",
+                ("clock", clock_channel.id, "America/Montreal")
+            )
         cur.execute(
             "INSERT OR REPLACE INTO servstats (chans, id) VALUES(?, ?)",
             ("members", members_channel.id)
@@ -146,6 +151,7 @@ class Servstats(commands.Cog, name="servstats"):
 
         conn.commit()
         conn.close()
+        invalidate_config(guild.id)
         await interaction.response.send_message(
             content="The channels for the server's stats have been created.",
             ephemeral=True
@@ -186,12 +192,11 @@ class Servstats(commands.Cog, name="servstats"):
             None
         """
         if datetime.now().minute % 15 == 0:
-            for guild in self.bot.guilds:
-                conn, cur = get_server_database(guild.id)
-                cur.execute("SELECT id FROM servstats WHERE chans = ?", ("clock",))
-                result = cur.fetchone()
+            for guild in shard_guilds():
+                result = await db_fetchone(
+                    guild.id, "SELECT id FROM servstats WHERE chans = ?", ("clock",)
+                )
                 channame = self.bot.get_channel(result[0]) if result is not None else None
-                conn.close()
                 if channame:
                     try:
                         await channame.edit(
@@ -203,18 +208,22 @@ class Servstats(commands.Cog, name="servstats"):
                         print(f"Error updating channel name: {err_edit}")
 
             if datetime.now().minute % 30 == 0:
-                for guild in self.bot.guilds:
-                    conn, cur = get_server_database(guild.id)
-                    cur.execute(
+                for guild in shard_guilds():
+                    rows = await db_fetchall(
+                        guild.id,
                         "SELECT * FROM servstats WHERE chans IN (?, ?, ?, ?, ?, ?)",
                         ("members", "users", "bots", "categories", "channels", "roles")
                     )
-                    rows = cur.fetchall()
-                    conn.close()
                     if len(rows) >= 6:
                         channel_ids = {row[0]: row[1] for row in rows}
 
-                        bot_count = sum(member.bot for member in guild.members)
+                        chan_bots_name = self.bot.get_channel(int(channel_ids.get("bots")))
+                        if guild.chunked or cache_policy.is_small(guild):
+                            bot_count = await count_bots(guild)
+                        else:
+                            # a big server keeps the bots counted by
+                            # /createservstats (see cachepolicy.py)
+                            bot_count = int(chan_bots_name.name.split(": ")[1])
                         user_count = guild.member_count - bot_count
                         channel_count = len([
                             channel for channel in guild.channels if not isinstance(
@@ -235,7 +244,6 @@ class Servstats(commands.Cog, name="servstats"):
                         if int(chan_users_name.name.split(": ")[1]) != user_count:
                             await chan_users_name.edit(name=f'[Users]: {user_count}')
 
-                        chan_bots_name = self.bot.get_channel(int(channel_ids.get("bots")))
                         if int(chan_bots_name.name.split(": ")[1]) != bot_count:
                             await chan_bots_name.edit(name=f'[Bots]: {bot_count}')
 
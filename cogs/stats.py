@@ -8,17 +8,95 @@ reactions, messages edited/deleted and time spent in voice.
 
 Author: Elcoyote Solitaire
 """
+import asyncio
 import random
 import math
+import time
 import discord
-import emoji
 
+from collections import OrderedDict
 from discord import app_commands, Interaction
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import Context
 from discord.app_commands import Choice, context_menu
 from discord.utils import get
-from cogs.intercogs import get_server_database, is_exception, add_achievement, get_achievements
+from cachepolicy import resolve_member
+from cogs.intercogs import (
+    add_achievement, get_achievements, get_setup_chan_id, get_stats_leaders,
+    get_board, mark_board_dirty
+)
+from dbmanager import db_execute, db_executemany, db_fetchone
+from eventstages import STATS_ORDER, register_stage, unregister_stage
+from guildconfig import invalidate_config
+from levelranks import get_rank, track_level
+from tokenizer import count_message, emoji_tables
+
+
+# The message/reaction/edit/delete stats are kept in memory and written
+# in one transaction per server every STATS_FLUSH_SECONDS, or as soon as
+# a server buffered STATS_FLUSH_EVENTS events. A crash loses at most one
+# of those windows.
+STATS_FLUSH_SECONDS = 30
+STATS_FLUSH_EVENTS = 500
+# The level ups are announced (and rewarded) by a single task, away from
+# on_message. Past LEVELUP_QUEUE_SIZE waiting level ups, new ones are
+# still saved but not announced.
+LEVELUP_QUEUE_SIZE = 1000
+# A member gets exp for EXP_BURST messages in a row, then for one
+# message every EXP_COOLDOWN seconds (a token bucket). Both can be
+# changed per server with /expcooldown (a cooldown of 0 turns it off).
+# The idle buckets are forgotten after EXP_BUCKET_IDLE seconds, and at
+# most MAX_EXP_BUCKETS are kept.
+EXP_COOLDOWN = 6
+EXP_BURST = 5
+EXP_BUCKET_IDLE = 3600
+MAX_EXP_BUCKETS = 50000
+
+
+
+class ExpBuckets:
+    """
+    Token buckets of the exp grants, per (server, member).
+
+    The buckets are kept from the least to the most recently used,
+    so the idle ones are found at the start.
+    """
+    def __init__(self):
+        self._buckets = OrderedDict()
+
+
+    def take(self, server_id, user_id, cooldown, burst):
+        """
+        Takes an exp grant from the bucket of a member.
+
+        Args:
+            server_id as guild.id
+            user_id as member.id
+            cooldown as int, seconds to get a grant back
+            burst as int, grants of a full bucket
+
+        Returns:
+            True if the message gives exp
+        """
+        if cooldown <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.pop((server_id, user_id), None)
+        if bucket is None:
+            tokens = burst
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) / cooldown)
+        granted = tokens >= 1
+        if granted:
+            tokens -= 1
+        self._buckets[(server_id, user_id)] = (tokens, now)
+
+        while self._buckets:
+            _, (_, last_use) = next(iter(self._buckets.items()))
+            if now - last_use < EXP_BUCKET_IDLE and len(self._buckets) <= MAX_EXP_BUCKETS:
+                break
+            self._buckets.popitem(last=False)
+        return granted
 
 
 
@@ -29,15 +107,30 @@ class Stats(commands.Cog, name="stats"):
     This class contains listeners and commands used for the stats system.
 
     Functions:
+        gives_exp()
         update_stats()
+        flush_stats()
+        flush_all_stats()
         update_level()
+        queue_levelup()
+        announce_levelups()
+        levelup_rewards()
         top_stats()
         generate_stats()
         generate_stats2()
         generate_card()
 
+    Task loop:
+        stats_flusher()
+
+    Pipeline stages:
+        message_stage()
+        edit_stage()
+        delete_stage()
+
     Commands:
         /setrole
+        /expcooldown
         /stats
         /stats2
         /leaderboard
@@ -58,6 +151,46 @@ class Stats(commands.Cog, name="stats"):
         self.bot.tree.context_menu(name="level")(self.check_level)
         self.bot.tree.context_menu(name="stats2")(self.check_stats2)
         self.bot.tree.context_menu(name="all-stats")(self.all_stats)
+        self.stats_buffer = {}
+        self.buffered_events = {}
+        self.levelups = asyncio.Queue(maxsize=LEVELUP_QUEUE_SIZE)
+        self.levelup_worker = None
+        self.exp_buckets = ExpBuckets()
+        self.stats_flusher.start()
+
+
+    async def cog_load(self):
+        register_stage("stats", "message", self.message_stage, STATS_ORDER)
+        register_stage("stats", "message_edit", self.edit_stage, STATS_ORDER)
+        register_stage("stats", "message_delete", self.delete_stage, STATS_ORDER)
+        self.levelup_worker = asyncio.create_task(self.announce_levelups())
+        # builds the emoji tables of the tokenizer off the event loop
+        asyncio.get_running_loop().run_in_executor(None, emoji_tables)
+
+
+    async def cog_unload(self):
+        unregister_stage("stats")
+        self.stats_flusher.cancel()
+        if self.levelup_worker:
+            self.levelup_worker.cancel()
+        await self.flush_all_stats()
+
+
+    def gives_exp(self, event):
+        """
+        Verify if a message gives exp, with the cooldown of the server.
+
+        Args:
+            event as eventstages.GuildEvent
+        """
+        cooldown = event.config.get_setup("exp_cooldown")
+        burst = event.config.get_setup("exp_burst")
+        return self.exp_buckets.take(
+            event.guild.id,
+            event.author.id,
+            EXP_COOLDOWN if cooldown is None else cooldown,
+            EXP_BURST if burst is None else burst
+        )
 
 
     async def update_stats(
@@ -66,6 +199,9 @@ class Stats(commands.Cog, name="stats"):
         """
         Updates the stats of the user.
 
+        The amounts are added to the server's buffer in memory, then
+        written by flush_stats() with the rest of the buffer.
+
         Args:
             id as user.id
             msg as integer - The amount of messages.
@@ -77,103 +213,175 @@ class Stats(commands.Cog, name="stats"):
             deletes as integer - The amount of messages deleted.
             server_id as guild.id
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT * FROM stats WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
-            messages = row[1] + msg if row[1] is not None else msg
-            words = row[2] + mots if row[2] is not None else mots
-            characters = row[3] + chars if row[3] is not None else chars
-            emojis = row[4] + emos if row[4] is not None else emos
-            reactions = row[5] + react if row[5] is not None else react
-            edited = row[6] + edits if row[6] is not None else edits
-            deleted = row[7] + deletes if row[7] is not None else deletes
-
-            cur.execute(
-                "UPDATE stats SET messages = ?, words = ?, characters = ?, emojis = ?, "
-                "reactions = ?, edited = ?, deleted = ? WHERE id = ?", 
-                (messages, words, characters, emojis, reactions, edited, deleted, user_id)
-            )
-            conn.commit()
-            conn.close()
+        server_buffer = self.stats_buffer.setdefault(server_id, {})
+        deltas = server_buffer.get(user_id)
+        if deltas is None:
+            deltas = server_buffer[user_id] = [0, 0, 0, 0, 0, 0, 0]
+        for index, amount in enumerate((msg, mots, chars, emos, react, edits, deletes)):
+            deltas[index] += amount
+        self.buffered_events[server_id] = self.buffered_events.get(server_id, 0) + 1
+        if self.buffered_events[server_id] >= STATS_FLUSH_EVENTS:
+            await self.flush_stats(server_id)
+
+
+    async def flush_stats(self, server_id):
+        """
+        Writes the buffered stats of a server in one transaction.
 
-        else:
-            cur.execute(
-                "INSERT INTO stats (id, messages, words, characters, emojis, "
-                "reactions, edited, deleted) VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
-                (user_id, msg, mots, chars, emos, react, edits, deletes)
+        If the write fails, the amounts are put back in the buffer
+        to be written with the next flush.
+
+        Args:
+            server_id as guild.id
+        """
+        server_buffer = self.stats_buffer.pop(server_id, None)
+        self.buffered_events.pop(server_id, None)
+        if not server_buffer:
+            return
+        try:
+            await db_executemany(
+                server_id,
+                "INSERT INTO stats (id, messages, words, characters, emojis, reactions, "
+                "edited, deleted) VALUES(?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET messages = messages + excluded.messages, "
+                "words = words + excluded.words, characters = characters + excluded.characters, "
+                "emojis = emojis + excluded.emojis, reactions = reactions + excluded.reactions, "
+                "edited = edited + excluded.edited, deleted = deleted + excluded.deleted",
+                [(user_id, *deltas) for user_id, deltas in server_buffer.items()]
             )
-            conn.commit()
-            conn.close()
+            mark_board_dirty(server_id, "leader")
+        except Exception:
+            current = self.stats_buffer.setdefault(server_id, {})
+            for user_id, deltas in server_buffer.items():
+                pending = current.setdefault(user_id, [0, 0, 0, 0, 0, 0, 0])
+                for index, amount in enumerate(deltas):
+                    pending[index] += amount
+            raise
 
 
-    async def update_level(self, context, user_id, exp, server_id):
+    async def flush_all_stats(self):
+        """
+        Writes the buffered stats of every server.
+        """
+        for server_id in list(self.stats_buffer):
+            try:
+                await self.flush_stats(server_id)
+            except Exception as err_flush:
+                print(f"Error writing the stats of server {server_id}: {err_flush}")
+
+
+    @tasks.loop(seconds=STATS_FLUSH_SECONDS)
+    async def stats_flusher(self):
+        """
+        Writes the buffered stats every STATS_FLUSH_SECONDS.
+
+        Args:
+            None
+        """
+        await self.flush_all_stats()
+
+
+    async def update_level(self, guild, user_id, exp):
         """
         Updates the level of the user.
 
+        A level up is queued for announce_levelups().
+
         Args:
-            id: the ID of the user.
+            guild as discord.Guild
+            user_id as member.id
             exp: the amount of exp to add.
-            server_id: The ID of the server.
-        """
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT * FROM level WHERE id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
-            # user exists already, update the stats.
-            total = row[3] + exp
-            exp = row[1] + exp
-            level = row[2]
-            if exp / 1000 > 1:
-                exp -= 1000
-                level += 1
-                cur.execute(
-                    "UPDATE level SET exp = ?, level = ?, total = ? WHERE id = ?",
-                    (exp, level, total, user_id)
-                )
-                conn.commit()
-                cur.execute("SELECT id FROM setup WHERE chans = ?", ("level",))
-                result = cur.fetchone()
-                member = f"<@{user_id}>"
-                lvlup_msg = [
-                    f"Congratulations {member} for reaching level {level}!",
-                    f"{member} is on fire! and also now level {level}.",
-                    f"I can't believe it! {member} made it to level {level}!",
-                    f"DING DING DING! {member} just reached level {level}!",
-                    f"Snap! Member: {member} - level: {level}"
-                ]
-                if not result:
-                    conn.close()
-                    return
-                levelchanname = self.bot.get_channel(int(result[0]))
-                permissions = levelchanname.permissions_for(context.guild.me)
-                if permissions.send_messages:
-                    await levelchanname.send(random.choice(lvlup_msg))
-                if level % 10 == 0:
-                    lvlreward = f"Level {level}"
-                    cur.execute("SELECT id FROM setup WHERE chans = ?", (lvlreward,))
-                    result = cur.fetchone()
-                    if result:
-                        reward_role = context.guild.get_role(result[0])
-                        member_reward = context.guild.get_member(user_id)
-                        await member_reward.add_roles(reward_role)
-
-                conn.close()
+        """
+        server_id = guild.id
+        # every expression of the update reads the row before the change,
+        # so the level up is decided and applied within the same statement.
+        row = await db_fetchone(
+            server_id,
+            "INSERT INTO level (id, exp, level, total) VALUES(?, ?, 0, ?) "
+            "ON CONFLICT(id) DO UPDATE SET "
+            "exp = CASE WHEN exp + excluded.exp > 1000 "
+            "THEN exp + excluded.exp - 1000 ELSE exp + excluded.exp END, "
+            "level = level + (exp + excluded.exp > 1000), "
+            "total = total + excluded.total "
+            "RETURNING exp, level, total",
+            (user_id, exp, exp)
+        )
+        track_level(server_id, user_id, row[2])
+        mark_board_dirty(server_id, "level")
+        # after a level up the remaining exp is at most the amount added,
+        # otherwise it is higher (a new member is inserted at level 0).
+        if exp <= 0 or row[1] == 0 or row[0] > exp:
+            return
+        self.queue_levelup(guild, user_id, row[1])
 
-            else:
-                cur.execute(
-                    "UPDATE level SET exp = ?, total = ? WHERE id = ?", (exp, total, user_id)
-                )
-                conn.commit()
-                conn.close()
 
-        else:
-            cur.execute(
-                "INSERT INTO level (id, exp, level, total) VALUES(?, ?, ?, ?)",
-                (user_id, exp, 0, exp)
-            )
-            conn.commit()
-            conn.close()
+    def queue_levelup(self, guild, user_id, level):
+        """
+        Adds a level up to the queue of announce_levelups().
+
+        Args:
+            guild as discord.Guild
+            user_id as member.id
+            level as int
+        """
+        try:
+            self.levelups.put_nowait((guild, user_id, level))
+        except asyncio.QueueFull:
+            print(f"Level up queue full, level {level} of {user_id} not announced.")
+
+
+    async def announce_levelups(self):
+        """
+        Task announcing the queued level ups, one at a time.
+
+        Args:
+            None
+        """
+        while True:
+            guild, user_id, level = await self.levelups.get()
+            try:
+                await self.levelup_rewards(guild, user_id, level)
+            except Exception as err_levelup:
+                print(f"Error announcing the level up of {user_id} in {guild.id}: {err_levelup}")
+            finally:
+                self.levelups.task_done()
+
+
+    async def levelup_rewards(self, guild, user_id, level):
+        """
+        Announces a level up and gives the reward role (every 10 levels).
+
+        Args:
+            guild as discord.Guild
+            user_id as member.id
+            level as int
+        """
+        server_id = guild.id
+        levelchan_id = await get_setup_chan_id(server_id, "level")
+        member = f"<@{user_id}>"
+        lvlup_msg = [
+            f"Congratulations {member} for reaching level {level}!",
+            f"{member} is on fire! and also now level {level}.",
+            f"I can't believe it! {member} made it to level {level}!",
+            f"DING DING DING! {member} just reached level {level}!",
+            f"Snap! Member: {member} - level: {level}"
+        ]
+        if not levelchan_id:
+            return
+        levelchanname = self.bot.get_channel(int(levelchan_id))
+        if levelchanname is None:
+            return
+        permissions = levelchanname.permissions_for(guild.me)
+        if permissions.send_messages:
+            await levelchanname.send(random.choice(lvlup_msg))
+        if level % 10 == 0:
+            lvlreward = f"Level {level}"
+            reward_role_id = await get_setup_chan_id(server_id, lvlreward)
+            if reward_role_id:
+                reward_role = guild.get_role(reward_role_id)
+                member_reward = await resolve_member(guild, user_id)
+                if reward_role and member_reward:
+                    await member_reward.add_roles(reward_role)
 
 
     @app_commands.command(
@@ -212,16 +420,57 @@ class Stats(commands.Cog, name="stats"):
             lvl as a choice for every 10 levels.
             lvlrole as a Role from the server.
         """
-        conn, cur = get_server_database(interaction.guild.id)
-        cur.execute(
+        await db_execute(
+            interaction.guild.id,
             "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)", (lvl.name, lvlrole.id)
         )
-        conn.commit()
+        invalidate_config(interaction.guild.id)
         await interaction.response.send_message(
             content=f"{lvlrole.mention} has been set as {lvl.name}'s reward.",
             ephemeral=True
         )
-        conn.close()
+
+
+    @app_commands.command(
+        name="expcooldown",
+        description="Setups how often messages give exp"
+    )
+    @app_commands.guild_only()
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        seconds="Seconds to get back one message with exp (0~3600, 0 to turn off)",
+        burst="Messages in a row that give exp (1~50)"
+    )
+    async def expcooldown(self, interaction: Interaction, seconds: int, burst: int):
+        """
+        Setups the exp cooldown of the server.
+
+        A member gets exp for `burst` messages in a row, then
+        for one message every `seconds`. The other messages
+        still count in the stats.
+
+        Args:
+            interaction as discord.Interaction
+            seconds as int (0 to turn off the cooldown)
+            burst as int
+        """
+        if not 0 <= seconds <= 3600 or not 1 <= burst <= 50:
+            await interaction.response.send_message(
+                content="Seconds must be from 0 to 3600 and burst from 1 to 50.",
+                ephemeral=True
+            )
+            return
+        await db_executemany(
+            interaction.guild.id,
+            "INSERT OR REPLACE INTO setup (chans, id) VALUES (?, ?)",
+            [("exp_cooldown", seconds), ("exp_burst", burst)]
+        )
+        invalidate_config(interaction.guild.id)
+        if seconds == 0:
+            content = "Every message now gives exp."
+        else:
+            content = f"Exp is now given for {burst} messages in a row, then one every {seconds} seconds."
+        await interaction.response.send_message(content=content, ephemeral=True)
 
 
     @app_commands.command(
@@ -247,7 +496,7 @@ class Stats(commands.Cog, name="stats"):
                 ephemeral=True
             )
             return
-        if user not in interaction.guild.members:
+        if await resolve_member(interaction.guild, user.id) is None:
             await add_achievement(interaction.guild.id, interaction.user.id, "Awkward")
             await interaction.response.send_message(
                 content=f"{user} is not a member of {interaction.guild.name}.",
@@ -255,10 +504,9 @@ class Stats(commands.Cog, name="stats"):
             )
             return
 
-        conn, cur = get_server_database(interaction.guild.id)
-        cur.execute("SELECT * FROM stats WHERE id = ?", (user.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM stats WHERE id = ?", (user.id,)
+        )
 
         if result is None:
             await interaction.response.send_message("This user has no stats yet.", ephemeral=True)
@@ -305,9 +553,6 @@ class Stats(commands.Cog, name="stats"):
             )
             return
         guild = interaction.guild
-        conn, cur = get_server_database(guild.id)
-
-        highest_stats = {}
         highest_stats_processed = {}
         stat_name_mapping = {
             'messages': 'Messages sent',
@@ -320,15 +565,11 @@ class Stats(commands.Cog, name="stats"):
             'jvoice': 'Voice sessions',
             'tvoice': 'Voice time',
         }
-        columns = [
-            "messages", "words", "characters", "emojis", "reactions",
-            "edited", "deleted", "jvoice", "tvoice"
-        ]
-        for column in columns:
-            cur.execute(f"SELECT id, MAX({column}) FROM stats")
-            result = cur.fetchone()
-            highest_stats[column] = result
-        conn.close()
+        await self.flush_stats(guild.id)
+        leaders = await get_stats_leaders(guild.id)
+        highest_stats = {
+            column: rows[0] if rows else (None, None) for column, rows in leaders.items()
+        }
 
         for column, (user_id, stats_value) in highest_stats.items():
             member = self.bot.get_user(user_id)
@@ -353,7 +594,6 @@ class Stats(commands.Cog, name="stats"):
             embed.add_field(name=friendly_name, value=value, inline=False)
 
         await interaction.response.send_message(embed=embed)
-        conn.close()
 
 
     @app_commands.command(
@@ -379,7 +619,7 @@ class Stats(commands.Cog, name="stats"):
                 ephemeral=True
             )
             return
-        if user not in interaction.guild.members:
+        if await resolve_member(interaction.guild, user.id) is None:
             await add_achievement(interaction.guild.id, interaction.user.id, "Awkward")
             await interaction.response.send_message(
                 content=f"{user} is not a member of {interaction.guild.name}.",
@@ -387,28 +627,18 @@ class Stats(commands.Cog, name="stats"):
             )
             return
 
-        conn, cur = get_server_database(interaction.guild.id)
-        cur.execute("SELECT * FROM level WHERE id = ?", (user.id,))
-        result = cur.fetchone()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM level WHERE id = ?", (user.id,)
+        )
 
         if result is None:
             await interaction.response.send_message("This user has no exp yet.", ephemeral=True)
-            conn.close()
         else:
             level = result[2]
             exp = result[1]
             pcent_exp = round(exp / 10, 2)
             total = result[3]
-            target_data = total
-
-            cur.execute("SELECT total, RANK() OVER (ORDER BY total DESC) AS rank FROM level")
-            rows = cur.fetchall()
-
-            rank = next((row[1] for row in rows if row[0] == target_data), None)
-
-            cur.execute("SELECT COUNT(*) FROM level")
-            row_count = cur.fetchone()[0]
-            conn.close()
+            rank, row_count = await get_rank(interaction.guild.id, total)
 
             embed = discord.Embed(title=f"{user.display_name}'s level", color=0x0000FF)
             embed.set_thumbnail(url=user.avatar)
@@ -445,31 +675,7 @@ class Stats(commands.Cog, name="stats"):
                 ephemeral=True
             )
             return
-        guild = interaction.guild
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute("SELECT id, level, exp FROM level ORDER BY total DESC LIMIT 10")
-        top_levels = cur.fetchall()
-        conn.close()
-
-        embed = discord.Embed(title=f"Levelboard of {guild.name}", color=0x00ff00)
-        top_level_info = []
-        embed.set_thumbnail(url=guild.icon)
-        for rank, (user_id, level, exp) in enumerate(top_levels, start=1):
-            member = self.bot.get_user(user_id)
-            exp_percentage = round(exp / 10, 2)
-            if member is not None:
-                member = member.display_name
-                top_level_info.append(f"{rank}: {member} - Level {level} ({exp_percentage}%)")
-            else:
-                member = f"<@{user_id}>"
-                top_level_info.append(f"{rank}: {member} - Level {level} ({exp_percentage}%)")
-            embed.add_field(
-                name=f"{rank}: {member} - Lvl {level} ({exp_percentage}%)",
-                value="",
-                inline=False
-            )
-
+        embed = await get_board(interaction.guild, "level")
         await interaction.response.send_message(embed=embed)
 
 
@@ -496,13 +702,12 @@ class Stats(commands.Cog, name="stats"):
                 ephemeral=True
             )
             return
-        conn, cur = get_server_database(interaction.guild.id)
-
-        cur.execute(
+        if await db_execute(
+            interaction.guild.id,
             "UPDATE level SET exp = ?, level = ?, total = ? WHERE id = ?", (0, 0, 0, user.id)
-        )
-        conn.commit()
-        conn.close()
+        ):
+            track_level(interaction.guild.id, user.id, 0)
+            mark_board_dirty(interaction.guild.id, "level")
         await interaction.response.send_message(
             content=f"{user}'s experience has been reset to 0.",
             ephemeral=True
@@ -535,7 +740,7 @@ class Stats(commands.Cog, name="stats"):
             )
             return
         if 1 <= exp <= 1000:
-            await self.update_level(interaction, user.id, exp, interaction.guild.id)
+            await self.update_level(interaction.guild, user.id, exp)
             await interaction.response.send_message(
                 content=f"Added {exp} experience to {user}.",
                 ephemeral=True
@@ -548,56 +753,37 @@ class Stats(commands.Cog, name="stats"):
             )
 
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    async def message_stage(self, event):
         """
-        Listener for messages.
+        Pipeline stage for messages.
 
         Args:
-            message: The message.
+            event as eventstages.GuildEvent
         """
-        if str(message.channel.type) == "private":
-            return
-        if message.author.bot:
-            return
-        if is_exception(message.guild.id, message.channel.id, "exp"):
+        if event.is_exception("exp"):
             return
 
-        server_id = message.guild.id
-        user_id = message.author.id
-        context = await self.bot.get_context(message)
-        words = message.content.split()
-        nbr_words = len(words)
-        characters = 0
-        emojis = 0
-        for char in message.content:
-            if emoji.is_emoji(char) is True:
-                emojis += 1
-        characters = len(''.join(words))
-        characters -= emojis
-        nbr_words -= emojis
-        get_server_database(server_id)
+        server_id = event.guild.id
+        user_id = event.author.id
+        nbr_words, characters, emojis = count_message(event.message.content)
         await self.update_stats(
             user_id, 1, nbr_words, characters, emojis, 0, 0, 0, server_id
         )
+        if not self.gives_exp(event):
+            return
         exp = math.ceil(characters/10 + random.randint(3,5))
-        await self.update_level(context, user_id, exp, server_id)
+        await self.update_level(event.guild, user_id, exp)
 
 
-    @commands.Cog.listener()
-    async def on_message_delete(self, message):
+    async def delete_stage(self, event):
         """
-        Listener for message deletion.
+        Pipeline stage for message deletion.
 
         Args:
-            message: The deleted message.
+            event as eventstages.GuildEvent
         """
-        if str(message.channel.type) == "private":
-            return
-        if message.author.bot:
-            return
         await self.update_stats(
-            message.author.id, 0, 0, 0, 0, 0, 0, 1, message.guild.id
+            event.author.id, 0, 0, 0, 0, 0, 0, 1, event.guild.id
         )
 
 
@@ -619,23 +805,14 @@ class Stats(commands.Cog, name="stats"):
         )
 
 
-    @commands.Cog.listener()
-    async def on_message_edit(self, before, after):
+    async def edit_stage(self, event):
         """
-        Listener for edited messages.
-        
+        Pipeline stage for edited messages.
+
         Args:
-            before: The message before the edition.
-            after: The message after the edition.
+            event as eventstages.GuildEvent
         """
-        if str(after.channel.type) == "private":
-            return
-        if after.author.bot:
-            return
-        if before.author.bot:
-            return
-
-        await self.update_stats(after.author.id, 0, 0, 0, 0, 0, 1, 0, after.guild.id)
+        await self.update_stats(event.author.id, 0, 0, 0, 0, 0, 1, 0, event.guild.id)
 
 
     @app_commands.command(
@@ -661,7 +838,7 @@ class Stats(commands.Cog, name="stats"):
                 ephemeral=True
             )
             return
-        if user not in interaction.guild.members:
+        if await resolve_member(interaction.guild, user.id) is None:
             await add_achievement(interaction.guild.id, interaction.user.id, "Awkward")
             await interaction.response.send_message(
                 content=f"{user} is not a member of {interaction.guild.name}.",
@@ -669,10 +846,9 @@ class Stats(commands.Cog, name="stats"):
             )
             return
 
-        conn, cur = get_server_database(interaction.guild.id)
-        cur.execute("SELECT * FROM stats WHERE id = ?", (user.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM stats WHERE id = ?", (user.id,)
+        )
 
         if result is None:
             await interaction.response.send_message("This user has no stats yet.", ephemeral=True)
@@ -710,25 +886,17 @@ class Stats(commands.Cog, name="stats"):
             server_id as interaction.guild.id
             user_id as member.id.
         """
-        conn, cur = get_server_database(server_id)
-
         highest_stats = {}
         member_top_stats = ""
-        columns = [
-            "messages", "words", "characters", "emojis", "reactions",
-            "edited", "deleted", "jvoice", "tvoice"
-        ]
-        for column in columns:
-            cur.execute(f"SELECT id, MAX({column}) FROM stats")
-            result = cur.fetchone()
+        leaders = await get_stats_leaders(server_id)
+        for column, rows in leaders.items():
             if column == "tvoice":
                 column_name = "Voice time"
             elif column == "jvoice":
                 column_name = "Voice sessions"
             else:
                 column_name = column
-            highest_stats[column_name] = result
-        conn.close()
+            highest_stats[column_name] = rows[0] if rows else (None, None)
 
         for column, (stats_id, stats_value) in highest_stats.items():
             #member = self.bot.get_user(user_id)
@@ -751,16 +919,14 @@ class Stats(commands.Cog, name="stats"):
             interaction as discord.Interaction
             member as discord.Member
         """
-        conn, cur = get_server_database(interaction.guild.id)
-
+        guild_id = interaction.guild.id
         embed = discord.Embed(
             title=f"{member}'s Profile",
             description=f"{member.mention} ({member.id})",
             color=0x808080
         )
 
-        cur.execute("SELECT * FROM level WHERE id = ?", (member.id,))
-        levels = cur.fetchone()
+        levels = await db_fetchone(guild_id, "SELECT * FROM level WHERE id = ?", (member.id,))
 
         level = levels[2] if levels else 0
         exp = levels[1] if levels else 0
@@ -780,23 +946,17 @@ class Stats(commands.Cog, name="stats"):
         else:
             total_achieves_1 = 10
             total_achieves_2 = total_achieves % 10
-        cur.execute("SELECT total, RANK() OVER (ORDER BY total DESC) AS rank FROM level")
-        ranks = cur.fetchall()
-        if ranks:
-            rank = next((row[1] for row in ranks if row[0] == total), 0)
-            cur.execute("SELECT COUNT(*) FROM level")
-            member_rank = f"{rank}/{cur.fetchone()[0]}"
-        else:
-            member_rank = "N/A"
-        cur.execute("SELECT * FROM fightscore WHERE id = ?", (member.id,))
-        fightstats = cur.fetchone()
+        rank, row_count = await get_rank(guild_id, total)
+        member_rank = f"{rank}/{row_count}" if row_count else "N/A"
+        fightstats = await db_fetchone(
+            guild_id, "SELECT * FROM fightscore WHERE id = ?", (member.id,)
+        )
         if fightstats:
             points = fightstats[1] if fightstats[1] else 0
             matches = fightstats[2] if fightstats[2] else 0
         else:
             points = 0
             matches = 0
-        conn.close()
         embed.add_field(
             name="Level / Rank",
             value=f"Level: {level} ({pcent_exp}%)\nRank: {member_rank}",
@@ -842,11 +1002,9 @@ class Stats(commands.Cog, name="stats"):
             interaction as discord.Interaction
             member as discord.Member
         """
-        conn, cur = get_server_database(interaction.guild.id)
-
-        cur.execute("SELECT * FROM stats WHERE id = ?", (member.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM stats WHERE id = ?", (member.id,)
+        )
 
         if result is None:
             await interaction.response.send_message(
@@ -883,11 +1041,9 @@ class Stats(commands.Cog, name="stats"):
             interaction as discord.Interaction
             member as discord.Member
         """
-        conn, cur = get_server_database(interaction.guild.id)
-
-        cur.execute("SELECT * FROM stats WHERE id = ?", (member.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM stats WHERE id = ?", (member.id,)
+        )
 
         if result is None:
             await interaction.response.send_message(
@@ -930,32 +1086,21 @@ class Stats(commands.Cog, name="stats"):
             interaction as discord.Interaction
             member as discord.Member
         """
-        conn, cur = get_server_database(interaction.guild.id)
-
-        cur.execute("SELECT * FROM level WHERE id = ?", (member.id,))
-        result = cur.fetchone()
+        result = await db_fetchone(
+            interaction.guild.id, "SELECT * FROM level WHERE id = ?", (member.id,)
+        )
 
         if result is None:
             await interaction.response.send_message(
                 content=f"{member.mention} has no exp yet.",
                 ephemeral=True
             )
-            conn.close()
         else:
             level = result[2]
             exp = result[1]
             pcent_exp = round(exp / 10, 2)
             total = result[3]
-            target_data = total
-
-            cur.execute("SELECT total, RANK() OVER (ORDER BY total DESC) AS rank FROM level")
-            rows = cur.fetchall()
-
-            rank = next((row[1] for row in rows if row[0] == target_data), None)
-
-            cur.execute("SELECT COUNT(*) FROM level")
-            row_count = cur.fetchone()[0]
-            conn.close()
+            rank, row_count = await get_rank(interaction.guild.id, total)
 
             embed = discord.Embed(title=f"{member.display_name}'s level", color=0x0000FF)
             embed.set_thumbnail(url=member.avatar)
@@ -988,11 +1133,7 @@ class Stats(commands.Cog, name="stats"):
         Returns:
             normal_stats as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute("SELECT * FROM stats WHERE id = ?", (member.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(guild.id, "SELECT * FROM stats WHERE id = ?", (member.id,))
 
         if result is None:
             return None
@@ -1029,11 +1170,7 @@ class Stats(commands.Cog, name="stats"):
         Returns:
             average_stats as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
-        cur.execute("SELECT * FROM stats WHERE id = ?", (member.id,))
-        result = cur.fetchone()
-        conn.close()
+        result = await db_fetchone(guild.id, "SELECT * FROM stats WHERE id = ?", (member.id,))
 
         if result is None:
             return None
@@ -1076,16 +1213,14 @@ class Stats(commands.Cog, name="stats"):
         Returns:
             member_card as discord.Embed
         """
-        conn, cur = get_server_database(guild.id)
-
+        guild_id = guild.id
         member_card = discord.Embed(
             title=f"{member}'s Profile",
             description=f"{member.mention} ({member.id})",
             color=0x808080
         )
 
-        cur.execute("SELECT * FROM level WHERE id = ?", (member.id,))
-        levels = cur.fetchone()
+        levels = await db_fetchone(guild_id, "SELECT * FROM level WHERE id = ?", (member.id,))
 
         level = levels[2] if levels else 0
         exp = levels[1] if levels else 0
@@ -1105,23 +1240,17 @@ class Stats(commands.Cog, name="stats"):
         else:
             total_achieves_1 = 10
             total_achieves_2 = total_achieves % 10
-        cur.execute("SELECT total, RANK() OVER (ORDER BY total DESC) AS rank FROM level")
-        ranks = cur.fetchall()
-        if ranks:
-            rank = next((row[1] for row in ranks if row[0] == total), 0)
-            cur.execute("SELECT COUNT(*) FROM level")
-            member_rank = f"{rank}/{cur.fetchone()[0]}"
-        else:
-            member_rank = "N/A"
-        cur.execute("SELECT * FROM fightscore WHERE id = ?", (member.id,))
-        fightstats = cur.fetchone()
+        rank, row_count = await get_rank(guild_id, total)
+        member_rank = f"{rank}/{row_count}" if row_count else "N/A"
+        fightstats = await db_fetchone(
+            guild_id, "SELECT * FROM fightscore WHERE id = ?", (member.id,)
+        )
         if fightstats:
             points = fightstats[1] if fightstats[1] else 0
             matches = fightstats[2] if fightstats[2] else 0
         else:
             points = 0
             matches = 0
-        conn.close()
         member_card.add_field(
             name="Level / Rank",
             value=f"Level: {level} ({pcent_exp}%)\nRank: {member_rank}",
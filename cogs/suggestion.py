@@ -29,6 +29,7 @@ from discord import app_commands, Interaction
 from discord.ext import commands
 from discord.app_commands import Choice
 from cogs.intercogs import get_server_database, get_time_zone, add_achievement
+from dbmanager import db_fetchone
 
 
 
@@ -151,15 +152,14 @@ class Suggestion(commands.Cog, name="suggestion"):
         channel = guild.get_channel_or_thread(payload.channel_id)
         if isinstance(channel, discord.Thread) or str(channel.type) != "text":
             return
-        conn, cur = get_server_database(guild.id)
-        cur.execute("SELECT * FROM suggestion WHERE id = ?", (payload.message_id,))
-        row = cur.fetchone()
-        conn.close()
+        row = await db_fetchone(
+            guild.id, "SELECT * FROM suggestion WHERE id = ?", (payload.message_id,)
+        )
         if not row:
             return
         message = await channel.fetch_message(payload.message_id)
         reaction = discord.utils.get(message.reactions, emoji=payload.emoji.name)
-        user = guild.get_member(payload.user_id)
+        user = payload.member
         await add_achievement(guild.id, user.id, "Vote")
         if reaction.emoji == "⬆️":
             down_reaction = discord.utils.get(message.reactions, emoji="⬇️")
@@ -18,7 +18,8 @@ import discord
 from datetime import datetime
 from discord.ext import commands
 from discord.utils import get
-from cogs.intercogs import get_server_database, add_achievement, add_achievecount
+from cogs.intercogs import add_achievement, add_achievecount, get_setup_chan_id, mark_board_dirty
+from dbmanager import db_execute, db_fetchone, db_transaction
 
 
 
@@ -51,24 +52,13 @@ class Voice(commands.Cog, name="voice"):
             member_id as member.id (int)
             minutes as an integer
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT tvoice, jvoice FROM stats WHERE id = ?", (member_id,))
-        row = cur.fetchone()
-        if row:
-            minutes_total = minutes + row[0] if row[0] is not None else minutes
-            voice_total = 1 + row[1] if row[1] is not None else 1
-            cur.execute("UPDATE stats SET tvoice = ?, jvoice = ? WHERE id = ?",
-                (minutes_total, voice_total, member_id)
-            )
-            conn.commit()
-
-        else:
-            cur.execute(
-                "INSERT INTO stats (id, tvoice, jvoice) VALUES(?, ?, ?)",
-                (member_id, minutes, 1)
-            )
-            conn.commit()
-        conn.close()
+        await db_execute(
+            server_id,
+            "INSERT INTO stats (id, tvoice, jvoice) VALUES(?, ?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET tvoice = tvoice + excluded.tvoice, jvoice = jvoice + 1",
+            (member_id, minutes)
+        )
+        mark_board_dirty(server_id, "leader")
 
 
     async def voice_entry(self, server_id, member_id, embmsg_id: int):
@@ -81,13 +71,11 @@ class Voice(commands.Cog, name="voice"):
             server_id as member.guild.id
             member_id as member.id (int)
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute(
+        await db_execute(
+            server_id,
             "INSERT OR REPLACE INTO voice (id, jtime, embmsg) VALUES (?, ?, ?)",
             (member_id, datetime.now(), embmsg_id)
         )
-        conn.commit()
-        conn.close()
 
 
     async def getemb(self, server_id, member_id):
@@ -100,11 +88,8 @@ class Voice(commands.Cog, name="voice"):
             server_id as member.guild.id
             member_id as member.id (int)
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT embmsg FROM voice WHERE id = ?", (member_id,))
-        row = cur.fetchone()
+        row = await db_fetchone(server_id, "SELECT embmsg FROM voice WHERE id = ?", (member_id,))
         embmsg = row[0] if row else False
-        conn.close()
         return embmsg
 
 
@@ -123,15 +108,12 @@ class Voice(commands.Cog, name="voice"):
             server_id as member.guild.id
             member_id as member.id (int)
         """
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT jtime FROM voice WHERE id = ?", (member_id,))
-        row = cur.fetchone()
-        db_timestamp = datetime.fromisoformat(row[0])
-        stamp_calc = datetime.now() - db_timestamp
-        minutes = round(stamp_calc.total_seconds() / 60)
-        cur.execute("DELETE FROM voice WHERE id = ?", (member_id,))
-        conn.commit()
-        conn.close()
+        async with db_transaction(server_id) as trans:
+            row = await trans.fetchone("SELECT jtime FROM voice WHERE id = ?", (member_id,))
+            db_timestamp = datetime.fromisoformat(row[0])
+            stamp_calc = datetime.now() - db_timestamp
+            minutes = round(stamp_calc.total_seconds() / 60)
+            await trans.execute("DELETE FROM voice WHERE id = ?", (member_id,))
         return minutes
 
 
@@ -153,11 +135,7 @@ class Voice(commands.Cog, name="voice"):
         if member.bot:
             return
         server_id = member.guild.id
-        conn, cur = get_server_database(server_id)
-        cur.execute("SELECT id FROM setup WHERE chans = ?", ("voices",))
-        result = cur.fetchone()
-        conn.close()
-        chanlog = self.bot.get_channel(result[0])
+        chanlog = self.bot.get_channel(await get_setup_chan_id(server_id, "voices"))
         if chanlog:
             permissions = chanlog.permissions_for(chanlog.guild.me)
 
@@ -0,0 +1,737 @@
+# dbmanager.py
+"""
+Connection manager for the servers' databases.
+
+Every cog used to open ./database/servers/<id>.db, run one query and
+close it right away, which means several connections opened and closed
+for every single message. This module keeps a small pool of long-lived
+connections per server instead, and evicts the least recently used
+servers so the amount of open files stays bounded no matter how many
+servers the bot is in.
+
+The cogs keep the same (conn, cur) contract through get_server_database:
+conn.close() simply gives the connection back to the pool.
+
+The schema (see dbschema.py) is applied once per database file, the
+first time the file is opened by the bot.
+
+Coroutines should use the awaitable helpers (db_execute, db_fetchone,
+db_fetchall, db_transaction) instead: the queries run on a small pool
+of worker threads so a slow disk never freezes the bot's event loop.
+
+The journal mode and the other pragmas of every connection are set
+here from the "database" section of config.json (see DEFAULT_SETTINGS).
+With the WAL journal, the checkpoints are done by a background task of
+the bot (checkpoint_all) instead of inline during a commit. Without
+that task (checkpoint_interval_minutes at 0), wal_autocheckpoint can't
+be 0 either and falls back to WAL_AUTOCHECKPOINT pages, otherwise the
+-wal file of a server would grow without limit.
+
+A server's database file is only created by its first write. Until
+then, the SELECT queries (and run(..., read_only=True)) are answered by
+an empty in-memory database built from the same schema, so servers that
+never use the bot's features don't get a file at all.
+
+Author: Elcoyote Solitaire
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dbschema import apply_migrations
+
+
+DB_FOLDER = "./database/servers"
+MAX_GUILDS = 256
+MAX_IDLE_PER_GUILD = 2
+MAX_WORKERS = 4
+
+DEFAULT_SETTINGS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -8000,
+    "mmap_size": 67108864,
+    "busy_timeout": 5000,
+    "wal_autocheckpoint": 0,
+    "checkpoint_interval_minutes": 5,
+    "max_guilds": MAX_GUILDS,
+    "max_idle_per_guild": MAX_IDLE_PER_GUILD,
+    "workers": MAX_WORKERS
+}
+# default of SQLite, used when the checkpoint task is disabled
+WAL_AUTOCHECKPOINT = 1000
+JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+SYNCHRONOUS_LEVELS = ("off", "normal", "full", "extra")
+
+
+
+class PooledConnection:
+    """
+    Wrapper around a sqlite3 connection borrowed from a GuildPool.
+
+    Everything is forwarded to the real connection, except close()
+    which returns the connection to its pool instead of closing it.
+
+    Args:
+        pool as GuildPool
+        conn as sqlite3.Connection
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+
+    def close(self):
+        """
+        Gives the connection back to the pool.
+
+        Uncommitted changes are rolled back, exactly like
+        closing a plain sqlite3 connection would do.
+        """
+        if self._conn is None:
+            return
+        conn = self._conn
+        self._conn = None
+        self._pool.manager.release(self._pool, conn)
+
+
+
+class AsyncTransaction:
+    """
+    Awaitable queries sharing one borrowed connection.
+
+    Returned by db_transaction(). Every query runs on the manager's
+    worker threads; everything is committed when the block exits, or
+    rolled back if an exception is raised.
+
+    Args:
+        manager as ConnectionManager
+        server_id as guild.id
+    """
+    def __init__(self, manager, server_id):
+        self.manager = manager
+        self.server_id = server_id
+        self._pool = None
+        self._conn = None
+
+
+    async def __aenter__(self):
+        acquiring = asyncio.ensure_future(
+            self.manager.in_thread(self.manager.acquire, self.server_id)
+        )
+        try:
+            self._pool, self._conn = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # the worker thread still borrows the connection, and
+            # __aexit__ won't run to give it back
+            acquiring.add_done_callback(self._release_abandoned)
+            raise
+        return self
+
+
+    def _release_abandoned(self, acquiring):
+        """
+        Gives back the connection of an acquire whose task was cancelled.
+
+        Args:
+            acquiring as asyncio.Future of manager.acquire()
+        """
+        if acquiring.cancelled() or acquiring.exception() is not None:
+            return
+        self.manager.executor.submit(self.manager.release, *acquiring.result())
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        pool, conn = self._pool, self._conn
+        self._pool = self._conn = None
+
+        def finish():
+            try:
+                if exc_type is None:
+                    conn.commit()
+            finally:
+                self.manager.release(pool, conn)
+
+        await self.manager.in_thread(finish)
+        return False
+
+
+    async def execute(self, query, params=()):
+        """
+        Executes a query and returns the amount of rows changed.
+        """
+        return await self.manager.in_thread(
+            lambda: self._conn.execute(query, params).rowcount
+        )
+
+
+    async def executemany(self, query, seq_of_params):
+        """
+        Executes a query for every set of parameters.
+        """
+        return await self.manager.in_thread(
+            lambda: self._conn.executemany(query, seq_of_params).rowcount
+        )
+
+
+    async def fetchone(self, query, params=()):
+        """
+        Executes a query and returns the first row (or None).
+        """
+        return await self.manager.in_thread(
+            lambda: self._conn.execute(query, params).fetchone()
+        )
+
+
+    async def fetchall(self, query, params=()):
+        """
+        Executes a query and returns all the rows.
+        """
+        return await self.manager.in_thread(
+            lambda: self._conn.execute(query, params).fetchall()
+        )
+
+
+
+class GuildPool:
+    """
+    Idle connections of a single server's database.
+
+    Args:
+        manager as ConnectionManager
+        server_id as guild.id
+        path as str for the database file
+    """
+    def __init__(self, manager, server_id, path):
+        self.manager = manager
+        self.server_id = server_id
+        self.path = path
+        self.idle = []
+        self.in_use = 0
+        self.evicted = False
+
+
+
+class ConnectionManager:
+    """
+    Keeps a small pool of connections per server's database.
+
+    Servers are kept in least recently used order. When more than
+    max_guilds servers have a pool, the oldest pools without any
+    borrowed connection are closed.
+
+    Args:
+        folder as str for the databases' folder
+        max_guilds as int for the amount of servers kept open
+        max_idle as int for the idle connections kept per server
+    """
+    def __init__(self, folder=DB_FOLDER, max_guilds=MAX_GUILDS, max_idle=MAX_IDLE_PER_GUILD):
+        self.folder = folder
+        self.max_guilds = max_guilds
+        self.max_idle = max_idle
+        self.workers = MAX_WORKERS
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._ready = set()
+        self._existing = set()
+        self._template = None
+        self._template_lock = threading.Lock()
+        self.opened = 0
+        self.template_reads = 0
+        self.evictions = 0
+        self.checkpoints = 0
+        self._executor = None
+
+
+    def configure(self, settings):
+        """
+        Applies the "database" section of config.json.
+
+        Must be called before the first connection is opened,
+        as the pragmas are only set when a connection is created.
+        Missing keys keep their DEFAULT_SETTINGS value.
+
+        Args:
+            settings as dict
+        """
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update(settings or {})
+        merged["journal_mode"] = str(merged["journal_mode"]).lower()
+        merged["synchronous"] = str(merged["synchronous"]).lower()
+        if merged["journal_mode"] not in JOURNAL_MODES:
+            raise ValueError(f"Invalid journal_mode in config.json: {merged['journal_mode']}")
+        if merged["synchronous"] not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous in config.json: {merged['synchronous']}")
+        for key in (
+            "cache_size", "mmap_size", "busy_timeout", "wal_autocheckpoint",
+            "max_guilds", "max_idle_per_guild", "workers"
+        ):
+            merged[key] = int(merged[key])
+        if merged["wal_autocheckpoint"] <= 0 and merged["checkpoint_interval_minutes"] <= 0:
+            print(
+                "No checkpoint_interval_minutes in config.json, "
+                f"wal_autocheckpoint set to {WAL_AUTOCHECKPOINT}"
+            )
+            merged["wal_autocheckpoint"] = WAL_AUTOCHECKPOINT
+        self.settings = merged
+        self.max_guilds = merged["max_guilds"]
+        self.max_idle = merged["max_idle_per_guild"]
+        self.workers = merged["workers"]
+
+
+    def _apply_pragmas(self, conn, first_open):
+        """
+        Sets the pragmas of a new connection.
+
+        The journal mode is stored in the file itself, so it is
+        only set the first time the file is opened.
+
+        Args:
+            conn as sqlite3.Connection
+            first_open as bool
+        """
+        settings = self.settings
+        conn.execute(f"PRAGMA busy_timeout = {settings['busy_timeout']}")
+        if first_open:
+            conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {settings['cache_size']}")
+        conn.execute(f"PRAGMA mmap_size = {settings['mmap_size']}")
+        if settings["journal_mode"] == "wal":
+            conn.execute(f"PRAGMA wal_autocheckpoint = {settings['wal_autocheckpoint']}")
+
+
+    def db_path(self, server_id):
+        """
+        Returns the path of the database file for a server.
+
+        Args:
+            server_id as guild.id
+        """
+        return os.path.join(self.folder, f"{server_id}.db")
+
+
+    def exists(self, server_id):
+        """
+        Returns True if the server's database file was created.
+
+        Args:
+            server_id as guild.id
+        """
+        if server_id in self._existing:
+            return True
+        if os.path.exists(self.db_path(server_id)):
+            self._existing.add(server_id)
+            return True
+        return False
+
+
+    def _read_template(self, func):
+        """
+        Runs func(cur) on the empty in-memory database.
+
+        The template has every table of the schema but no row, so
+        the reads of a server without a file get the same defaults
+        as an empty file. It is read only: a write raises an error.
+
+        Args:
+            func as a callable receiving a sqlite3.Cursor
+        """
+        with self._template_lock:
+            if self._template is None:
+                template = sqlite3.connect(":memory:", check_same_thread=False)
+                apply_migrations(template)
+                template.execute("PRAGMA query_only = ON")
+                self._template = template
+            self.template_reads += 1
+            return func(self._template.cursor())
+
+
+    def _connect(self, pool):
+        """
+        Opens a new connection for a pool.
+
+        The connection can be used from any thread, but a
+        single borrower uses it at a time. The schema's
+        migrations are applied the first time a file is
+        opened, then never again for this process.
+        """
+        conn = sqlite3.connect(pool.path, check_same_thread=False)
+        try:
+            if pool.path not in self._ready:
+                with self._schema_lock:
+                    if pool.path not in self._ready:
+                        self._apply_pragmas(conn, True)
+                        apply_migrations(conn)
+                        self._ready.add(pool.path)
+                    else:
+                        self._apply_pragmas(conn, False)
+            else:
+                self._apply_pragmas(conn, False)
+        except Exception:
+            conn.close()
+            raise
+        with self._lock:
+            self.opened += 1
+            self._existing.add(pool.server_id)
+        return conn
+
+
+    def _evict(self):
+        """
+        Closes the least recently used pools above max_guilds.
+
+        Must be called with the lock held. Pools with borrowed
+        connections are skipped and will be evicted later.
+        """
+        excess = len(self._pools) - self.max_guilds
+        if excess <= 0:
+            return
+        for server_id in list(self._pools):
+            if excess <= 0:
+                break
+            pool = self._pools[server_id]
+            if pool.in_use:
+                continue
+            del self._pools[server_id]
+            pool.evicted = True
+            for conn in pool.idle:
+                conn.close()
+            pool.idle.clear()
+            self.evictions += 1
+            excess -= 1
+
+
+    def acquire(self, server_id, touch=True):
+        """
+        Borrows a connection for a server.
+
+        Args:
+            server_id as guild.id
+            touch as bool, False to keep the server's LRU position
+
+        Returns:
+            pool as GuildPool
+            conn as sqlite3.Connection
+        """
+        with self._lock:
+            pool = self._pools.get(server_id)
+            if pool is None:
+                pool = GuildPool(self, server_id, self.db_path(server_id))
+                self._pools[server_id] = pool
+            elif touch:
+                self._pools.move_to_end(server_id)
+            pool.in_use += 1
+            conn = pool.idle.pop() if pool.idle else None
+            self._evict()
+        if conn is None:
+            try:
+                conn = self._connect(pool)
+            except Exception:
+                with self._lock:
+                    pool.in_use -= 1
+                raise
+        return pool, conn
+
+
+    def release(self, pool, conn):
+        """
+        Gives a borrowed connection back to its pool.
+
+        Args:
+            pool as GuildPool
+            conn as sqlite3.Connection
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            pool.in_use -= 1
+            if not pool.evicted and len(pool.idle) < self.max_idle:
+                pool.idle.append(conn)
+                conn = None
+            self._evict()
+        if conn is not None:
+            conn.close()
+
+
+    def connection(self, server_id):
+        """
+        Borrows a connection wrapped in a PooledConnection.
+
+        Args:
+            server_id as guild.id
+        """
+        pool, conn = self.acquire(server_id)
+        return PooledConnection(pool, conn)
+
+
+    @property
+    def executor(self):
+        """
+        Worker threads used by the awaitable queries.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="servitor-db"
+            )
+        return self._executor
+
+
+    async def in_thread(self, func, *args):
+        """
+        Runs a blocking function on the worker threads.
+
+        Args:
+            func as a callable
+            *args for the callable
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+
+    def run(self, server_id, func, read_only=False):
+        """
+        Runs func(cur) on a borrowed connection, then commits.
+
+        Nothing is committed if func raises an exception. With
+        read_only, a server without a database file is read from
+        the empty template instead of creating the file.
+
+        Args:
+            server_id as guild.id
+            func as a callable receiving a sqlite3.Cursor
+            read_only as bool, True if func never writes
+        """
+        if read_only and not self.exists(server_id):
+            return self._read_template(func)
+        pool, conn = self.acquire(server_id)
+        try:
+            result = func(conn.cursor())
+            if conn.in_transaction:
+                conn.commit()
+            return result
+        finally:
+            self.release(pool, conn)
+
+
+    async def execute(self, server_id, query, params=()):
+        """
+        Executes a single query and commits it.
+
+        Args:
+            server_id as guild.id
+            query as str
+            params as tuple
+
+        Returns:
+            rowcount as int for the amount of rows changed
+        """
+        return await self.in_thread(
+            self.run, server_id, lambda cur: cur.execute(query, params).rowcount
+        )
+
+
+    async def executemany(self, server_id, query, seq_of_params):
+        """
+        Executes a query for every set of parameters in one transaction.
+
+        Args:
+            server_id as guild.id
+            query as str
+            seq_of_params as a list of tuples
+        """
+        return await self.in_thread(
+            self.run, server_id, lambda cur: cur.executemany(query, seq_of_params).rowcount
+        )
+
+
+    async def fetchone(self, server_id, query, params=()):
+        """
+        Executes a query and returns the first row (or None).
+
+        Args:
+            server_id as guild.id
+            query as str
+            params as tuple
+        """
+        return await self.in_thread(
+            self.run, server_id, lambda cur: cur.execute(query, params).fetchone(),
+            is_read_query(query)
+        )
+
+
+    async def fetchall(self, server_id, query, params=()):
+        """
+        Executes a query and returns all the rows.
+
+        Args:
+            server_id as guild.id
+            query as str
+            params as tuple
+        """
+        return await self.in_thread(
+            self.run, server_id, lambda cur: cur.execute(query, params).fetchall(),
+            is_read_query(query)
+        )
+
+
+    def transaction(self, server_id):
+        """
+        Opens a transaction to use with "async with".
+
+        Example:
+            async with db_transaction(guild.id) as trans:
+                row = await trans.fetchone("SELECT ...", (user_id,))
+                await trans.execute("UPDATE ...", (value, user_id))
+
+        Args:
+            server_id as guild.id
+        """
+        return AsyncTransaction(self, server_id)
+
+
+    def checkpoint(self, server_id, mode="PASSIVE"):
+        """
+        Runs a WAL checkpoint on a server's database.
+
+        Args:
+            server_id as guild.id
+            mode as str (PASSIVE, FULL, RESTART or TRUNCATE)
+
+        Returns:
+            (busy, log, checkpointed) as given by SQLite
+        """
+        pool, conn = self.acquire(server_id, touch=False)
+        try:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        finally:
+            self.release(pool, conn)
+
+
+    async def checkpoint_all(self, mode="PASSIVE"):
+        """
+        Runs a WAL checkpoint on every database currently open.
+
+        Used by the bot's background task so the checkpoints never
+        happen inline with a commit from a listener.
+
+        Args:
+            mode as str (PASSIVE, FULL, RESTART or TRUNCATE)
+
+        Returns:
+            count as int for the amount of databases checkpointed
+        """
+        if self.settings["journal_mode"] != "wal":
+            return 0
+        with self._lock:
+            server_ids = list(self._pools)
+        count = 0
+        for server_id in server_ids:
+            with self._lock:
+                pool = self._pools.get(server_id)
+                if pool is None or not pool.idle:
+                    continue
+            await self.in_thread(self.checkpoint, server_id, mode)
+            count += 1
+        self.checkpoints += count
+        return count
+
+
+    def close_all(self):
+        """
+        Closes every idle connection and forgets all the pools.
+
+        Used when the bot shuts down.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+            for pool in pools:
+                pool.evicted = True
+                for conn in pool.idle:
+                    conn.close()
+                pool.idle.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._template_lock:
+            if self._template is not None:
+                self._template.close()
+                self._template = None
+
+
+    def stats(self):
+        """
+        Returns a few counters about the pools.
+        """
+        with self._lock:
+            return {
+                "guilds": len(self._pools),
+                "idle": sum(len(pool.idle) for pool in self._pools.values()),
+                "in_use": sum(pool.in_use for pool in self._pools.values()),
+                "opened": self.opened,
+                "template_reads": self.template_reads,
+                "evictions": self.evictions,
+                "checkpoints": self.checkpoints
+            }
+
+
+
+def is_read_query(query):
+    """
+    Returns True for a query that can't write (a SELECT).
+
+    Args:
+        query as str
+    """
+    return query.lstrip()[:6].upper() == "SELECT"
+
+
+
+db_manager = ConnectionManager()
+
+
+async def db_execute(server_id, query, params=()):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await db_manager.execute(server_id, query, params)
+
+
+async def db_executemany(server_id, query, seq_of_params):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await db_manager.executemany(server_id, query, seq_of_params)
+
+
+async def db_fetchone(server_id, query, params=()):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await db_manager.fetchone(server_id, query, params)
+
+
+async def db_fetchall(server_id, query, params=()):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await db_manager.fetchall(server_id, query, params)
+
+
+def db_transaction(server_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return db_manager.transaction(server_id)
@@ -0,0 +1,346 @@
+# dbschema.py
+"""
+Schema of the servers' databases.
+
+USING THIS FILE ALLOWS THE ADMIN TO ADD/CHANGE TABLES FROM THE
+DATABASE WITHOUT HAVING TO FIND WHERE TO APPLY THE CHANGES.
+
+The schema is versioned with PRAGMA user_version. Every entry of
+MIGRATIONS brings a database file from the previous version to its
+own version. dbmanager.py applies the missing migrations the first
+time a server's database is opened by the bot, so the usual queries
+never have to run any CREATE TABLE.
+
+To change the schema, append a new (version, statements) entry at
+the end of MIGRATIONS. Never edit an entry that was already shipped.
+
+Author: Elcoyote Solitaire
+"""
+
+
+# Bit of every achievement in the mask of the achievements table.
+# The names are the keys of Intercogs.desc_achieves. A bit is saved in
+# the databases, so never change or reuse one: new achievements get
+# the next free bit at the end.
+ACHIEVEMENT_BITS = {
+    "Application": 0,
+    "Awkward": 1,
+    "Belligerent": 2,
+    "Bold": 3,
+    "Bot whisperer": 4,
+    "Cooldown!": 5,
+    "Feisty": 6,
+    "Garrulous": 7,
+    "Happy birthday": 8,
+    "Hugaholic": 9,
+    "Level": 10,
+    "Profile": 11,
+    "Statistics": 12,
+    "Statistics 2": 13,
+    "Suggestion": 14,
+    "Teddy bear": 15,
+    "Vocal": 16,
+    "Vote": 17
+}
+
+
+# (table, column) of every column saving channel IDs. A channel that
+# is deleted is removed from all of them (Modlogs.is_a_bot_chan), and
+# guildconfig.py keeps the IDs in memory to know which ones to remove.
+# A new table saving channels must be added here.
+CHANNEL_COLUMNS = (
+    ("setup", "id"),
+    ("servstats", "id"),
+    ("exception", "id"),
+    ("reddit_settings", "channel_id")
+)
+
+
+
+def migrate_achievements(cur):
+    """
+    Converts the text rows of achievements into one mask per member.
+
+    Names without a bit were never granted by the bot and are dropped.
+
+    Args:
+        cur as sqlite3.Cursor
+    """
+    masks = {}
+    for user_id, name in cur.execute("SELECT id, achievements FROM achievements").fetchall():
+        if user_id is not None and name in ACHIEVEMENT_BITS:
+            masks[user_id] = masks.get(user_id, 0) | 1 << ACHIEVEMENT_BITS[name]
+    cur.executemany(
+        "INSERT INTO achievements_new (id, mask, total) VALUES (?, ?, ?)",
+        [(user_id, mask, bin(mask).count("1")) for user_id, mask in masks.items()]
+    )
+
+
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS stats
+            (id INTEGER PRIMARY KEY,
+            messages INTEGER,
+            words INTEGER,
+            characters INTEGER,
+            emojis INTEGER,
+            reactions INTEGER,
+            edited INTEGER,
+            deleted INTEGER,
+            jvoice INTEGER,
+            tvoice INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS setup
+            (chans TEXT PRIMARY KEY,
+            id INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS level
+            (id INTEGER PRIMARY KEY,
+            exp INTEGER,
+            level INTEGER,
+            total INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS reaction
+            (message INTEGER,
+            emoji TEXT,
+            type TEXT,
+            role INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS servstats
+            (chans TEXT PRIMARY KEY,
+            id INTEGER,
+            region TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS suggestion
+            (number INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER,
+            authorid INTEGER,
+            decision TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS exception
+            (id INTEGER,
+            reason TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS punishment
+            (target INTEGER,
+            starters INTEGER,
+            message INTEGER,
+            channel INTEGER,
+            PRIMARY KEY (target, starters))''',
+
+        '''CREATE TABLE IF NOT EXISTS anniv
+            (id INTEGER PRIMARY KEY,
+            month INTEGER,
+            day INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS voice
+            (id INTEGER PRIMARY KEY,
+            jtime TIMESTAMP,
+            embmsg INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS timezone
+            (id INTEGER PRIMARY KEY,
+            timezone TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS achievements
+            (id INTEGER,
+            achievements TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS notes
+            (number INTEGER PRIMARY KEY AUTOINCREMENT,
+            authorid INTEGER,
+            ctime TIMESTAMP,
+            note TEXT,
+            active TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS achievecount
+            (id INTEGER,
+            achieve TEXT,
+            count INTEGER,
+            notes TEXT,
+            PRIMARY KEY (id, achieve))''',
+
+        '''CREATE TABLE IF NOT EXISTS fightgame
+            (attackid INTEGER,
+            opponentid INTEGER,
+            attack1 INTEGER,
+            attack2 INTEGER,
+            attack3 INTEGER,
+            defense1 INTEGER,
+            defense2 INTEGER,
+            defense3 INTEGER,
+            PRIMARY KEY (attackid, opponentid))''',
+
+        '''CREATE TABLE IF NOT EXISTS fightscore
+            (id INTEGER,
+            score INTEGER,
+            games INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS anonyme
+            (id INTEGER PRIMARY KEY,
+            prefix TEXT,
+            suffix TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS member_options
+            (id INTEGER PRIMARY KEY,
+            single_hug TEXT,
+            anon_hug TEXT,
+            group_hug TEXT,
+            fight TEXT,
+            kiss TEXT)''',
+
+        '''CREATE TABLE IF NOT EXISTS quiz
+            (starter INTEGER PRIMARY KEY,
+            question TEXT,
+            answer TEXT,
+            timestamp TIMESTAMP)''',
+
+        '''CREATE TABLE IF NOT EXISTS quiz_score
+            (id INTEGER PRIMARY KEY,
+            score INTEGER,
+            question INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS thisorthat
+            (id INTEGER PRIMARY KEY,
+            answers TEXT,
+            current_question INTEGER)''',
+
+        '''CREATE TABLE IF NOT EXISTS reddit_settings
+            (guild_id INTEGER PRIMARY KEY,
+            channel_id INTEGER,
+            sub TEXT,
+            last_post_ids TEXT,
+            on_off TEXT)'''
+    ]),
+    # counters default to 0 so they can be increased with a single
+    # INSERT ... ON CONFLICT DO UPDATE, and fightscore gets the primary
+    # key that ON CONFLICT needs (duplicated rows are added together).
+    (2, [
+        '''CREATE TABLE stats_new
+            (id INTEGER PRIMARY KEY,
+            messages INTEGER NOT NULL DEFAULT 0,
+            words INTEGER NOT NULL DEFAULT 0,
+            characters INTEGER NOT NULL DEFAULT 0,
+            emojis INTEGER NOT NULL DEFAULT 0,
+            reactions INTEGER NOT NULL DEFAULT 0,
+            edited INTEGER NOT NULL DEFAULT 0,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            jvoice INTEGER NOT NULL DEFAULT 0,
+            tvoice INTEGER NOT NULL DEFAULT 0)''',
+        '''INSERT INTO stats_new
+            SELECT id, IFNULL(messages, 0), IFNULL(words, 0), IFNULL(characters, 0),
+            IFNULL(emojis, 0), IFNULL(reactions, 0), IFNULL(edited, 0),
+            IFNULL(deleted, 0), IFNULL(jvoice, 0), IFNULL(tvoice, 0)
+            FROM stats''',
+        "DROP TABLE stats",
+        "ALTER TABLE stats_new RENAME TO stats",
+
+        '''CREATE TABLE level_new
+            (id INTEGER PRIMARY KEY,
+            exp INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0)''',
+        '''INSERT INTO level_new
+            SELECT id, IFNULL(exp, 0), IFNULL(level, 0), IFNULL(total, 0)
+            FROM level''',
+        "DROP TABLE level",
+        "ALTER TABLE level_new RENAME TO level",
+
+        '''CREATE TABLE achievecount_new
+            (id INTEGER,
+            achieve TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            notes TEXT,
+            PRIMARY KEY (id, achieve))''',
+        '''INSERT INTO achievecount_new
+            SELECT id, achieve, IFNULL(count, 0), notes
+            FROM achievecount''',
+        "DROP TABLE achievecount",
+        "ALTER TABLE achievecount_new RENAME TO achievecount",
+
+        '''CREATE TABLE fightscore_new
+            (id INTEGER PRIMARY KEY,
+            score INTEGER NOT NULL DEFAULT 0,
+            games INTEGER NOT NULL DEFAULT 0)''',
+        '''INSERT INTO fightscore_new
+            SELECT id, SUM(IFNULL(score, 0)), SUM(IFNULL(games, 0))
+            FROM fightscore WHERE id IS NOT NULL GROUP BY id''',
+        "DROP TABLE fightscore",
+        "ALTER TABLE fightscore_new RENAME TO fightscore"
+    ]),
+    # achievements become one bitmask per member (see ACHIEVEMENT_BITS)
+    # with the amount of achievements kept next to it for the boards.
+    (3, [
+        '''CREATE TABLE achievements_new
+            (id INTEGER PRIMARY KEY,
+            mask INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0)''',
+        migrate_achievements,
+        "DROP TABLE achievements",
+        "ALTER TABLE achievements_new RENAME TO achievements",
+        "CREATE INDEX achievements_total ON achievements (total)"
+    ]),
+    # one index per stats column, so the leaderboards are index seeks
+    (4, [
+        f"CREATE INDEX stats_{column} ON stats ({column})" for column in (
+            "messages", "words", "characters", "emojis", "reactions",
+            "edited", "deleted", "jvoice", "tvoice"
+        )
+    ]),
+    # ranks of the level system are counts of higher totals (levelranks.py)
+    (5, [
+        "CREATE INDEX level_total ON level (total)"
+    ]),
+]
+
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+
+def get_version(conn):
+    """
+    Returns the schema version of a database file.
+
+    Args:
+        conn as sqlite3.Connection
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    """
+    Brings a database file up to SCHEMA_VERSION.
+
+    Each missing migration runs in its own transaction together
+    with the new user_version, so a crash never leaves a file
+    with a half applied migration.
+
+    Args:
+        conn as sqlite3.Connection
+
+    Returns:
+        version as int for the schema version before the migrations
+    """
+    version = get_version(conn)
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            # another process may have migrated the file meanwhile
+            if get_version(conn) >= target:
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(cur)
+                else:
+                    cur.execute(statement)
+            cur.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
@@ -0,0 +1,215 @@
+# eventstages.py
+"""
+Stages of the event pipeline.
+
+The message events (message, message_edit, message_delete) are
+received once by the pipeline cog (cogs/pipeline.py). It drops the
+private messages, resolves the GuildConfig of the server once (see
+guildconfig.py), then runs every stage registered for that event,
+in order, with the same GuildEvent.
+
+A cog registers its stages in cog_load() and removes them in
+cog_unload(), so a reloaded cog does not run twice:
+
+    register_stage("stats", "message", self.message_stage, order=STATS_ORDER)
+    unregister_stage("stats")
+
+The registry lives here, outside of the cogs folder, so it survives
+the reload of any cog (including the pipeline itself).
+
+Author: Elcoyote Solitaire
+"""
+import time
+
+from bisect import insort
+
+
+EVENTS = ("message", "message_edit", "message_delete")
+
+# Order of the stages, lowest first. The stats are counted before
+# the quiz answers, and the logs come last.
+STATS_ORDER = 100
+QUIZ_ORDER = 200
+MODLOGS_ORDER = 300
+
+
+
+class GuildEvent:
+    """
+    A message event of a server, as given to every stage.
+
+    Args:
+        kind as str from EVENTS
+        message as discord.Message (the message after an edit)
+        config as GuildConfig of the server
+        before as discord.Message before an edit (or None)
+    """
+    def __init__(self, kind, message, config, before=None):
+        self.kind = kind
+        self.message = message
+        self.before = before
+        self.config = config
+        self.guild = message.guild
+        self.channel = message.channel
+        self.author = message.author
+
+
+    def is_exception(self, reason):
+        """
+        Verify if the channel of the event is in the exception's list.
+
+        Args:
+            reason as str
+        """
+        return self.config.is_exception(self.channel.id, reason)
+
+
+
+class Stage:
+    """
+    A registered stage with its timing.
+
+    Args:
+        name as str
+        event as str from EVENTS
+        callback as async function taking a GuildEvent
+        order as int
+        bots as bool, True to also receive the messages of bots
+    """
+    def __init__(self, name, event, callback, order, bots):
+        self.name = name
+        self.event = event
+        self.callback = callback
+        self.order = order
+        self.bots = bots
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+    def __lt__(self, other):
+        return (self.order, self.name) < (other.order, other.name)
+
+
+    async def run(self, event):
+        """
+        Runs the stage and times it. An error is printed and counted
+        so the next stages still run.
+
+        Args:
+            event as GuildEvent
+        """
+        start = time.perf_counter()
+        try:
+            await self.callback(event)
+        except Exception as err_stage:
+            self.errors += 1
+            print(f"Error in the {self.event} stage {self.name}: {err_stage}")
+        finally:
+            elapsed = time.perf_counter() - start
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+
+
+class EventStages:
+    """
+    Registry of the stages, by event.
+    """
+    def __init__(self):
+        self._stages = {event: [] for event in EVENTS}
+
+
+    def register(self, name, event, callback, order, bots=False):
+        """
+        Adds a stage, replacing the stage with the same name and event.
+
+        Args:
+            name as str
+            event as str from EVENTS
+            callback as async function taking a GuildEvent
+            order as int
+            bots as bool
+        """
+        if event not in self._stages:
+            raise ValueError(f"Unknown event {event}, must be one of {EVENTS}")
+        self._stages[event] = [
+            stage for stage in self._stages[event] if stage.name != name
+        ]
+        insort(self._stages[event], Stage(name, event, callback, order, bots))
+
+
+    def unregister(self, name):
+        """
+        Removes every stage of a name.
+
+        Args:
+            name as str
+        """
+        for event, stages in self._stages.items():
+            self._stages[event] = [stage for stage in stages if stage.name != name]
+
+
+    def wanted(self, event, bot_author):
+        """
+        Returns the stages to run for an event (the list is replaced,
+        never changed, so it can be iterated while a cog registers).
+
+        Args:
+            event as str from EVENTS
+            bot_author as bool, True when the author is a bot
+        """
+        stages = self._stages[event]
+        if bot_author:
+            return [stage for stage in stages if stage.bots]
+        return stages
+
+
+    async def dispatch(self, event):
+        """
+        Runs the stages of an event in order.
+
+        Args:
+            event as GuildEvent
+        """
+        for stage in self.wanted(event.kind, event.author.bot):
+            await stage.run(event)
+
+
+    def stats(self):
+        """
+        Returns the timing of every stage, in order.
+        """
+        return [
+            {
+                "name": stage.name,
+                "event": stage.event,
+                "order": stage.order,
+                "calls": stage.calls,
+                "errors": stage.errors,
+                "average_ms": stage.total_time / stage.calls * 1000 if stage.calls else 0.0,
+                "max_ms": stage.max_time * 1000
+            }
+            for event in EVENTS
+            for stage in self._stages[event]
+        ]
+
+
+
+event_stages = EventStages()
+
+
+def register_stage(name, event, callback, order, bots=False):
+    """
+    Mirror function to be imported in cogs.
+    """
+    event_stages.register(name, event, callback, order, bots)
+
+
+def unregister_stage(name):
+    """
+    Mirror function to be imported in cogs.
+    """
+    event_stages.unregister(name)
@@ -0,0 +1,270 @@
+# guildconfig.py
+"""
+In-memory configuration of the servers.
+
+The setup, exception and timezone tables are read on almost every
+event (modlogs, level up, voice, is_exception on every message...)
+but they only change when an admin runs a command like /setchan,
+/setalllogs, /exception, /settimezone or /setrole.
+
+This module loads those three tables once per server into a
+GuildConfig and serves them from memory afterwards, along with the
+channel IDs saved in the tables of CHANNEL_COLUMNS (dbschema.py).
+Every command that writes in one of those tables must call
+invalidate_config() once the write is done, so the next read loads
+the new values.
+
+The cache also keeps a reverse index of the setup table, from an
+entry (like the "users" log channel) to the servers that saved it.
+The events of a user (on_user_update) concern every mutual server,
+and guilds_with_setup() gives the ones logging them without opening
+their databases. preload_configs() loads every server at startup so
+the index is complete; a server that is not loaded yet (or was just
+invalidated by /setchan or /setalllogs) is loaded on its next lookup.
+
+Author: Elcoyote Solitaire
+"""
+import threading
+import pytz
+
+from dbmanager import db_manager
+from dbschema import CHANNEL_COLUMNS
+
+
+DEFAULT_TIMEZONE = "US/Eastern"
+
+
+
+class GuildConfig:
+    """
+    Configuration of a single server.
+
+    Args:
+        setup as dict of {chans: id} from the setup table
+        exceptions as set of (id, reason) from the exception table
+        timezone_name as str (or None) from the timezone table
+        channels as set of the channel IDs saved in the database
+            (see CHANNEL_COLUMNS in dbschema.py)
+    """
+    def __init__(self, setup, exceptions, timezone_name, channels):
+        self.setup = setup
+        self.exceptions = exceptions
+        self.timezone_name = timezone_name
+        self.channels = channels
+        self.time_zone = pytz.timezone(timezone_name or DEFAULT_TIMEZONE)
+
+
+    def get_setup(self, chans):
+        """
+        Returns the ID saved for an entry of the setup table (or None).
+
+        Args:
+            chans as str for the name of the entry
+        """
+        return self.setup.get(chans)
+
+
+    def is_exception(self, channel_id, reason):
+        """
+        Verify if the channel is in the exception's list.
+
+        Args:
+            channel_id as TextChannel.id
+            reason as str
+        """
+        return (channel_id, reason) in self.exceptions
+
+
+    def references(self, channel_id):
+        """
+        Verify if a channel is saved in the database of the server.
+
+        Args:
+            channel_id as channel.id
+        """
+        return channel_id in self.channels
+
+
+
+class GuildConfigCache:
+    """
+    Cache of the GuildConfig of every server.
+
+    A server is loaded from its database on the first read (a miss)
+    and served from memory afterwards (a hit). invalidate() drops
+    a server; a load that was running during an invalidate() is not
+    kept, since it may have read the values from before the write.
+    """
+    def __init__(self):
+        self._configs = {}
+        self._setup_index = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+    @staticmethod
+    def _load(cur):
+        """
+        Reads the configuration tables of a server.
+
+        Args:
+            cur as sqlite3.Cursor
+        """
+        setup = dict(cur.execute("SELECT chans, id FROM setup").fetchall())
+        exceptions = set(cur.execute("SELECT id, reason FROM exception").fetchall())
+        row = cur.execute("SELECT timezone FROM timezone").fetchone()
+        channels = set()
+        for table, column in CHANNEL_COLUMNS:
+            channels.update(
+                channel_id for (channel_id,) in
+                cur.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL")
+            )
+        return GuildConfig(setup, exceptions, row[0] if row else None, channels)
+
+
+    async def get(self, server_id):
+        """
+        Returns the GuildConfig of a server.
+
+        Args:
+            server_id as guild.id
+        """
+        with self._lock:
+            config = self._configs.get(server_id)
+            if config is not None:
+                self.hits += 1
+                return config
+            self.misses += 1
+            generation = self._generations.get(server_id, 0)
+        config = await db_manager.in_thread(db_manager.run, server_id, self._load, True)
+        with self._lock:
+            if self._generations.get(server_id, 0) == generation:
+                self._unindex(server_id)
+                self._configs[server_id] = config
+                for chans, setup_id in config.setup.items():
+                    if setup_id:
+                        self._setup_index.setdefault(chans, {})[server_id] = setup_id
+        return config
+
+
+    def _unindex(self, server_id):
+        """
+        Removes a server from the setup index (with the lock held).
+
+        Args:
+            server_id as guild.id
+        """
+        config = self._configs.get(server_id)
+        if config is None:
+            return
+        for chans in config.setup:
+            servers = self._setup_index.get(chans)
+            if servers is not None:
+                servers.pop(server_id, None)
+                if not servers:
+                    del self._setup_index[chans]
+
+
+    async def guilds_with_setup(self, chans, server_ids):
+        """
+        Returns the servers with an entry in their setup table.
+
+        The loaded servers are read from the index, the others
+        are loaded first.
+
+        Args:
+            chans as str for the name of the entry
+            server_ids as list of guild.id to look in
+
+        Returns:
+            dict of {server_id: id saved for the entry}
+        """
+        with self._lock:
+            servers = self._setup_index.get(chans, {})
+            found = {
+                server_id: servers[server_id] for server_id in server_ids if server_id in servers
+            }
+            missing = [server_id for server_id in server_ids if server_id not in self._configs]
+        for server_id in missing:
+            setup_id = (await self.get(server_id)).get_setup(chans)
+            if setup_id:
+                found[server_id] = setup_id
+        return found
+
+
+    async def preload(self, server_ids):
+        """
+        Loads the servers that are not in the cache yet.
+
+        Args:
+            server_ids as iterable of guild.id
+        """
+        for server_id in list(server_ids):
+            with self._lock:
+                loaded = server_id in self._configs
+            if not loaded:
+                await self.get(server_id)
+
+
+    def invalidate(self, server_id):
+        """
+        Forgets the configuration of a server.
+
+        Args:
+            server_id as guild.id
+        """
+        with self._lock:
+            self._unindex(server_id)
+            self._configs.pop(server_id, None)
+            self._generations[server_id] = self._generations.get(server_id, 0) + 1
+            self.invalidations += 1
+
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "guilds": len(self._configs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
+
+
+
+config_cache = GuildConfigCache()
+
+
+async def get_config(server_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await config_cache.get(server_id)
+
+
+def invalidate_config(server_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    config_cache.invalidate(server_id)
+
+
+async def guilds_with_setup(chans, server_ids):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await config_cache.guilds_with_setup(chans, server_ids)
+
+
+async def preload_configs(server_ids):
+    """
+    Mirror function to be imported in cogs.
+    """
+    await config_cache.preload(server_ids)
@@ -0,0 +1,171 @@
+# levelranks.py
+"""
+Rank of the members in the level system.
+
+The rank of a member is 1 + the amount of members with a higher
+total of exp, and the population is the amount of members in the
+level table. Both come back from a single call to get_rank().
+
+The level table has an index on total (see dbschema.py), so the
+rank is a COUNT(*) over an index range instead of a ranking of the
+whole table. That is the default.
+
+Optionally (MAX_RANKED_GUILDS above 0), the totals of the most
+recently used servers are also kept in memory as a sorted list, so a
+rank is found with a binary search. Loading a server reads its whole
+level table and every level update moves an item of the list (O(n)),
+so it only pays off for servers of a few thousand members that ask
+for ranks much more often than they gain exp. update_level() keeps
+the lists in step through track_level().
+
+Author: Elcoyote Solitaire
+"""
+import threading
+
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from dbmanager import db_manager, db_fetchone
+
+
+# servers kept in memory, 0 to always count with the index
+MAX_RANKED_GUILDS = 0
+
+
+
+class GuildRanks:
+    """
+    Totals of exp of a single server.
+
+    Args:
+        rows as list of (user_id, total) from the level table
+    """
+    def __init__(self, rows):
+        self.totals = {user_id: total for user_id, total in rows}
+        self.ordered = sorted(self.totals.values())
+
+
+    def rank(self, total):
+        """
+        Returns (rank, population) for a total of exp.
+
+        Args:
+            total as int
+        """
+        population = len(self.ordered)
+        return population - bisect_right(self.ordered, total) + 1, population
+
+
+    def update(self, user_id, total):
+        """
+        Moves a member to a new total of exp.
+
+        Args:
+            user_id as member.id
+            total as int
+        """
+        old_total = self.totals.get(user_id)
+        if old_total is not None:
+            del self.ordered[bisect_left(self.ordered, old_total)]
+        self.totals[user_id] = total
+        insort(self.ordered, total)
+
+
+
+class LevelRanks:
+    """
+    Rank service of the level system.
+
+    Counts with the index of the level table. With MAX_RANKED_GUILDS
+    above 0, the servers are loaded in memory on their first rank
+    lookup and the least recently used ones are forgotten past
+    MAX_RANKED_GUILDS.
+    """
+    def __init__(self):
+        self._guilds = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _load(cur):
+        """
+        Reads the totals of a server.
+
+        Args:
+            cur as sqlite3.Cursor
+        """
+        return GuildRanks(cur.execute("SELECT id, total FROM level").fetchall())
+
+
+    async def get_rank(self, server_id, total):
+        """
+        Returns the rank and the population for a total of exp.
+
+        Args:
+            server_id as guild.id
+            total as int
+
+        Returns:
+            rank as int
+            population as int
+        """
+        if MAX_RANKED_GUILDS <= 0:
+            return await db_fetchone(
+                server_id,
+                "SELECT (SELECT COUNT(*) FROM level WHERE total > ?) + 1, "
+                "(SELECT COUNT(*) FROM level)",
+                (total,)
+            )
+        with self._lock:
+            ranks = self._guilds.get(server_id)
+            if ranks is not None:
+                self._guilds.move_to_end(server_id)
+                return ranks.rank(total)
+            generation = self._generations.get(server_id, 0)
+        ranks = await db_manager.in_thread(db_manager.run, server_id, self._load, True)
+        with self._lock:
+            # a total changed during the load, the list may be missing it
+            if self._generations.get(server_id, 0) == generation:
+                self._guilds[server_id] = ranks
+                while len(self._guilds) > MAX_RANKED_GUILDS:
+                    self._guilds.popitem(last=False)
+            return ranks.rank(total)
+
+
+    def track_level(self, server_id, user_id, total):
+        """
+        Keeps the list of a server in step with a new total.
+
+        Must be called after every change to level.total.
+
+        Args:
+            server_id as guild.id
+            user_id as member.id
+            total as int
+        """
+        if MAX_RANKED_GUILDS <= 0:
+            return
+        with self._lock:
+            ranks = self._guilds.get(server_id)
+            if ranks is not None:
+                ranks.update(user_id, total)
+            else:
+                self._generations[server_id] = self._generations.get(server_id, 0) + 1
+
+
+
+level_ranks = LevelRanks()
+
+
+async def get_rank(server_id, total):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return await level_ranks.get_rank(server_id, total)
+
+
+def track_level(server_id, user_id, total):
+    """
+    Mirror function to be imported in cogs.
+    """
+    level_ranks.track_level(server_id, user_id, total)
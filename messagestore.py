@@ -0,0 +1,323 @@
+# messagestore.py
+"""
+Compact store of the recent messages, for the edit and delete logs.
+
+discord.py only gives the content of an edited or deleted message
+when the message is in its cache (max_messages in config.json), and
+a cached discord.Message costs a few KB. The modlogs keep their own
+record of the messages of the servers logging the edits instead:
+(author_id, channel_id, content, attachment URLs) with the content
+compressed, which costs a few hundred bytes per message.
+
+The content is compressed with raw deflate and a preset dictionary
+of common words (ZDICT), so even short messages get smaller. A
+content too short or that does not compress is kept as is.
+
+The records of a server are kept from the oldest to the newest and
+the oldest are dropped above the "guild_bytes" budget of the
+"message_store" settings (see cachepolicy.py). Above "total_bytes"
+for the whole bot, the servers that had no message for the longest
+lose their oldest records first.
+
+Author: Elcoyote Solitaire
+"""
+import zlib
+
+from collections import OrderedDict
+from discord.utils import snowflake_time
+
+
+# memory of a record besides its content and URLs (tuple, bytes
+# object, IDs and node of the OrderedDict), measured with tracemalloc
+RECORD_OVERHEAD = 300
+# contents shorter than that are not compressed
+MIN_COMPRESS = 24
+# raw deflate with a 2 KB window, which the dictionary must fit in
+WINDOW_BITS = -11
+MEM_LEVEL = 2
+ZDICT = (
+    "the you to and a i it is that of in for this be on have not are with just but so "
+    "was do what like can my me if your all at get no he they know we good one think "
+    "lol yeah about out it's i'm don't how there will people up time would when or "
+    "more now then from some really see because an here make go had oh want need too "
+    "going well also only been thanks sure thing right yes got much very still why ok "
+    "okay something did back who game new can't let day love look which even way work "
+    "lot those them take he's that's she him her has our us where "
+    "https://discord.com/channels/ https://cdn.discordapp.com/attachments/ "
+    "https://tenor.com/view/ https://www.youtube.com/watch?v= "
+).encode()
+
+RAW = b"\x00"
+DEFLATED = b"\x01"
+
+
+def compress(content):
+    """
+    Returns the stored bytes of a content.
+
+    Args:
+        content as str
+    """
+    data = content.encode()
+    if len(data) >= MIN_COMPRESS:
+        compressor = zlib.compressobj(
+            9, zlib.DEFLATED, WINDOW_BITS, MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, ZDICT
+        )
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            return DEFLATED + deflated
+    return RAW + data
+
+
+def decompress(stored):
+    """
+    Returns the content of stored bytes.
+
+    Args:
+        stored as bytes from compress()
+    """
+    if stored[:1] == DEFLATED:
+        return zlib.decompressobj(WINDOW_BITS, ZDICT).decompress(stored[1:]).decode()
+    return stored[1:].decode()
+
+
+
+class StoredMessage:
+    """
+    A message read back from the store.
+
+    Args:
+        message_id as message.id
+        record as tuple of the store
+    """
+    __slots__ = ("id", "author_id", "channel_id", "content", "attachments", "created_at")
+
+    def __init__(self, message_id, record):
+        self.id = message_id
+        self.author_id, self.channel_id, stored, self.attachments = record
+        self.content = decompress(stored)
+        self.created_at = snowflake_time(message_id)
+
+
+
+class GuildMessages:
+    """
+    Records of a single server, from the oldest to the newest.
+    """
+    def __init__(self):
+        self.records = OrderedDict()
+        self.size = 0
+
+
+    @staticmethod
+    def record_size(record):
+        """
+        Returns the estimated memory of a record.
+
+        Args:
+            record as tuple
+        """
+        return RECORD_OVERHEAD + len(record[2]) + sum(len(url) for url in record[3])
+
+
+    def put(self, message_id, record):
+        """
+        Adds or replaces a record.
+
+        Args:
+            message_id as message.id
+            record as tuple
+        """
+        self.pop(message_id)
+        self.records[message_id] = record
+        self.size += self.record_size(record)
+
+
+    def pop(self, message_id):
+        """
+        Removes a record, returning it (or None).
+
+        Args:
+            message_id as message.id
+        """
+        record = self.records.pop(message_id, None)
+        if record is not None:
+            self.size -= self.record_size(record)
+        return record
+
+
+    def pop_oldest(self):
+        """
+        Removes the oldest record, returning its size.
+        """
+        _, record = self.records.popitem(last=False)
+        size = self.record_size(record)
+        self.size -= size
+        return size
+
+
+
+class MessageStore:
+    """
+    Compact records of the recent messages of every server.
+    """
+    def __init__(self, guild_bytes=262144, total_bytes=67108864):
+        self.guild_bytes = guild_bytes
+        self.total_bytes = total_bytes
+        self._guilds = OrderedDict()
+        self.size = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def configure(self, settings):
+        """
+        Applies the "message_store" settings.
+
+        Args:
+            settings as dict with guild_bytes and total_bytes
+        """
+        self.guild_bytes = int(settings["guild_bytes"])
+        self.total_bytes = int(settings["total_bytes"])
+
+
+    def add(self, server_id, message_id, author_id, channel_id, content, attachments):
+        """
+        Records a message (or its new content after an edit).
+
+        Args:
+            server_id as guild.id
+            message_id as message.id
+            author_id as member.id
+            channel_id as channel.id
+            content as str
+            attachments as list of URLs
+        """
+        if self.guild_bytes <= 0:
+            return
+        stored = compress(content)
+        self.raw_bytes += len(content.encode())
+        self.stored_bytes += len(stored) - 1
+        guild = self._guilds.pop(server_id, None) or GuildMessages()
+        self._guilds[server_id] = guild
+        before = guild.size
+        guild.put(message_id, (author_id, channel_id, stored, tuple(attachments)))
+        while guild.size > self.guild_bytes and len(guild.records) > 1:
+            guild.pop_oldest()
+            self.evictions += 1
+        self.size += guild.size - before
+        self._trim()
+
+
+    def _trim(self):
+        """
+        Drops the oldest records of the quietest servers above total_bytes.
+        """
+        while self.size > self.total_bytes and self._guilds:
+            server_id, guild = next(iter(self._guilds.items()))
+            if guild.records:
+                self.size -= guild.pop_oldest()
+                self.evictions += 1
+            if not guild.records:
+                del self._guilds[server_id]
+
+
+    def get(self, server_id, message_id):
+        """
+        Returns a recorded message as StoredMessage (or None).
+
+        Args:
+            server_id as guild.id
+            message_id as message.id
+        """
+        guild = self._guilds.get(server_id)
+        record = guild.records.get(message_id) if guild else None
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return StoredMessage(message_id, record)
+
+
+    def pop(self, server_id, message_id):
+        """
+        Removes a recorded message, returning it as StoredMessage (or None).
+
+        Args:
+            server_id as guild.id
+            message_id as message.id
+        """
+        stored = self.get(server_id, message_id)
+        if stored is not None:
+            guild = self._guilds[server_id]
+            before = guild.size
+            guild.pop(message_id)
+            self.size += guild.size - before
+        return stored
+
+
+    def forget(self, server_id):
+        """
+        Drops every record of a server.
+
+        Args:
+            server_id as guild.id
+        """
+        guild = self._guilds.pop(server_id, None)
+        if guild is not None:
+            self.size -= guild.size
+
+
+    def stats(self):
+        """
+        Returns the counters of the store.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "guilds": len(self._guilds),
+            "messages": sum(len(guild.records) for guild in self._guilds.values()),
+            "bytes": self.size,
+            "ratio": self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
+
+message_store = MessageStore()
+
+
+def store_message(message):
+    """
+    Records a message of a server (see MessageStore.add).
+
+    Args:
+        message as discord.Message
+    """
+    message_store.add(
+        message.guild.id,
+        message.id,
+        message.author.id,
+        message.channel.id,
+        message.content,
+        [attachment.url for attachment in message.attachments]
+    )
+
+
+def pop_message(server_id, message_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return message_store.pop(server_id, message_id)
+
+
+def get_message(server_id, message_id):
+    """
+    Mirror function to be imported in cogs.
+    """
+    return message_store.get(server_id, message_id)
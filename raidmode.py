@@ -0,0 +1,204 @@
+# raidmode.py
+"""
+Raid detection of the servers, for the modlogs.
+
+During a raid, hundreds of accounts join a server in a few minutes.
+One join embed and one welcome message per member exhaust the rate
+limit of the channels, and the logs fall minutes behind.
+
+Every join is counted in a sliding window per server. When a server
+gets raid_joins joins (or more) within raid_window seconds, it is in
+raid mode: the joins, leaves and bulk deletions are added to an
+aggregate instead of being logged one by one, and the welcome
+messages are not sent. Modlogs posts the aggregates every
+RAID_SUMMARY_INTERVAL seconds, and the raid mode ends at the first
+summary where the joins of the window are below the threshold.
+
+The thresholds are saved in the setup table with /raidmode
+("raid_joins" and "raid_window"), RAID_JOINS and RAID_WINDOW
+otherwise.
+
+Author: Elcoyote Solitaire
+"""
+import time
+
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+
+RAID_JOINS = 10
+RAID_WINDOW = 30
+# seconds between the summaries of a raid
+RAID_SUMMARY_INTERVAL = 30
+# IDs kept per summary, the others are only counted
+RAID_MAX_IDS = 5000
+
+# (upper limit in seconds, label) of the account age histogram
+ACCOUNT_AGES = (
+    (3600, "< 1 hour"),
+    (86400, "< 1 day"),
+    (604800, "< 1 week"),
+    (2592000, "< 1 month"),
+    (31536000, "< 1 year"),
+    (None, "1 year +")
+)
+
+
+def account_age(created_at):
+    """
+    Returns the label of the histogram for an account.
+
+    Args:
+        created_at as datetime of the account (aware)
+    """
+    seconds = (datetime.now(timezone.utc) - created_at).total_seconds()
+    for limit, label in ACCOUNT_AGES:
+        if limit is None or seconds < limit:
+            return label
+    return ACCOUNT_AGES[-1][1]
+
+
+
+class RaidAggregate:
+    """
+    Members that joined (or left) during a summary of a raid.
+    """
+    def __init__(self):
+        self.count = 0
+        self.ids = []
+        self.ages = Counter()
+
+
+    def add(self, member):
+        """
+        Adds a member to the aggregate.
+
+        Args:
+            member as discord.Member
+        """
+        self.count += 1
+        if len(self.ids) < RAID_MAX_IDS:
+            self.ids.append(member.id)
+        self.ages[account_age(member.created_at)] += 1
+
+
+    def histogram(self):
+        """
+        Returns the account ages as [(label, count)], youngest first.
+        """
+        return [(label, self.ages[label]) for _, label in ACCOUNT_AGES if self.ages[label]]
+
+
+
+class GuildRaid:
+    """
+    Join window and raid aggregates of a single server.
+    """
+    def __init__(self):
+        self.joins = deque()
+        self.threshold = RAID_JOINS
+        self.window = RAID_WINDOW
+        self.active = False
+        self.started_at = None
+        self.reset()
+
+
+    def reset(self):
+        """
+        Starts the aggregates of the next summary.
+        """
+        self.joined = RaidAggregate()
+        self.left = RaidAggregate()
+        self.bulk_deletes = 0
+        self.deleted_messages = 0
+
+
+    def expire(self, now):
+        """
+        Drops the joins older than the window.
+
+        Args:
+            now as time.monotonic()
+        """
+        while self.joins and now - self.joins[0] > self.window:
+            self.joins.popleft()
+
+
+
+class RaidDetector:
+    """
+    Raid detection of every server.
+    """
+    def __init__(self):
+        self._guilds = {}
+        self.raids = 0
+
+
+    def record_join(self, server_id, threshold, window):
+        """
+        Counts a join, starting the raid mode at the threshold.
+
+        Args:
+            server_id as guild.id
+            threshold as int, joins starting the raid mode
+            window as int, seconds of the sliding window
+
+        Returns:
+            True if the server is in raid mode
+        """
+        state = self._guilds.setdefault(server_id, GuildRaid())
+        state.threshold = threshold
+        state.window = window
+        now = time.monotonic()
+        state.joins.append(now)
+        state.expire(now)
+        if not state.active and len(state.joins) >= threshold:
+            state.active = True
+            state.started_at = datetime.now(timezone.utc)
+            self.raids += 1
+        return state.active
+
+
+    def active(self, server_id):
+        """
+        Returns the GuildRaid of a server in raid mode (or None).
+
+        Args:
+            server_id as guild.id
+        """
+        state = self._guilds.get(server_id)
+        return state if state is not None and state.active else None
+
+
+    def summaries(self):
+        """
+        Takes the aggregates of the servers in raid mode, and ends
+        the raids whose joins went back under the threshold.
+
+        Returns:
+            list of (server_id, GuildRaid, ended as bool); the
+            aggregates of the GuildRaid are the ones taken
+        """
+        now = time.monotonic()
+        taken = []
+        for server_id, state in list(self._guilds.items()):
+            state.expire(now)
+            if not state.active:
+                if not state.joins:
+                    del self._guilds[server_id]
+                continue
+            ended = len(state.joins) < state.threshold
+            summary = GuildRaid()
+            summary.started_at = state.started_at
+            summary.joined, summary.left = state.joined, state.left
+            summary.bulk_deletes = state.bulk_deletes
+            summary.deleted_messages = state.deleted_messages
+            state.reset()
+            if ended:
+                state.active = False
+            taken.append((server_id, summary, ended))
+        return taken
+
+
+
+raid_detector = RaidDetector()
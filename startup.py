@@ -0,0 +1,209 @@
+# startup.py
+"""
+Startup of the bot: loading of the extensions and lazy imports.
+
+load_extensions() is used by MyBot.setup_hook(). It loads the core
+extensions first (CORE_EXTENSIONS, which the other cogs import),
+then every other cog of ./cogs one after the other, and returns the
+time spent importing every cog for the startup report. Importing a
+cog blocks the event loop, so the cogs can't load in parallel: the
+startup gets faster by importing less, with the lazy imports below.
+
+lazy_import() gives a module that is only imported on its first
+use, so the heavy libraries of a cog (matplotlib, PIL, imdb...) are
+imported by the first command needing them instead of delaying the
+connection of the bot:
+
+    plt = lazy_import("matplotlib.pyplot")
+
+Author: Elcoyote Solitaire
+"""
+import importlib
+import importlib.abc
+import importlib.machinery
+import os
+import sys
+import time
+import types
+
+from discord.ext import commands
+
+
+# loaded first, in this order, since the other cogs import them
+CORE_EXTENSIONS = ("intercogs",)
+
+# {module name: seconds} of the lazy imports done so far
+lazy_import_times = {}
+
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module imported on the first access to one of its attributes.
+
+    Args:
+        name as str for the full name of the module
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_name"] = name
+
+
+    def __getattr__(self, attribute):
+        name = self.__dict__["_lazy_name"]
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        if name not in lazy_import_times:
+            lazy_import_times[name] = time.perf_counter() - start
+            print(f"Lazy import of {name} ({lazy_import_times[name] * 1000:.0f} ms)")
+        # becomes a plain copy of the module, as fast as the real one
+        self.__dict__.update(module.__dict__)
+        self.__class__ = types.ModuleType
+        return getattr(module, attribute)
+
+
+
+def lazy_import(name):
+    """
+    Returns a module that is imported on its first use.
+
+    A module that is already imported is returned as is.
+
+    Args:
+        name as str for the full name of the module
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+
+class TimedLoader(importlib.abc.Loader):
+    """
+    Loader of a cog that times the execution of its module.
+
+    Args:
+        loader as the loader found by the import system
+        import_times as dict of {module name: seconds}
+    """
+    def __init__(self, loader, import_times):
+        self.loader = loader
+        self.import_times = import_times
+
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.import_times[module.__name__] = time.perf_counter() - start
+
+
+    def __getattr__(self, attribute):
+        return getattr(self.loader, attribute)
+
+
+
+class CogImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Finder giving a TimedLoader to the modules of a package.
+
+    Args:
+        package as str
+    """
+    def __init__(self, package="cogs"):
+        self.prefix = f"{package}."
+        self.import_times = {}
+
+
+    def find_spec(self, fullname, path, target=None):
+        if not fullname.startswith(self.prefix):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is not None and spec.loader is not None:
+            spec.loader = TimedLoader(spec.loader, self.import_times)
+        return spec
+
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+
+    def __exit__(self, *exc_info):
+        sys.meta_path.remove(self)
+
+
+
+async def load_extension(bot, extension):
+    """
+    Loads a cog, returning the error as str if it fails.
+
+    Args:
+        bot as commands.Bot
+        extension as str for the name of the cog
+    """
+    try:
+        await bot.load_extension(f"cogs.{extension}")
+    except commands.ExtensionError as extension_failed:
+        return f"{type(extension_failed).__name__}: {extension_failed}"
+    return None
+
+
+async def load_extensions(bot, folder="./cogs"):
+    """
+    Loads every cog of the folder, the core ones first.
+
+    Args:
+        bot as commands.Bot
+        folder as str
+
+    Returns:
+        list of (extension, import seconds or None, error or None),
+        in the order of the files
+        seconds as float for the whole loading
+    """
+    extensions = sorted(file[:-3] for file in os.listdir(folder) if file.endswith(".py"))
+    core = [extension for extension in CORE_EXTENSIONS if extension in extensions]
+    others = [extension for extension in extensions if extension not in core]
+    errors = {}
+    start = time.perf_counter()
+    with CogImportTimer() as timer:
+        for extension in core + others:
+            errors[extension] = await load_extension(bot, extension)
+    elapsed = time.perf_counter() - start
+    return [
+        (extension, timer.import_times.get(f"cogs.{extension}"), errors[extension])
+        for extension in extensions
+    ], elapsed
+
+
+def print_report(report, elapsed):
+    """
+    Prints the startup report of load_extensions().
+
+    Args:
+        report as list of (extension, import seconds, error)
+        elapsed as float for the whole loading
+    """
+    print("\n-----EXTENSIONS-----")
+    loaded = 0
+    imports = 0.0
+    for extension, import_time, error in sorted(
+        report, key=lambda item: item[1] or 0.0, reverse=True
+    ):
+        if error:
+            print(f"Failed to load extension {extension}\n{error}")
+            continue
+        loaded += 1
+        imports += import_time or 0.0
+        print(f"Loaded extension '{extension}' (import {(import_time or 0.0) * 1000:.0f} ms)")
+    print(
+        f"¤¤¤ {loaded}/{len(report)} extensions loaded in {elapsed * 1000:.0f} ms "
+        f"({imports * 1000:.0f} ms of imports) ¤¤¤"
+    )
@@ -0,0 +1,216 @@
+# tokenizer.py
+"""
+Counts the words, characters and emojis of a message.
+
+Used by the stats system for every message sent. The matcher is
+built once from the data of the emoji package:
+
+- a character class covering every non ASCII code point found in an
+  emoji, which lets the regex skip plain text at C speed;
+- the set of every emoji sequence, used to split a run of those code
+  points into whole emojis (longest first), so a ZWJ sequence, a skin
+  tone or a flag counts as one emoji. The lengths of the sequences
+  are indexed by their first code point, so each position of a run
+  only tries the lengths of the emojis starting with that character;
+- the keycaps (1️⃣, #️⃣...) and the custom emojis of Discord
+  (<:name:id> and <a:name:id>).
+
+Emojis are neither words nor characters: a word made only of emojis
+is not counted as a word.
+
+The tables are built by emoji_tables() on the first message with
+an emoji (or by a thread started by the stats cog), so the emoji
+package is not imported before the bot connects.
+
+Run this file directly for a micro-benchmark against the previous
+per character loop (python tokenizer.py).
+
+Author: Elcoyote Solitaire
+"""
+import functools
+import re
+
+from startup import lazy_import
+
+
+emoji = lazy_import("emoji")
+
+CUSTOM_EMOJI = r"<a?:\w{2,32}:\d{15,21}>"
+KEYCAP = "[#*0-9]\uFE0F?\u20E3"
+RANGE_GAP = 256
+
+
+
+def codepoint_ranges(codepoints, gap=RANGE_GAP):
+    """
+    Writes sorted code points as the ranges of a regex class.
+
+    The regex engine tests a class range by range, so the code
+    points above U+2000 that are less than gap apart are merged in
+    a single range. The class then also matches a few characters
+    that are not emojis, which split_emoji_run() gives back as text.
+
+    Args:
+        codepoints as a sorted list of str
+        gap as int
+    """
+    ranges = []
+    for char in codepoints:
+        if ranges and ord(char) > 0x2000 and ord(char) - ord(ranges[-1][1]) <= gap:
+            ranges[-1][1] = char
+        else:
+            ranges.append([char, char])
+    return "".join(
+        re.escape(first) if first == last else f"{re.escape(first)}-{re.escape(last)}"
+        for first, last in ranges
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def emoji_tables():
+    """
+    Builds the tables of the emojis, once.
+
+    Returns:
+        emojis as frozenset of every emoji sequence
+        lengths as dict of {first code point: lengths, longest first}
+        matcher as re.Pattern
+    """
+    emojis = frozenset(emoji.EMOJI_DATA)
+    lengths = {}
+    for sequence in emojis:
+        lengths.setdefault(sequence[0], set()).add(len(sequence))
+    lengths = {char: tuple(sorted(sizes, reverse=True)) for char, sizes in lengths.items()}
+    codepoints = codepoint_ranges(
+        sorted({char for sequence in emojis for char in sequence if ord(char) > 127})
+    )
+    # the lookahead lets the regex skip the characters that can't
+    # start any of the three groups without trying each of them
+    matcher = re.compile(
+        f"(?=[<#*0-9{codepoints}])"
+        f"(?:({CUSTOM_EMOJI})|({KEYCAP})|([{codepoints}]+))"
+    )
+    return emojis, lengths, matcher
+
+
+def split_emoji_run(run):
+    """
+    Splits a run of emoji code points into whole emojis.
+
+    Args:
+        run as str
+
+    Returns:
+        emojis as int for the amount of emojis
+        leftover as str for the code points that are not an emoji
+    """
+    sequences, lengths, _ = emoji_tables()
+    if run in sequences:
+        return 1, ""
+    emojis = 0
+    leftover = []
+    index = 0
+    length = len(run)
+    while index < length:
+        for size in lengths.get(run[index], ()):
+            if run[index:index + size] in sequences:
+                emojis += 1
+                index += size
+                break
+        else:
+            leftover.append(run[index])
+            index += 1
+    return emojis, "".join(leftover)
+
+
+def count_message(content):
+    """
+    Counts the words, characters and emojis of a message.
+
+    Args:
+        content as message.content
+
+    Returns:
+        words as int
+        characters as int (without spaces and emojis)
+        emojis as int
+    """
+    if content.isascii() and "<" not in content:
+        words = content.split()
+        return len(words), len("".join(words)), 0
+    matcher = emoji_tables()[2]
+    if not matcher.search(content):
+        words = content.split()
+        return len(words), len("".join(words)), 0
+
+    emojis = 0
+
+    def strip_emoji(match):
+        nonlocal emojis
+        if match.lastindex == 3:
+            found, leftover = split_emoji_run(match.group(3))
+            emojis += found
+            return leftover
+        emojis += 1
+        return ""
+
+    words = matcher.sub(strip_emoji, content).split()
+    return len(words), len("".join(words)), emojis
+
+
+
+def legacy_count(content):
+    """
+    Previous counting of Stats.on_message, kept for the benchmark.
+
+    Args:
+        content as message.content
+    """
+    words = content.split()
+    emojis = sum(1 for char in content if emoji.is_emoji(char))
+    return len(words) - emojis, len("".join(words)) - emojis, emojis
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    random.seed(2024)
+    vocabulary = (
+        "the bot server level voice channel message hello thanks everyone tonight game "
+        "quiz fight suggestion anniversary salut merci demain ça été très bien"
+    ).split()
+    unicode_emojis = ["😀", "👍", "❤️", "🎉", "👍🏽", "👨‍👩‍👧‍👦", "🇨🇦", "🏳️‍🌈", "1️⃣", "🔥"]
+    custom_emojis = ["<:pepe:123456789012345678>", "<a:dance:876543210987654321>"]
+
+    def build(count, emoji_rate, custom_rate):
+        messages = []
+        for _ in range(count):
+            tokens = []
+            for _ in range(random.randint(1, 30)):
+                roll = random.random()
+                if roll < custom_rate:
+                    tokens.append(random.choice(custom_emojis))
+                elif roll < custom_rate + emoji_rate:
+                    tokens.append(random.choice(unicode_emojis))
+                else:
+                    tokens.append(random.choice(vocabulary))
+            messages.append(" ".join(tokens))
+        return messages
+
+    corpora = {
+        "plain text": build(2000, 0.0, 0.0),
+        "some emojis": build(2000, 0.05, 0.02),
+        "emoji heavy": build(2000, 0.4, 0.1),
+    }
+    for name, corpus in corpora.items():
+        legacy = timeit.timeit(lambda: [legacy_count(msg) for msg in corpus], number=5)
+        current = timeit.timeit(lambda: [count_message(msg) for msg in corpus], number=5)
+        per_message = 1e6 / (len(corpus) * 5)
+        print(
+            f"{name:<12} legacy {legacy * per_message:8.2f} µs/msg   "
+            f"count_message {current * per_message:8.2f} µs/msg   x{legacy / current:.1f}"
+        )
+
+    for sample in ("hi 👨‍👩‍👧‍👦 and 👍🏽 from 🇨🇦", "gg <:pepe:123456789012345678> 1️⃣", "plain text"):
+        print(f"{sample!r}: legacy {legacy_count(sample)}, count_message {count_message(sample)}")